@@ -0,0 +1,164 @@
+import contextlib
+import inspect
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows: peak memory is not reported
+    resource = None
+
+from NetworkFlowMeter.Cache import extractorFingerprint
+from NetworkFlowMeter.Comprehensive import pcap2csv
+from NetworkFlowMeter.Feature import FeatureExtractor
+from NetworkFlowMeter.IO import expandCaptures, captureFormat, iterRecordTs, FeatureWriter
+from NetworkFlowMeter.NetworkTyping import Optional, Union, Any, Iterable, List, Tuple, Dict, Features, FeatureSet
+
+
+def jobSettings(kwargs: Dict[str, Any], extractors: List[FeatureExtractor]) -> str:
+    """
+    Keyword arguments of pcap2csv (functions by qualified name) and fingerprints of the feature extractors as text,
+    so that runs can be compared
+    """
+    settings = {name: f'{value.__module__}.{value.__qualname__}' if inspect.isfunction(value) else value
+                for name, value in kwargs.items()}
+    settings['Feature Extractors'] = [extractorFingerprint(extractor) for extractor in extractors]
+    return json.dumps(settings, sort_keys=True, default=str)
+
+
+def settingsPath(csvPath: Path) -> Path:
+    return csvPath.with_suffix('.settings')
+
+
+def outputUpToDate(capturePath: Path, csvPath: Path, settings: str) -> bool:
+    """The CSV file exists, is newer than its capture, and was extracted with the same settings"""
+    if not csvPath.exists() or csvPath.stat().st_mtime < capturePath.stat().st_mtime:
+        return False
+    try:
+        return settingsPath(csvPath).read_text() == settings
+    except FileNotFoundError:
+        return False
+
+
+def outputPath(capturePath: Path, captureRoot: Path, outputDir: Path) -> Path:
+    """CSV path of a capture in outputDir, keeping its path relative to captureRoot, so that same-named
+    captures of different folders do not collide"""
+    return (outputDir / capturePath.relative_to(captureRoot)).with_suffix('.csv')
+
+
+def countPackets(capturePath: Path) -> Optional[int]:
+    """Number of packet records, from the record headers; None if the format is unknown"""
+    if captureFormat(capturePath) is None:
+        return None
+    return sum(1 for _ in iterRecordTs(capturePath))
+
+
+def peakMemory() -> Optional[float]:
+    """Peak resident memory of this process in MB"""
+    if resource is None:
+        return None
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def runJob(job: Tuple[Path, Path, Dict[str, Any], List[FeatureExtractor], str]) -> Features:
+    """
+    Pool worker: extract one capture into its CSV file, with the output redirected to '<csv>.log',
+    and its settings saved to '<csv>.settings'
+    :param job: (capture path, CSV path, keyword arguments of pcap2csv, feature extractors, settings)
+    :return: summary row
+    """
+    capturePath, csvPath, kwargs, extractors, settings = job
+    # a spawned worker re-imports the package, which enables the built-in extractors again
+    FeatureExtractor.extractors = list(extractors)
+    summary = {'Capture': str(capturePath), 'CSV': str(csvPath), 'Status': 'Done',
+               'Size': capturePath.stat().st_size, 'Packets': None, 'Flows': None,
+               'Wall Time': None, 'Peak Memory': None}
+    csvPath.parent.mkdir(parents=True, exist_ok=True)
+    # a partial CSV file must not look up to date on the next run
+    settingsPath(csvPath).unlink(missing_ok=True)
+    startTime = time.perf_counter()
+    with open(csvPath.with_suffix('.log'), 'w') as logFile, contextlib.redirect_stdout(logFile):
+        try:
+            summary['Flows'] = pcap2csv(capturePath, csvPath, **kwargs)
+        except Exception as e:
+            traceback.print_exc(file=logFile)
+            summary['Status'] = f'Failed: {e!r}'
+            if csvPath.exists():
+                csvPath.unlink()
+    summary['Wall Time'] = time.perf_counter() - startTime
+    # the job process is fresh (spawned, one task per child), so its peak is the one of this job
+    summary['Peak Memory'] = peakMemory()
+    if summary['Status'] == 'Done':
+        settingsPath(csvPath).write_text(settings)
+        # outside the timed section
+        summary['Packets'] = countPackets(capturePath)
+    return summary
+
+
+def batchPcap2csv(captures: Union[str, Path, Iterable[Union[str, Path]]], outputDir=None,
+                  workers: Optional[int] = None, force: bool = False, summaryPath=None,
+                  **kwargs) -> FeatureSet:
+    """
+    Extract many captures non-interactively, one CSV file per capture.
+    Jobs run in a process pool (a freshly spawned process per job, so that peak memory is per job),
+    largest capture first to shorten the makespan; captures whose CSV file is up to date
+    (newer than the capture, and extracted with the same settings and feature extractors) are skipped.
+    The feature extractors enabled in this process are sent to every job
+    :param captures: files, directories, or glob patterns
+    :param outputDir: folder of CSV and log files, mirroring the folders of the captures below their common folder;
+                      if it is None, the folder of each capture
+    :param workers: number of processes; if it is None, the number of CPUs
+    :param force: extract captures even if their CSV files are up to date
+    :param summaryPath: summary CSV path; if it is None, 'summary.csv' in outputDir
+                        (or in the folder of the first capture)
+    :param kwargs: keyword arguments of pcap2csv, e.g., flowTimeout
+    :return: summary rows (Capture, CSV, Status, Size, Packets, Flows, Wall Time, Peak Memory)
+    """
+    capturePaths = expandCaptures(captures)
+    if len(capturePaths) == 0:
+        raise Exception(f'No capture is found in {captures}')
+    if outputDir is not None:
+        outputDir = Path(outputDir)
+        outputDir.mkdir(parents=True, exist_ok=True)
+    if summaryPath is None:
+        summaryPath = (capturePaths[0].parent if outputDir is None else outputDir) / 'summary.csv'
+
+    captureRoot = Path(os.path.commonpath([capturePath.resolve().parent for capturePath in capturePaths]))
+    # the extractors enabled in this process, sent to the workers with every job
+    extractors = list(FeatureExtractor.extractors)
+    settings = jobSettings(kwargs, extractors)
+
+    summaries: List[Features] = list()
+    jobs = list()
+    for capturePath in capturePaths:
+        if outputDir is None:
+            csvPath = capturePath.with_suffix('.csv')
+        else:
+            csvPath = outputPath(capturePath.resolve(), captureRoot, outputDir)
+        if not force and outputUpToDate(capturePath, csvPath, settings):
+            summaries.append({'Capture': str(capturePath), 'CSV': str(csvPath), 'Status': 'Skipped',
+                              'Size': capturePath.stat().st_size, 'Packets': None, 'Flows': None,
+                              'Wall Time': None, 'Peak Memory': None})
+            continue
+        jobs.append((capturePath, csvPath, kwargs, extractors, settings))
+    # largest first: long jobs start early instead of finishing last
+    jobs.sort(key=lambda job: job[0].stat().st_size, reverse=True)
+    print(f'{len(jobs)} Captures to Extract, {len(summaries)} Up to Date')
+
+    # spawned rather than forked: a forked child inherits the peak memory of the parent
+    with multiprocessing.get_context('spawn').Pool(workers, maxtasksperchild=1) as pool:
+        for i, summary in enumerate(pool.imap_unordered(runJob, jobs)):
+            print(f'[{i + 1}/{len(jobs)}] {summary["Status"]}: {summary["Capture"]} '
+                  f'({summary["Flows"]} Flows, {summary["Wall Time"]:.1f} s)')
+            summaries.append(summary)
+
+    with FeatureWriter(summaryPath) as writer:
+        writer.writeRows(summaries)
+    print(f'Summary Saved to {summaryPath}')
+    return summaries
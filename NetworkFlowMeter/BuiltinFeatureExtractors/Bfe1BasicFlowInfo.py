@@ -1,6 +1,7 @@
 from NetworkFlowMeter.Feature import FeatureExtractor
 from NetworkFlowMeter.Flow import Flow
 from NetworkFlowMeter.NetworkTyping import FeatureSet, Features
+from NetworkFlowMeter.Utils import ReadableTs
 
 
 class BasicFlowInfo(FeatureExtractor):
@@ -17,8 +18,9 @@ class BasicFlowInfo(FeatureExtractor):
             'Src Port': srcPort,
             'Dst IP': dstIp,
             'Dst Port': dstPort,
-            'Init Ts': flow.readableInitPacketTs(),
-            'Last Ts': flow.readableLastPacketTs(),
+            # formatted when they are written out
+            'Init Ts': ReadableTs(flow.initialPacketNs),
+            'Last Ts': ReadableTs(flow.lastPacketNs),
             'Ts': flow.initialPacketTs,
             'Duration': flow.duration(),
             'Mac Addr': set(),
@@ -1,6 +1,10 @@
-from NetworkFlowMeter.Feature import FeatureExtractor, addBidirFlowMathChar2Features, addBidirFlowCountSpeed2features
+import numpy as np
+
+from NetworkFlowMeter.Columnar import ColumnSpec, FlowColumns
+from NetworkFlowMeter.Feature import FeatureExtractor, addBidirFlowMathChar2Features, addBidirFlowCountSpeed2features, \
+    addCountSpeed2features, addBidirMathChar2Features
 from NetworkFlowMeter.Flow import Flow
-from NetworkFlowMeter.NetworkTyping import Features
+from NetworkFlowMeter.NetworkTyping import Collection, Features
 
 
 class PacketCounter(FeatureExtractor):
@@ -8,13 +12,34 @@ class PacketCounter(FeatureExtractor):
     Count the Number, the Speed and the Length of Forward and Backward Packets
     """
 
+    def __init__(self, enable=True, quantiles: Collection[float] = ()):
+        """
+        :param quantiles: packet length quantiles, e.g., (0.5, 0.95) => Pkt Len P50, Pkt Len P95
+        """
+        self.quantiles = tuple(quantiles)
+        super(PacketCounter, self).__init__(enable)
+
     def extract(self, flow: Flow) -> Features:
         features = dict()
-        addBidirFlowMathChar2Features(features, flow, 'Pkt Len', lambda p: p.frame_info.len)
+        addBidirFlowMathChar2Features(features, flow, 'Pkt Len', lambda p: p.frame_info.len,
+                                      quantiles=self.quantiles)
         addBidirFlowCountSpeed2features(features, flow, 'Pkt', len)
-        addBidirFlowCountSpeed2features(features, flow, 'Byte',
-                                        lambda pl: sum(float(p.frame_info.len) for p in pl))
+        # bytes are the packet length sums, so packets are not iterated again
+        addCountSpeed2features(features, 'Byte', features['Fwd Pkt Len Sum'], features['Bwd Pkt Len Sum'],
+                               flow.duration(f='s'))
+
+        return features
+
+    def packetColumns(self) -> ColumnSpec:
+        return {'frame_info.len': (np.float64, lambda flow, p: float(p.frame_info.len))}
 
+    def extractColumns(self, flow: FlowColumns) -> Features:
+        features = dict()
+        fwdLen, bwdLen = flow.forwardColumn('frame_info.len'), flow.backwardColumn('frame_info.len')
+        addBidirMathChar2Features(features, 'Pkt Len', fwdLen, bwdLen, quantiles=self.quantiles)
+        addCountSpeed2features(features, 'Pkt', len(fwdLen), len(bwdLen), flow.duration(f='s'))
+        addCountSpeed2features(features, 'Byte', features['Fwd Pkt Len Sum'], features['Bwd Pkt Len Sum'],
+                               flow.duration(f='s'))
         return features
 
 
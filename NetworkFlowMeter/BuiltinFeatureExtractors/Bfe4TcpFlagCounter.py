@@ -1,29 +1,53 @@
-from NetworkFlowMeter.Feature import FeatureExtractor, addBidirFlowCountSpeed2features
+import numpy as np
+
+from NetworkFlowMeter.Columnar import ColumnSpec, FlowColumns
+from NetworkFlowMeter.Feature import FeatureExtractor, addBidirFlowCountSpeed2features, addCountSpeed2features
 from NetworkFlowMeter.Flow import Flow
-from NetworkFlowMeter.NetworkTyping import Features
+from NetworkFlowMeter.NetworkTyping import Tuple, Features
+
+# feature name => field of the tcp layer
+tcpFlags = {
+    'Flag Ack': 'flags_ack',
+    'Flag Cwr': 'flags_cwr',
+    'Flag Ecn': 'flags_ecn',
+    'Flag Fin': 'flags_fin',
+    # NS Flag: Experimental, and May Not be Useful
+    'Flag Ns': 'flags_ns',
+    'Flag Push': 'flags_push',
+    'Flag Res': 'flags_res',
+    'Flag Reset': 'flags_reset',
+    'Flag Syn': 'flags_syn',
+    'Flag Urg': 'flags_urg',
+}
 
 
 class TcpFlagCounter(FeatureExtractor):
     def extract(self, flow: Flow) -> Features:
         features = dict()
-        flagDict = {
-            'Flag Ack': lambda p: p.tcp.flags_ack,
-            'Flag Cwr': lambda p: p.tcp.flags_cwr,
-            'Flag Ecn': lambda p: p.tcp.flags_ecn,
-            'Flag Fin': lambda p: p.tcp.flags_fin,
-            # NS Flag: Experimental, and May Not be Useful
-            'Flag Ns': lambda p: p.tcp.flags_ns,
-            'Flag Push': lambda p: p.tcp.flags_push,
-            'Flag Res': lambda p: p.tcp.flags_res,
-            'Flag Reset': lambda p: p.tcp.flags_reset,
-            'Flag Syn': lambda p: p.tcp.flags_syn,
-            'Flag Urg': lambda p: p.tcp.flags_urg,
-        }
-        for flagName, flagExtractor in flagDict.items():
+        for flagName, field in tcpFlags.items():
             addBidirFlowCountSpeed2features(features, flow, flagName,
-                                            lambda pl: sum([float(flagExtractor(p)) for p in pl
+                                            lambda pl: sum([float(getattr(p.tcp, field)) for p in pl
                                                             if flow.protocol() == 'TCP']))
         return features
 
+    def packetColumns(self) -> ColumnSpec:
+        # one column of all flags; flags of packets in other flows are 0, as they are not counted
+        return {'tcp.flags': ((np.uint8, len(tcpFlags)), self.packetFlags)}
+
+    @staticmethod
+    def packetFlags(flow: Flow, p) -> Tuple[int, ...]:
+        if flow.protocol() != 'TCP':
+            return (0,) * len(tcpFlags)
+        return tuple(int(float(getattr(p.tcp, field))) for field in tcpFlags.values())
+
+    def extractColumns(self, flow: FlowColumns) -> Features:
+        features = dict()
+        fwdCounts = flow.forwardColumn('tcp.flags').sum(axis=0).tolist()
+        bwdCounts = flow.backwardColumn('tcp.flags').sum(axis=0).tolist()
+        duration = flow.duration(f='s')
+        for flagName, fwdCount, bwdCount in zip(tcpFlags, fwdCounts, bwdCounts):
+            addCountSpeed2features(features, flagName, fwdCount, bwdCount, duration)
+        return features
+
 
 TcpFlagCounter()
@@ -1,15 +1,29 @@
-from NetworkFlowMeter.Feature import FeatureExtractor, addBidirFlowMathChar2Features
+from NetworkFlowMeter.Columnar import FlowColumns
+from NetworkFlowMeter.Feature import FeatureExtractor, addBidirFlowMathChar2Features, addBidirMathChar2Features
 from NetworkFlowMeter.Flow import Flow
-from NetworkFlowMeter.NetworkTyping import Features
-from NetworkFlowMeter.Utils import packetTs
+from NetworkFlowMeter.Kernels import packetNanoseconds, firstDifferences
+from NetworkFlowMeter.NetworkTyping import Collection, Features
 
 
 class InterArrivalTime(FeatureExtractor):
+    def __init__(self, enable=True, quantiles: Collection[float] = ()):
+        """
+        :param quantiles: IAT quantiles, e.g., (0.5, 0.95) => IAT P50, IAT P95
+        """
+        self.quantiles = tuple(quantiles)
+        super(InterArrivalTime, self).__init__(enable)
+
     def extract(self, flow: Flow) -> Features:
         features = dict()
         addBidirFlowMathChar2Features(features, flow, 'IAT',
-                                      pktListOperator=lambda pl: [packetTs(pl[i]) - packetTs(pl[i-1])
-                                                                  for i in range(1, len(pl))])
+                                      pktListOperator=lambda pl: firstDifferences(packetNanoseconds(pl)) / 1e9,
+                                      quantiles=self.quantiles)
+        return features
+
+    def extractColumns(self, flow: FlowColumns) -> Features:
+        features = dict()
+        addBidirMathChar2Features(features, 'IAT', firstDifferences(flow.forwardColumn('Ns')) / 1e9,
+                                  firstDifferences(flow.backwardColumn('Ns')) / 1e9, quantiles=self.quantiles)
         return features
 
 
@@ -0,0 +1,180 @@
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+from functools import lru_cache
+from pathlib import Path
+
+from NetworkFlowMeter.Feature import FeatureExtractor
+from NetworkFlowMeter.Flow import Flow, iterPackets2flows
+from NetworkFlowMeter.Session import SessionExtractor, defaultBidirectionalSessionExtractor
+from NetworkFlowMeter.NetworkTyping import Callable, Optional, AnyStr, Any, Iterable, Iterator, List, Tuple, Dict, \
+    Packet, Features, FeatureSet
+
+
+def fileHash(filepath, chunkSize: int = 1 << 20) -> AnyStr:
+    """SHA-256 of the file content"""
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunkSize), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def capturesHash(filepaths: Iterable) -> AnyStr:
+    """Content hash of one or several (merged) captures, independent of their paths"""
+    sha = hashlib.sha256()
+    for filepath in filepaths:
+        sha.update(fileHash(filepath).encode())
+    return sha.hexdigest()
+
+
+def _fingerprint(*items: Any) -> AnyStr:
+    return hashlib.sha256(repr(items).encode()).hexdigest()
+
+
+def _callableName(f: Optional[Callable]) -> AnyStr:
+    if f is None:
+        return 'None'
+    return f'{getattr(f, "__module__", "")}.{getattr(f, "__qualname__", repr(f))}'
+
+
+def _source(o: Any) -> AnyStr:
+    try:
+        return inspect.getsource(o)
+    except (OSError, TypeError):
+        return ''
+
+
+# modules shared by every extractor (flow generation, feature helpers and kernels, timestamps)
+coreModules = ('NetworkFlowMeter.NetworkTyping', 'NetworkFlowMeter.Utils', 'NetworkFlowMeter.Session',
+               'NetworkFlowMeter.Flow', 'NetworkFlowMeter.Kernels', 'NetworkFlowMeter.Quantile',
+               'NetworkFlowMeter.Columnar', 'NetworkFlowMeter.Feature')
+
+
+@lru_cache(maxsize=None)
+def coreFingerprint() -> AnyStr:
+    """Source hash of the core modules, so that changing shared code invalidates every cached column"""
+    return _fingerprint(*(_source(sys.modules[module]) for module in coreModules))
+
+
+def sessionExtractorFingerprint(sessionExtractor: Optional[Callable]) -> AnyStr:
+    """A compiled session extractor is identified by its spec, a function by its name and its source"""
+    if sessionExtractor is None:
+        sessionExtractor = defaultBidirectionalSessionExtractor
+    if isinstance(sessionExtractor, SessionExtractor):
+        return repr(sessionExtractor)
+    return _fingerprint(_callableName(sessionExtractor), _source(sessionExtractor))
+
+
+def extractorFingerprint(extractor: FeatureExtractor) -> AnyStr:
+    """
+    Fingerprint of an extractor: its class, the source code of its module, its parameters (instance attributes)
+    and the core modules, so that changing the implementation, its helpers or the parameters
+    invalidates its cached columns
+    """
+    cls = extractor.__class__
+    source = _source(sys.modules.get(cls.__module__)) or _source(cls)
+    parameters = sorted((k, repr(v)) for k, v in vars(extractor).items() if k != 'featureNames')
+    return _fingerprint(cls.__module__, cls.__qualname__, source, parameters, coreFingerprint())
+
+
+class ResultCache(object):
+    """
+    Content-addressed cache of feature columns.
+    An entry is keyed by the capture content hash and the flow generation settings
+    (direction, session extractor, timeouts); inside an entry every extractor's columns are stored
+    separately under the extractor fingerprint, so that enabling a new extractor only computes its columns.
+    Files are evicted in least-recently-used order once the cache exceeds maxBytes
+    """
+    # default cache size limit (bytes)
+    defaultMaxBytes = 1 << 30
+
+    def __init__(self, cacheDir, maxBytes: Optional[int] = None):
+        self.cacheDir = Path(cacheDir)
+        self.cacheDir.mkdir(parents=True, exist_ok=True)
+        self.maxBytes = self.defaultMaxBytes if maxBytes is None else maxBytes
+        self.hits, self.misses = 0, 0
+
+    def entryDir(self, captureHash: AnyStr, direction: AnyStr,
+                 sessionExtractor: Optional[Callable], flowTimeout, activityTimeout) -> Path:
+        runFingerprint = _fingerprint(direction, sessionExtractorFingerprint(sessionExtractor), float(flowTimeout),
+                                      float(activityTimeout), coreFingerprint())
+        return self.cacheDir / f'{captureHash[:32]}-{runFingerprint[:16]}'
+
+    def load(self, entryDir: Path, extractor: FeatureExtractor) -> Optional[FeatureSet]:
+        columnsPath = entryDir / f'{extractorFingerprint(extractor)[:32]}.pkl'
+        try:
+            with open(columnsPath, 'rb') as columnsFile:
+                columns = pickle.load(columnsFile)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        # mark as recently used
+        os.utime(columnsPath)
+        self.hits += 1
+        return columns
+
+    def store(self, entryDir: Path, extractor: FeatureExtractor, columns: FeatureSet):
+        entryDir.mkdir(parents=True, exist_ok=True)
+        columnsPath = entryDir / f'{extractorFingerprint(extractor)[:32]}.pkl'
+        # write then rename, so that an interrupted run never leaves a truncated entry
+        tmpPath = columnsPath.with_suffix('.tmp')
+        with open(tmpPath, 'wb') as columnsFile:
+            pickle.dump(columns, columnsFile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, columnsPath)
+
+    def size(self) -> int:
+        return sum(p.stat().st_size for p in self.cacheDir.glob('*/*.pkl'))
+
+    def evict(self):
+        """Remove least recently used columns until the cache fits into maxBytes"""
+        files = [(p.stat().st_mtime, p.stat().st_size, p) for p in self.cacheDir.glob('*/*.pkl')]
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, p in files:
+            if total <= self.maxBytes:
+                break
+            p.unlink()
+            total -= size
+            if not any(p.parent.iterdir()):
+                p.parent.rmdir()
+
+    def features(self, captures: List, packetsFactory: Callable[[], Iterable[Packet]],
+                 direction: AnyStr = 'bidirectional',
+                 sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
+                 flowTimeout=Flow.defaultFlowTimeout,
+                 activityTimeout=Flow.defaultActivityTimeout) -> Iterator[Features]:
+        """
+        Features of the enabled extractors, in the order flows are finished (as iterPackets2features).
+        Packets are only decoded if some extractor's columns are missing
+        :param captures: capture file paths
+        :param packetsFactory: return the packets of the captures
+        :param direction: unidirectional or bidirectional
+        :param sessionExtractor: session extractor
+        :param flowTimeout: flow timeout in microseconds
+        :param activityTimeout: activity timeout in microseconds
+        :return: features
+        """
+        entryDir = self.entryDir(capturesHash(captures), direction, sessionExtractor, flowTimeout, activityTimeout)
+        extractors = list(FeatureExtractor.extractors)
+        columns: Dict[FeatureExtractor, Optional[FeatureSet]] = {e: self.load(entryDir, e) for e in extractors}
+        missing = [e for e in extractors if columns[e] is None]
+        if len(missing) != 0:
+            for e in missing:
+                columns[e] = list()
+            for flow in iterPackets2flows(packetsFactory(), direction, sessionExtractor,
+                                          flowTimeout, activityTimeout):
+                for e in missing:
+                    columns[e].append(e.extract(flow))
+            for e in missing:
+                self.store(entryDir, e, columns[e])
+            self.evict()
+        rows = len(columns[extractors[0]]) if len(extractors) != 0 else 0
+        for i in range(rows):
+            # same merge as flow2feature
+            features = dict()
+            for e in extractors:
+                features.update(columns[e][i])
+            yield features
@@ -0,0 +1,387 @@
+import gzip
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+from NetworkFlowMeter.Dedup import FrameDeduplicator
+from NetworkFlowMeter.Feature import flow2feature
+from NetworkFlowMeter.Filter import sliceCaptureRecords
+from NetworkFlowMeter.Flow import Flow, FlowTable
+from NetworkFlowMeter.IO import iterPackets, mergePacketStreams, captureFormat, iterRecordTs, firstPacketTs
+from NetworkFlowMeter.NetworkTyping import Callable, Optional, Collection, AnyStr, Any, Iterator, List, Tuple, \
+    Dict, Packet, Features
+from NetworkFlowMeter.Utils import progress, packetTsNanoseconds
+
+# (capture index, frame number) of a packet
+FramePosition = Tuple[int, int]
+
+# layer => fields identifying a PDU that tshark reassembles across frames (fragmented datagrams, segmented streams)
+pduKeyFields = {
+    'ip': ('src', 'dst', 'id'),
+    'ipv6': ('src', 'dst', 'fraghdr_ident'),
+    '6lowpan': ('frag_tag', 'frag_size'),
+    'tcp': ('stream',),
+}
+
+
+class Checkpoint(object):
+    """
+    Compact on-disk snapshot (gzip pickle) of a long-running extraction:
+    the reader position (frames consumed per capture), the alive flows as the frame positions of their packets
+    (they are re-read on resume, so packets are not pickled), the decoded fields of the alive frames
+    which tshark reassembled with other frames (see DecodedPacket), and the position of the row journal.
+    Snapshots are written to a temporary file and renamed, so a crash never leaves a broken checkpoint
+    """
+
+    def __init__(self, checkpointPath):
+        self.checkpointPath = Path(checkpointPath)
+
+    def exists(self) -> bool:
+        return self.checkpointPath.exists()
+
+    def save(self, state: Dict[AnyStr, Any]):
+        tmpPath = self.checkpointPath.with_suffix('.tmp')
+        with gzip.open(tmpPath, 'wb', compresslevel=1) as checkpointFile:
+            pickle.dump(state, checkpointFile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, self.checkpointPath)
+
+    def load(self) -> Dict[AnyStr, Any]:
+        with gzip.open(self.checkpointPath, 'rb') as checkpointFile:
+            return pickle.load(checkpointFile)
+
+    def remove(self):
+        if self.checkpointPath.exists():
+            self.checkpointPath.unlink()
+
+
+class DecodedLayer(object):
+    """The decoded fields of a layer as strings, read like the ones of pyshark (get_field, attributes)"""
+
+    def __init__(self, layer):
+        self.layer_name = layer.layer_name
+        self.fields: Dict[AnyStr, AnyStr] = {field: str(layer.get_field(field)) for field in layer.field_names}
+
+    @property
+    def field_names(self) -> List[AnyStr]:
+        return list(self.fields)
+
+    def get_field(self, name: AnyStr) -> Optional[AnyStr]:
+        return self.fields.get(name)
+
+    def __getattr__(self, name):
+        fields = self.__dict__.get('fields', dict())
+        if name not in fields:
+            raise AttributeError(name)
+        return fields[name]
+
+
+class DecodedPacket(object):
+    """
+    Picklable copy of the decoded layers of a packet, for frames which cannot be decoded again on their own:
+    a frame completing a reassembled PDU only has its upper layers when tshark has read the other parts before
+    """
+
+    def __init__(self, p: Packet):
+        self.sniff_timestamp = str(p.sniff_timestamp)
+        self.frame_info = DecodedLayer(p.frame_info)
+        self.layers = [DecodedLayer(layer) for layer in p.layers]
+
+    def __contains__(self, layerName: AnyStr) -> bool:
+        return any(layer.layer_name.lower() == layerName.lower() for layer in self.layers)
+
+    def __getitem__(self, layerName: AnyStr) -> DecodedLayer:
+        for layer in self.layers:
+            if layer.layer_name.lower() == layerName.lower():
+                return layer
+        raise KeyError(layerName)
+
+    def __getattr__(self, name):
+        # the outermost layer of the name, as p.<layer> of pyshark
+        for layer in self.__dict__.get('layers', list()):
+            if layer.layer_name.lower() == name.lower():
+                return layer
+        raise AttributeError(name)
+
+
+def _pduParts(p: Packet) -> Iterator[Tuple[Tuple, bool]]:
+    """
+    Parts of PDUs reassembled by tshark which the frame carries (IP/IPv6/6LoWPAN fragments, TCP segments)
+    :return: (PDU key, whether the PDU is still incomplete after this frame)
+    """
+    for layer in p.layers:
+        layerName = layer.layer_name
+        if layerName not in pduKeyFields:
+            continue
+        fieldNames = layer.field_names
+        if layerName == 'ip':
+            incomplete = str(layer.get_field('flags_mf')) in ('1', 'True')
+        elif layerName == 'ipv6':
+            incomplete = str(layer.get_field('fraghdr_more')) in ('1', 'True')
+        else:
+            incomplete = 'frag_tag' in fieldNames or 'segment_data' in fieldNames
+        complete = 'reassembled_length' in fieldNames
+        if incomplete or complete:
+            key = (layerName,) + tuple(str(layer.get_field(field)) for field in pduKeyFields.get(layerName, ()))
+            yield key, incomplete and not complete
+
+
+def _capturesFingerprint(captures: List[Path], direction, flowTimeout, activityTimeout,
+                        displayFilter: Optional[AnyStr], deduplicator: Optional[FrameDeduplicator]) -> Tuple:
+    """Resuming is refused if the inputs or the settings have changed since the checkpoint"""
+    files = tuple((str(c), c.stat().st_size, c.stat().st_mtime_ns) for c in captures)
+    dedup = None if deduplicator is None else \
+        (deduplicator.window, deduplicator.capacity, sorted(deduplicator.fingerprintFields.items()))
+    return files, direction, float(flowTimeout), float(activityTimeout), displayFilter, dedup
+
+
+def _iterJournal(journalPath) -> Iterator[Features]:
+    with open(journalPath, 'rb') as journal:
+        while True:
+            try:
+                yield pickle.load(journal)
+            except EOFError:
+                return
+
+
+def _findRecords(filepath, frameNumbers: Collection[int]) -> Tuple[int, Dict[int, Tuple[float, int, int]]]:
+    """
+    Locate records from the record headers, without decoding
+    :param filepath: PCAP/PCAPNG file path
+    :param frameNumbers: frame numbers (1-based)
+    :return: (bytes before the first record, frame number => (timestamp in seconds, start offset, end offset))
+    """
+    wanted, records = set(frameNumbers), dict()
+    headerEnd, fileSize, last = None, Path(filepath).stat().st_size, max(frameNumbers, default=0)
+    # a record ends where the next one starts
+    previous = None
+    for frameNumber, (ts, offset) in enumerate(iterRecordTs(filepath), 1):
+        if headerEnd is None:
+            headerEnd = offset
+        if previous is not None:
+            records[previous[0]] = previous[1:] + (offset,)
+            previous = None
+        if frameNumber > last:
+            break
+        if frameNumber in wanted:
+            previous = (frameNumber, ts, offset)
+    if previous is not None:
+        records[previous[0]] = previous[1:] + (fileSize,)
+    return fileSize if headerEnd is None else headerEnd, records
+
+
+def _andFilter(displayFilter: Optional[AnyStr], condition: AnyStr) -> AnyStr:
+    return condition if displayFilter is None else f'({displayFilter}) && ({condition})'
+
+
+class _CaptureReader(object):
+    """
+    Read captures from given positions, tagging every packet with its frame position.
+    PCAP/PCAPNG captures are sliced at the byte offset of the next frame (found from the record headers),
+    so consumed frames are neither decoded nor filtered again; other formats are filtered by frame number
+    """
+
+    def __init__(self, captures: List[Path], displayFilter: Optional[AnyStr], tmpDir: Path):
+        self.captures, self.displayFilter, self.tmpDir = captures, displayFilter, tmpDir
+
+    def _iterTagged(self, captureIndex: int, filepath, base: int, displayFilter: Optional[AnyStr]) -> Iterator[Packet]:
+        for p in iterPackets(filepath, displayFilter):
+            p.framePosition = (captureIndex, base + int(p.frame_info.number))
+            yield p
+
+    def stream(self, captureIndex: int, consumed: int) -> Optional[Tuple[float, Callable[[], Iterator[Packet]]]]:
+        """
+        :return: (first packet ts, opener) of the frames after the consumed ones; None if none is left
+        """
+        capture = self.captures[captureIndex]
+        if captureFormat(capture) is None:
+            ts = firstPacketTs(capture)
+            displayFilter = self.displayFilter if consumed == 0 else \
+                _andFilter(self.displayFilter, f'frame.number > {consumed}')
+            return None if ts is None else \
+                (ts, lambda: self._iterTagged(captureIndex, capture, 0, displayFilter))
+        headerEnd, records = _findRecords(capture, [consumed + 1])
+        if consumed + 1 not in records:
+            return None
+        ts, startOffset, _ = records[consumed + 1]
+        if consumed == 0:
+            return ts, lambda: self._iterTagged(captureIndex, capture, 0, self.displayFilter)
+
+        def openSlice():
+            # the remaining records are copied once the merge reaches them
+            slicePath = self.tmpDir / f'{captureIndex}-{consumed}{capture.suffix}'
+            sliceCaptureRecords(capture, slicePath, [(startOffset, capture.stat().st_size)], headerEnd)
+            return self._iterTagged(captureIndex, slicePath, consumed, self.displayFilter)
+        return ts, openSlice
+
+    def packets(self, positions: List[int]) -> Iterator[Packet]:
+        """Packets after the consumed frames (positions[i] of capture i), merged by timestamp"""
+        streams = [self.stream(i, consumed) for i, consumed in enumerate(positions)]
+        return mergePacketStreams([stream for stream in streams if stream is not None])
+
+    def frames(self, framePositions: Collection[FramePosition]) -> Dict[FramePosition, Packet]:
+        """Re-read the given frames: only their records are copied into temporary captures and decoded"""
+        byCapture: Dict[int, List[int]] = dict()
+        for captureIndex, frameNumber in framePositions:
+            byCapture.setdefault(captureIndex, list()).append(frameNumber)
+        packets = dict()
+        for captureIndex, frameNumbers in byCapture.items():
+            capture, frameNumbers = self.captures[captureIndex], sorted(set(frameNumbers))
+            if captureFormat(capture) is None:
+                frameFilter = f'frame.number in {{{" ".join(str(n) for n in frameNumbers)}}}'
+                for p in self._iterTagged(captureIndex, capture, 0, frameFilter):
+                    packets[p.framePosition] = p
+                continue
+            headerEnd, records = _findRecords(capture, frameNumbers)
+            slicePath = self.tmpDir / f'{captureIndex}-frames{capture.suffix}'
+            sliceCaptureRecords(capture, slicePath, [records[n][1:] for n in frameNumbers], headerEnd)
+            for frameNumber, p in zip(frameNumbers, iterPackets(slicePath)):
+                p.framePosition = (captureIndex, frameNumber)
+                packets[p.framePosition] = p
+        return packets
+
+
+def _restoreFlowTable(state: Dict[AnyStr, Any], reader: _CaptureReader, direction: AnyStr,
+                      sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]]) -> FlowTable:
+    """
+    Rebuild the alive flows in the saved order of the flow table:
+    reassembled frames from their decoded copies, the other ones by re-reading them
+    """
+    flowTable = FlowTable(direction, sessionExtractor)
+    flowTable.packets = state['packets']
+    decodedFrames: Dict[FramePosition, DecodedPacket] = state['decodedFrames']
+    packets = reader.frames([position for _, positions in state['aliveFlows'] for position in positions
+                             if position not in decodedFrames])
+    for position, p in decodedFrames.items():
+        p.framePosition, p.reassembled = position, True
+        packets[position] = p
+    mismatches = 0
+    for sessionKey, positions in state['aliveFlows']:
+        flowPackets = [packets[position] for position in positions]
+        for p in flowPackets:
+            p.reassembled = getattr(p, 'reassembled', False)
+            packetSessionKey, p.pDirection = flowTable.sessionExtractor(p)
+            mismatches += packetSessionKey != sessionKey
+        flow = flowTable.newFlow(sessionKey, flowPackets[0])
+        for p in flowPackets[1:]:
+            flow.add(p)
+    if mismatches != 0:
+        print(f'Warning: {mismatches} Frames of Alive Flows Were Decoded Differently on Resume')
+    return flowTable
+
+
+def iterCheckpointedFeatures(captures: List[Path], checkpointPath, journalPath=None,
+                             checkpointInterval: int = 100000, resume: bool = False,
+                             direction: AnyStr = 'bidirectional',
+                             sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
+                             flowTimeout=Flow.defaultFlowTimeout,
+                             activityTimeout=Flow.defaultActivityTimeout,
+                             displayFilter: Optional[AnyStr] = None,
+                             deduplicator: Optional[FrameDeduplicator] = None) -> Iterator[Features]:
+    """
+    Generate features with periodic checkpoints.
+    Finished rows are appended to a journal; every checkpointInterval frames the journal is synced
+    and the checkpoint records the journal position together with the reader position and the alive flows.
+    On resume, the journal is truncated to the recorded position, the alive flows are rebuilt from their frames,
+    and the reader seeks past the consumed frames.
+    Positions are the frame numbers of the packets themselves, so frames dropped by the display filter
+    or the deduplicator do not shift them.
+    Frames are decoded again without the frames before them, which matters where tshark reassembles PDUs
+    (IP/IPv6/6LoWPAN fragments, TCP segments): alive frames carrying parts of a PDU are saved decoded,
+    and checkpoints are deferred (by up to checkpointInterval frames) until no PDU is partly consumed;
+    a checkpoint which cannot be deferred any longer is taken with a warning.
+    Then the rows are identical to an uninterrupted run, except for fields that tshark computes per capture
+    (e.g., TCP stream indexes, relative sequence numbers, analysis flags), which are not read by the built-in
+    extractors
+    :param captures: capture file paths (several captures are merged by timestamp)
+    :param checkpointPath: checkpoint file path
+    :param journalPath: row journal path; if it is None, '<checkpoint>.journal'
+    :param checkpointInterval: frames between checkpoints
+    :param resume: restart from the last checkpoint if there is one
+    :param direction: unidirectional or bidirectional
+    :param sessionExtractor: session extractor
+    :param flowTimeout: flow timeout in microseconds
+    :param activityTimeout: activity timeout in microseconds
+    :param displayFilter: wireshark display filter applied by tshark
+    :param deduplicator: if it is not None, duplicate frames are dropped (its window is saved in the checkpoint)
+    :return: features, in the order flows are finished
+    """
+    checkpoint = Checkpoint(checkpointPath)
+    journalPath = Path(checkpointPath).with_suffix('.journal') if journalPath is None else Path(journalPath)
+    fingerprint = _capturesFingerprint(captures, direction, flowTimeout, activityTimeout, displayFilter, deduplicator)
+    Flow.defaultFlowTimeout, Flow.defaultActivityTimeout = flowTimeout, activityTimeout
+
+    with tempfile.TemporaryDirectory(prefix='NetworkFlowMeter-') as tmpDir:
+        reader = _CaptureReader(captures, displayFilter, Path(tmpDir))
+        if resume and checkpoint.exists():
+            state = checkpoint.load()
+            if state['fingerprint'] != fingerprint:
+                raise Exception(f'{checkpointPath} was created for other captures or settings')
+            positions: List[int] = state['positions']
+            flowTable = _restoreFlowTable(state, reader, direction, sessionExtractor)
+            if deduplicator is not None:
+                deduplicator.__dict__.update(state['deduplicator'].__dict__)
+            journal = open(journalPath, 'r+b')
+            journal.truncate(state['journalOffset'])
+            journal.seek(state['journalOffset'])
+            print(f'Resuming from Frame {sum(positions)} ({len(flowTable)} Alive Flows)')
+        else:
+            positions = [0] * len(captures)
+            flowTable = FlowTable(direction, sessionExtractor)
+            journal = open(journalPath, 'wb')
+
+        with journal:
+            frames = sum(positions)
+            nextCheckpoint = (frames // checkpointInterval + 1) * checkpointInterval
+            # PDU key => ts (nanoseconds) of its last part, for PDUs which later frames complete
+            openPdus: Dict[Tuple, int] = dict()
+            for p in progress(reader.packets(positions)):
+                captureIndex, frameNumber = p.framePosition
+                positions[captureIndex] = frameNumber
+                frames += 1
+                p.reassembled = False
+                for key, incomplete in _pduParts(p):
+                    p.reassembled = True
+                    if incomplete:
+                        openPdus[key] = packetTsNanoseconds(p)
+                    else:
+                        openPdus.pop(key, None)
+                if deduplicator is None or not deduplicator.duplicate(p):
+                    finishedFlow = flowTable.add(p)
+                    if finishedFlow is not None:
+                        pickle.dump(flow2feature(finishedFlow), journal, protocol=pickle.HIGHEST_PROTOCOL)
+                if frames < nextCheckpoint:
+                    continue
+                # the missing parts of a PDU idle for a flow timeout are lost
+                oldestNs = packetTsNanoseconds(p) - flowTimeout * 1000
+                for key in [key for key, ns in openPdus.items() if ns < oldestNs]:
+                    del openPdus[key]
+                if len(openPdus) != 0:
+                    if frames < nextCheckpoint + checkpointInterval:
+                        continue
+                    print(f'Warning: Checkpoint at Frame {frames} Splits {len(openPdus)} Reassembled PDUs, '
+                          f'Which May Be Decoded Differently on Resume')
+                nextCheckpoint = frames + checkpointInterval
+                journal.flush()
+                os.fsync(journal.fileno())
+                aliveFlows = [(sessionKey, [packet.framePosition for packet in flow.packets])
+                              for sessionKey, flow in flowTable.aliveFlows.items()]
+                decodedFrames = {packet.framePosition: DecodedPacket(packet)
+                                 for flow in flowTable.aliveFlows.values() for packet in flow.packets
+                                 if packet.reassembled}
+                checkpoint.save({'fingerprint': fingerprint, 'positions': positions,
+                                 'packets': flowTable.packets, 'aliveFlows': aliveFlows,
+                                 'decodedFrames': decodedFrames,
+                                 'deduplicator': deduplicator, 'journalOffset': journal.tell()})
+            # flush alive flows to flows
+            for aliveFlow in flowTable.flush():
+                pickle.dump(flow2feature(aliveFlow), journal, protocol=pickle.HIGHEST_PROTOCOL)
+    yield from _iterJournal(journalPath)
+
+
+def removeCheckpoint(checkpointPath, journalPath=None):
+    """Remove the checkpoint and its journal once the output is complete"""
+    Checkpoint(checkpointPath).remove()
+    journalPath = Path(checkpointPath).with_suffix('.journal') if journalPath is None else Path(journalPath)
+    if journalPath.exists():
+        journalPath.unlink()
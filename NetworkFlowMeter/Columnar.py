@@ -0,0 +1,240 @@
+import math
+import os
+import sys
+from multiprocessing import Pool, resource_tracker, shared_memory
+
+import numpy as np
+
+from NetworkFlowMeter.Flow import Flow
+from NetworkFlowMeter.NetworkTyping import Callable, Optional, AnyStr, Any, List, Tuple, Dict, Packet, Flows, \
+    Features
+from NetworkFlowMeter.Utils import packetTsNanoseconds
+
+# packet columns requested by a feature extractor: name => (dtype, getter(flow, packet));
+# a sub-array dtype, e.g., (np.uint8, 10), makes a 2-D column (the getter returns a tuple)
+ColumnSpec = Dict[AnyStr, Tuple[Any, Callable[[Flow, Packet], Any]]]
+
+
+def attachSharedMemory(name: AnyStr) -> shared_memory.SharedMemory:
+    """
+    Attach to an existing shared memory block without registering it with the resource tracker:
+    the creator owns the block (it registers and unlinks it), and a registration by an attaching process
+    would make its tracker unlink the block (or warn about a leak) when that process exits
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # before 3.13, attaching always registers; the registration is skipped rather than undone afterwards,
+    # as an unregister would also drop the creator's one when both use the same tracker (pool workers)
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedColumns(object):
+    """
+    Named numpy arrays laid out in one shared memory block.
+    Only the layout and the block name are pickled, so other processes attach to the same buffers without copying
+    """
+
+    def __init__(self, layout: List[Tuple[AnyStr, Any, Tuple[int, ...]]], name: Optional[AnyStr] = None):
+        """
+        :param layout: (name, dtype, shape) of the arrays
+        :param name: name of an existing block to attach to; if it is None, a new block is created
+        """
+        self.layout = [(columnName, np.dtype(dtype), tuple(shape)) for columnName, dtype, shape in layout]
+        sizes = [np.dtype(dtype).itemsize * math.prod(shape) for _, dtype, shape in self.layout]
+        # 8-byte aligned arrays
+        offsets = np.cumsum([0] + [(size + 7) // 8 * 8 for size in sizes]).tolist()
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=max(offsets[-1], 1))
+        else:
+            self.memory = attachSharedMemory(name)
+        self.columns: Dict[AnyStr, np.ndarray] = {
+            columnName: np.ndarray(shape, dtype, buffer=self.memory.buf, offset=offset)
+            for (columnName, dtype, shape), offset in zip(self.layout, offsets)}
+
+    def __getitem__(self, columnName: AnyStr) -> np.ndarray:
+        return self.columns[columnName]
+
+    def __getstate__(self):
+        return {'layout': self.layout, 'name': self.memory.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['layout'], state['name'])
+
+    def close(self):
+        # views must be released before the buffer is closed
+        self.columns = dict()
+        self.memory.close()
+
+    def unlink(self):
+        self.close()
+        self.memory.unlink()
+
+
+class FlowColumns(object):
+    """
+    Columnar view of one flow for FeatureExtractor.extractColumns:
+    its packet columns (slices of the shared buffers, in arrival order),
+    split into forward and backward as Flow.forwardPackets and Flow.backwardPackets.
+    'Ns' (packet timestamps in nanoseconds) and 'Forward' are always available
+    """
+
+    def __init__(self, columns: Dict[AnyStr, np.ndarray]):
+        self.columns = columns
+        self.forward = columns['Forward']
+        self.backward = ~self.forward
+        # nanoseconds
+        self.durationNs = int(columns['Ns'][-1]) - int(columns['Ns'][0]) if len(self.forward) != 0 else 0
+
+    def __len__(self):
+        return len(self.forward)
+
+    def column(self, columnName: AnyStr) -> np.ndarray:
+        return self.columns[columnName]
+
+    def forwardColumn(self, columnName: AnyStr) -> np.ndarray:
+        return self.columns[columnName][self.forward]
+
+    def backwardColumn(self, columnName: AnyStr) -> np.ndarray:
+        return self.columns[columnName][self.backward]
+
+    def duration(self, f='ms') -> float:
+        """
+        ms: microsecond
+        s: second
+        """
+        return self.durationNs / (1000000000.0 if f == 's' else 1000.0)
+
+
+def flows2columns(flows: Flows, columnSpec: ColumnSpec) -> SharedColumns:
+    """
+    Lay out the packet columns of all flows in shared memory, flow after flow;
+    flow i owns the packets [Flow Offsets[i], Flow Offsets[i + 1])
+    """
+    offsets = np.cumsum([0] + [len(flow) for flow in flows])
+    total = int(offsets[-1])
+    layout = [('Flow Offsets', np.int64, (len(flows) + 1,)),
+              ('Ns', np.int64, (total,)), ('Forward', np.bool_, (total,))]
+    layout.extend((columnName, dtype, (total,)) for columnName, (dtype, _) in columnSpec.items())
+    packetColumns = SharedColumns(layout)
+    packetColumns['Flow Offsets'][:] = offsets
+    ns, forward = packetColumns['Ns'], packetColumns['Forward']
+    getters = [(packetColumns[columnName], getter) for columnName, (_, getter) in columnSpec.items()]
+    for flow, start, end in zip(flows, offsets[:-1], offsets[1:]):
+        ns[start:end] = [packetTsNanoseconds(p) for p in flow.packets]
+        forward[start:end] = [p.pDirection == 'Forward' for p in flow.packets]
+        for column, getter in getters:
+            column[start:end] = [getter(flow, p) for p in flow.packets]
+    return packetColumns
+
+
+def flowRanges(offsets: np.ndarray, chunks: int) -> List[Tuple[int, int]]:
+    """Split flows into contiguous ranges of about the same number of packets"""
+    targets = offsets[-1] * np.arange(1, chunks) / chunks
+    bounds = sorted({0, len(offsets) - 1, *np.searchsorted(offsets, targets).tolist()})
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+# types of feature values in the output table: float values are kept in 'Float Features',
+# int and bool values in 'Integer Features' (exact, as ints of python), the code of each type in 'Feature Types'
+featureTypes = (float, int, bool)
+
+# per worker process: packet columns, output table and extractors, received once by the initializer
+_worker: Dict[AnyStr, Any] = dict()
+
+
+def _initWorker(packetColumns: SharedColumns, table: SharedColumns, extractors: List):
+    _worker.update(packetColumns=packetColumns, table=table, extractors=extractors)
+
+
+def _extractFlowRange(flowRange: Tuple[int, int]) -> int:
+    """Pool worker: run extractColumns on a range of flows, writing rows into the shared output table"""
+    packetColumns, table, extractors = _worker['packetColumns'], _worker['table'], _worker['extractors']
+    floats, integers, types = table['Float Features'], table['Integer Features'], table['Feature Types']
+    offsets = packetColumns['Flow Offsets']
+    columnNames = [columnName for columnName in packetColumns.columns if columnName != 'Flow Offsets']
+    for i in range(*flowRange):
+        start, end = offsets[i], offsets[i + 1]
+        flow = FlowColumns({columnName: packetColumns[columnName][start:end] for columnName in columnNames})
+        row = list()
+        for extractor in extractors:
+            features = extractor.extractColumns(flow)
+            row.extend(features[featureName] for featureName in extractor.featureNames)
+        for j, value in enumerate(row):
+            if isinstance(value, (bool, np.bool_)):
+                types[i, j], integers[i, j] = featureTypes.index(bool), value
+            elif isinstance(value, (int, np.integer)):
+                types[i, j], integers[i, j] = featureTypes.index(int), value
+            else:
+                types[i, j], floats[i, j] = featureTypes.index(float), value
+    return flowRange[1] - flowRange[0]
+
+
+class ColumnarExtraction(object):
+    """
+    Columnar feature extraction in a process pool, started on enter so that the caller can work meanwhile.
+    Packet columns are laid out in shared memory once; workers only receive flow ranges
+    and write their rows into a preallocated shared table, so neither flows nor packets are pickled.
+    The table keeps the type of each value (float, int or bool), so features are the same as the ones of extract
+    """
+
+    def __init__(self, flows: Flows, extractors: List, workers: Optional[int] = None, chunksPerWorker: int = 4):
+        """
+        :param flows: flows
+        :param extractors: feature extractors implementing extractColumns (they are pickled once per worker)
+        :param workers: number of processes; if it is None, the number of CPUs
+        :param chunksPerWorker: flow ranges per worker, for load balancing
+        """
+        self.flows, self.extractors = flows, extractors
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunksPerWorker = chunksPerWorker
+        self.featureNames = [featureName for extractor in extractors for featureName in extractor.featureNames]
+        self.packetColumns, self.table, self.pool, self.result = None, None, None, None
+
+    def __enter__(self):
+        columnSpec: ColumnSpec = dict()
+        for extractor in self.extractors:
+            columnSpec.update(extractor.packetColumns())
+        try:
+            self.packetColumns = flows2columns(self.flows, columnSpec)
+            shape = (len(self.flows), len(self.featureNames))
+            self.table = SharedColumns([('Float Features', np.float64, shape), ('Integer Features', np.int64, shape),
+                                        ('Feature Types', np.int8, shape)])
+            self.pool = Pool(self.workers, _initWorker, (self.packetColumns, self.table, self.extractors))
+            ranges = flowRanges(self.packetColumns['Flow Offsets'], self.workers * self.chunksPerWorker)
+            self.result = self.pool.map_async(_extractFlowRange, ranges)
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def features(self) -> List[List[Features]]:
+        """
+        Wait for the workers
+        :return: for each flow, the features of each extractor
+        """
+        self.result.get()
+        floatRows, integerRows, typeRows = (self.table[tableName].tolist()
+                                            for tableName in ('Float Features', 'Integer Features', 'Feature Types'))
+        rows = [[f if featureTypes[t] is float else featureTypes[t](i) for f, i, t in zip(*cells)]
+                for cells in zip(floatRows, integerRows, typeRows)]
+        blocks, start = list(), 0
+        for extractor in self.extractors:
+            blocks.append((extractor.featureNames, start, start + len(extractor.featureNames)))
+            start += len(extractor.featureNames)
+        return [[dict(zip(featureNames, row[start:end])) for featureNames, start, end in blocks] for row in rows]
+
+    def __exit__(self, excType, excValue, traceback):
+        if self.pool is not None:
+            if excType is None:
+                self.pool.close()
+            else:
+                self.pool.terminate()
+            self.pool.join()
+        for sharedColumns in (self.packetColumns, self.table):
+            if sharedColumns is not None:
+                sharedColumns.unlink()
@@ -1,94 +1,233 @@
 from pathlib import Path
-from pyprobar import probar
 
 from NetworkFlowMeter.BuiltinFeatureExtractors.Bfe1BasicFlowInfo import sortFeatures
-from NetworkFlowMeter.Settings import progressBarColor
-from NetworkFlowMeter.IO import readPackets, featureSet2csv
+from NetworkFlowMeter.IO import readPackets, iterPackets, expandCaptures, iterMergedPackets, featureSet2csv, \
+    FeatureWriter, ExternalSorter
+from NetworkFlowMeter.Sketch import packets2summary, TrafficSummary
+from NetworkFlowMeter.Context import addContextFeatures, iterContextFeatures
+from NetworkFlowMeter.Cache import ResultCache
+from NetworkFlowMeter.Checkpoint import iterCheckpointedFeatures, removeCheckpoint
+from NetworkFlowMeter.Dedup import FrameDeduplicator
+from NetworkFlowMeter.Filter import FilterSpec, iterFilteredPackets, readFilteredPackets, iterFilteredMergedPackets
 from NetworkFlowMeter.TicToc import Timer
-from NetworkFlowMeter.Session import defaultBidirectionalSessionExtractor
-from NetworkFlowMeter.Flow import Flow
-from NetworkFlowMeter.Feature import flow2feature, FeatureExtractor
-from NetworkFlowMeter.NetworkTyping import Callable, Optional, AnyStr, List, Tuple, Packet, FeatureSet
+from NetworkFlowMeter.Flow import Flow, iterPackets2flows
+from NetworkFlowMeter.Feature import flow2feature, generateFeatures, FeatureExtractor
+from NetworkFlowMeter.NetworkTyping import Callable, Optional, AnyStr, Iterable, Iterator, List, Tuple, Packet, \
+    Features, FeatureSet
 
 
-def packets2features(packets: List[Packet], direction: AnyStr = 'bidirectional',
+def iterPackets2features(packets: Iterable[Packet], direction: AnyStr = 'bidirectional',
+                         sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
+                         flowTimeout=Flow.defaultFlowTimeout,
+                         activityTimeout=Flow.defaultActivityTimeout) -> Iterator[Features]:
+    """
+    Take packets as input and yield features of each flow once it is finished
+    :param packets: A list of packets, or a packet stream in timestamp order
+    :param direction: unidirectional or bidirectional
+    :param sessionExtractor: session extractor
+    :param flowTimeout: flow timeout in microseconds
+    :param activityTimeout: activity timeout in microseconds
+    :return: features, in the order flows are finished
+    """
+    for flow in iterPackets2flows(packets, direction, sessionExtractor, flowTimeout, activityTimeout):
+        yield flow2feature(flow)
+
+
+def packets2features(packets: Iterable[Packet], direction: AnyStr = 'bidirectional',
                      sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
                      flowTimeout=Flow.defaultFlowTimeout,
                      activityTimeout=Flow.defaultActivityTimeout) -> Tuple[FeatureSet, List[AnyStr]]:
     """
     Take packets as input generate features
-    :param packets: A list of packets
+    :param packets: A list of packets, or a packet stream in timestamp order
     :param direction: unidirectional or bidirectional
     :param sessionExtractor: session extractor
     :param flowTimeout: flow timeout in microseconds
     :param activityTimeout: activity timeout in microseconds
     :return: (Feature Set, Feature Names)
     """
-    aliveFlows, flows = dict(), list()
-    featureSet: FeatureSet = list()
-    Flow.defaultFlowTimeout, Flow.defaultActivityTimeout = flowTimeout, activityTimeout
-    if sessionExtractor is None:
-        # use bidirectional session extractor as default
-        # unidirectional session key is the bidirectional session key + direction
-        sessionExtractor = defaultBidirectionalSessionExtractor
-    for p in probar(packets, color=progressBarColor):
-        sessionKey, pDirection = sessionExtractor(p)
-        if direction == 'unidirectional':
-            sessionKey = f'{sessionKey} {pDirection}'
-        # add additional attribute on packet to mark the direction
-        p.pDirection = pDirection
-
-        if sessionKey not in aliveFlows:
-            aliveFlows[sessionKey] = Flow(sessionKey, p)
-        else:
-            flow = aliveFlows[sessionKey]
-            success = flow.add(p)
-            if not success:
-                features = flow2feature(flow)
-                featureSet.append(features)
-                aliveFlows[sessionKey] = Flow(sessionKey, p)
-    # flush alive flows to flows
-    for sessionKey, aliveFlow in aliveFlows.items():
-        features = flow2feature(aliveFlow)
-        featureSet.append(features)
+    featureSet: FeatureSet = list(iterPackets2features(packets, direction, sessionExtractor,
+                                                       flowTimeout, activityTimeout))
     return featureSet, list(featureSet[0].keys())
 
 
 def pcap2csv(pcapPath=None, csvPath=None, direction: AnyStr = 'bidirectional',
              sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
              flowTimeout=Flow.defaultFlowTimeout,
-             activityTimeout=Flow.defaultActivityTimeout):
+             activityTimeout=Flow.defaultActivityTimeout,
+             contextWindow: Optional[float] = None,
+             maxRowsInMemory: Optional[int] = None,
+             cacheDir=None, cacheSize: Optional[int] = None,
+             checkpointPath=None, checkpointInterval: int = 100000, resume: bool = False,
+             packetFilter: Optional[FilterSpec] = None,
+             featureWorkers: Optional[int] = None,
+             dedupWindow: Optional[float] = None):
     """
     Take PCAP/PCAPNG as input, and generate CSV file
-    :param pcapPath: PCAP/PCAPNG file path; if it is None, user need to input the file path
+    :param pcapPath: PCAP/PCAPNG file path; if it is None, user need to input the file path.
+                     It can also be a directory, a glob pattern or a list of rotated captures,
+                     which are merged by timestamp so that flows spanning files are not split
     :param csvPath: CSV file path;
                     if it is None, CSV file will be generated in the same folder
                     as the one of PCAP file with same name
+                    (a directory gets a sibling CSV file, other multi-file inputs get '<first file>-merged.csv')
     :param direction: unidirectional or bidirectional
     :param sessionExtractor: session extractor
     :param flowTimeout: flow timeout in microseconds
     :param activityTimeout: activity timeout in microseconds
-    :return:
+    :param contextWindow: if it is not None, add connection-context features
+                          over a sliding window of this many microseconds
+    :param maxRowsInMemory: if it is not None, packets are streamed and rows are sorted by Ts
+                            with an external merge sort keeping at most this many rows in memory
+    :param cacheDir: if it is not None, feature columns are cached there per capture content and extractor,
+                     and only the columns of new/changed extractors are computed
+    :param cacheSize: cache size limit in bytes (least recently used columns are evicted)
+    :param checkpointPath: if it is not None, the extraction state is checkpointed there
+                           every checkpointInterval packets, and removed once the CSV file is saved
+    :param checkpointInterval: packets between checkpoints
+    :param resume: restart from the checkpoint of an interrupted run (see iterCheckpointedFeatures for what may differ)
+    :param packetFilter: if it is not None, only packets matching the filter are decoded
+                         (time windows are read through the capture time index)
+    :param featureWorkers: if it is not None, flows are collected first, and features are generated
+                           in this many processes over packet columns in shared memory
+    :param dedupWindow: if it is not None, duplicate frames (e.g., of SPAN ports) seen again within this many
+                        microseconds are dropped before session extraction
+    :return: number of flows
     """
     if pcapPath is None:
         pcapPath = input('PCAP/PCAPNG File Path: ')
-    pcapPath = Path(pcapPath)
+    captures = expandCaptures(pcapPath)
+    if len(captures) == 0:
+        raise Exception(f'No capture is found in {pcapPath}')
     if csvPath is None:
-        csvPath = pcapPath.with_suffix('.csv')
+        if len(captures) == 1:
+            csvPath = captures[0].with_suffix('.csv')
+        elif isinstance(pcapPath, (str, Path)) and Path(pcapPath).is_dir():
+            # with_suffix would cut directory names with dots, e.g., 'day1.v2' => 'day1.csv'
+            csvPath = Path(pcapPath).with_name(f'{Path(pcapPath).name}.csv')
+        else:
+            csvPath = captures[0].with_name(f'{captures[0].stem}-merged.csv')
     print(f'{len(FeatureExtractor.extractors)} Feature Extractors are Invoked: ')
     FeatureExtractor.printExistingExtractors()
-    with Timer(f'{pcapPath} Resolved'):
-        print(f'Resolving {pcapPath}')
-        packets = readPackets(pcapPath)
+    if packetFilter is not None:
+        print(f'Packet Filter: {packetFilter}')
+    deduplicator = None if dedupWindow is None else FrameDeduplicator(dedupWindow)
+
+    def openPackets():
+        packets = readCaptures()
+        if deduplicator is not None:
+            return deduplicator.filter(packets)
+        return packets
+
+    def readCaptures():
+        if len(captures) > 1:
+            # packets are decoded lazily during feature generation
+            print(f'Merging {len(captures)} Captures by Timestamp')
+            if packetFilter is not None:
+                return iterFilteredMergedPackets(captures, packetFilter)
+            return iterMergedPackets(captures)
+        if maxRowsInMemory is not None or cacheDir is not None:
+            if packetFilter is not None:
+                return iterFilteredPackets(captures[0], packetFilter)
+            return iterPackets(captures[0])
+        with Timer(f'{captures[0]} Resolved'):
+            print(f'Resolving {captures[0]}')
+            if packetFilter is not None:
+                return readFilteredPackets(captures[0], packetFilter)
+            return readPackets(captures[0])
+
+    if checkpointPath is not None and cacheDir is not None:
+        raise Exception('Checkpoints and the result cache cannot be used at the same time')
+    if packetFilter is not None and cacheDir is not None:
+        raise Exception('Packet filters cannot be used with the result cache')
+    if deduplicator is not None and cacheDir is not None:
+        raise Exception('Frame deduplication cannot be used with the result cache')
+    if featureWorkers is not None and (checkpointPath is not None or cacheDir is not None
+                                       or maxRowsInMemory is not None):
+        raise Exception('Feature workers cannot be used with checkpoints, the result cache or maxRowsInMemory')
+    if checkpointPath is not None:
+        # the time window of the filter is applied by tshark, as frame positions must stay those of the captures
+        featureSet = iterCheckpointedFeatures(captures, checkpointPath, None, checkpointInterval, resume,
+                                              direction, sessionExtractor, flowTimeout, activityTimeout,
+                                              None if packetFilter is None else packetFilter.displayFilter(),
+                                              deduplicator)
+    elif cacheDir is not None:
+        resultCache = ResultCache(cacheDir, cacheSize)
+        featureSet = resultCache.features(captures, openPackets, direction, sessionExtractor,
+                                          flowTimeout, activityTimeout)
+    elif featureWorkers is not None:
+        with Timer('Flows Generated'):
+            print('Generating Flows')
+            flows = list(iterPackets2flows(openPackets(), direction, sessionExtractor, flowTimeout, activityTimeout))
+        print(f'Generating Features ({featureWorkers} Workers)')
+        featureSet, _ = generateFeatures(flows, featureWorkers)
+    else:
+        featureSet = iterPackets2features(openPackets(), direction, sessionExtractor,
+                                          flowTimeout, activityTimeout)
+    if maxRowsInMemory is not None:
+        with Timer('Features Generated'):
+            print(f'Generating Features (Sorted Runs of {maxRowsInMemory} Rows)')
+            sorter = ExternalSorter(maxRowsInMemory)
+            for features in featureSet:
+                sorter.add(features)
+        with Timer(f'Features Sorted and Saved to {csvPath}'):
+            print(f'Merging {len(sorter.runs) + 1} Sorted Runs to {csvPath}')
+            featureSet = sorter.sorted()
+            if contextWindow is not None:
+                featureSet = iterContextFeatures(featureSet, contextWindow)
+            with FeatureWriter(csvPath) as writer:
+                writer.writeRows(featureSet)
+        if checkpointPath is not None:
+            removeCheckpoint(checkpointPath)
+        if deduplicator is not None:
+            print(deduplicator)
+        print(f'Flows: {writer.rows}')
+        print(f'Features ({len(writer.featureNames)}): \n'
+              f'    {"; ".join(writer.featureNames)}')
+        return writer.rows
     with Timer('Features Generated'):
         print('Generating Features')
-        featureSet, featureNames = packets2features(packets, direction, sessionExtractor, flowTimeout, activityTimeout)
+        featureSet = list(featureSet)
+        featureNames = list(featureSet[0].keys())
+    if cacheDir is not None:
+        print(f'Cached Columns: {resultCache.hits} Reused, {resultCache.misses} Computed')
     with Timer('Features Sorted'):
         print('Soring Features')
         featureSet = sortFeatures(featureSet)
+    if contextWindow is not None:
+        with Timer('Context Features Added'):
+            print('Adding Context Features')
+            featureSet = addContextFeatures(featureSet, contextWindow)
+            featureNames = list(featureSet[0].keys())
     with Timer(f'Features Saved to {csvPath}'):
         print(f'Saving Features to {csvPath}')
         featureSet2csv(csvPath, featureSet)
+    if checkpointPath is not None:
+        removeCheckpoint(checkpointPath)
+    if deduplicator is not None:
+        print(deduplicator)
     print(f'Flows: {len(featureSet)}')
     print(f'Features ({len(featureNames)}): \n'
           f'    {"; ".join(featureNames)}')
+    return len(featureSet)
+
+
+def pcap2summary(pcapPath=None,
+                 sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
+                 capacity: int = 100) -> TrafficSummary:
+    """
+    Fast triage of a PCAP/PCAPNG file in one pass and bounded memory,
+    to decide whether it deserves the full feature extraction
+    :param pcapPath: PCAP/PCAPNG file path; if it is None, user need to input the file path
+    :param sessionExtractor: session extractor
+    :param capacity: number of heavy hitters tracked
+    :return: traffic summary
+    """
+    if pcapPath is None:
+        pcapPath = input('PCAP/PCAPNG File Path: ')
+    pcapPath = Path(pcapPath)
+    with Timer(f'{pcapPath} Summarised'):
+        print(f'Summarising {pcapPath}')
+        summary = packets2summary(iterPackets(pcapPath), sessionExtractor, capacity)
+    print(summary)
+    return summary
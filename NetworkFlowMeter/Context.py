@@ -0,0 +1,120 @@
+from collections import deque, defaultdict
+
+from NetworkFlowMeter.NetworkTyping import Any, Dict, Features, FeatureSet, Iterable, Iterator
+
+
+class SlidingWindow(object):
+    """
+    Flows (ts, peer) seen within the last window microseconds;
+    a counter of peers is maintained alongside the deque, so that both the number of flows
+    and the number of distinct peers are O(1), and each flow is pushed and expired once
+    """
+
+    def __init__(self):
+        self.flows = deque()
+        self.peers = defaultdict(int)
+
+    def expire(self, oldestTs: float):
+        flows, peers = self.flows, self.peers
+        while flows and flows[0][0] < oldestTs:
+            _, peer = flows.popleft()
+            peers[peer] -= 1
+            if peers[peer] == 0:
+                del peers[peer]
+
+    def push(self, ts: float, peer: Any):
+        self.flows.append((ts, peer))
+        self.peers[peer] += 1
+
+    def __len__(self):
+        return len(self.flows)
+
+    def distinct(self) -> int:
+        return len(self.peers)
+
+
+class HostContext(object):
+    """
+    Connection-context (host-level and service-level) features over a sliding window of flow start times.
+    Flows must be fed in Ts order, e.g., after sortFeatures.
+    Counts only cover previous flows within the window, the current flow is excluded
+    """
+    # default window setting (microseconds)
+    defaultWindow = 2000000
+
+    def __init__(self, window: float = None):
+        self.window = self.defaultWindow if window is None else window
+        # src ip => dst ips; dst ip => src ips; dst port => src ips;
+        # (dst ip, dst port) => src ips; (src ip, dst port) => dst ips
+        self.srcWindows: Dict[Any, SlidingWindow] = defaultdict(SlidingWindow)
+        self.dstWindows: Dict[Any, SlidingWindow] = defaultdict(SlidingWindow)
+        self.dstPortWindows: Dict[Any, SlidingWindow] = defaultdict(SlidingWindow)
+        self.serviceWindows: Dict[Any, SlidingWindow] = defaultdict(SlidingWindow)
+        self.srcServiceWindows: Dict[Any, SlidingWindow] = defaultdict(SlidingWindow)
+        self.lastTs = None
+
+    @staticmethod
+    def _count(windows: Dict[Any, SlidingWindow], key: Any, oldestTs: float) -> (int, int):
+        """Expire a window and count it; a missing window is not created"""
+        window = windows.get(key)
+        if window is None:
+            return 0, 0
+        window.expire(oldestTs)
+        if len(window) == 0:
+            # drop idle hosts to keep the index proportional to the active hosts
+            del windows[key]
+            return 0, 0
+        return len(window), window.distinct()
+
+    def update(self, features: Features) -> Features:
+        """
+        Add context features of one flow to its row, and index the flow
+        :param features: features having Ts, Src IP, Dst IP and Dst Port items
+        :return: the features
+        """
+        ts, src, dst, dstPort = features['Ts'], features['Src IP'], features['Dst IP'], features['Dst Port']
+        if self.lastTs is not None and ts < self.lastTs:
+            raise Exception('Context features require flows in Ts order')
+        self.lastTs = ts
+        oldestTs = ts - self.window
+        service, srcService = (dst, dstPort), (src, dstPort)
+
+        features['Ctx Src Flows'], features['Ctx Src Distinct Dsts'] = \
+            self._count(self.srcWindows, src, oldestTs)
+        features['Ctx Dst Flows'], features['Ctx Dst Distinct Srcs'] = \
+            self._count(self.dstWindows, dst, oldestTs)
+        features['Ctx Dst Port Flows'], features['Ctx Dst Port Distinct Srcs'] = \
+            self._count(self.dstPortWindows, dstPort, oldestTs)
+        features['Ctx Svc Flows'], features['Ctx Svc Distinct Srcs'] = \
+            self._count(self.serviceWindows, service, oldestTs)
+        features['Ctx Src Dst Port Flows'], features['Ctx Src Dst Port Distinct Dsts'] = \
+            self._count(self.srcServiceWindows, srcService, oldestTs)
+
+        self.srcWindows[src].push(ts, dst)
+        self.dstWindows[dst].push(ts, src)
+        self.dstPortWindows[dstPort].push(ts, src)
+        self.serviceWindows[service].push(ts, src)
+        self.srcServiceWindows[srcService].push(ts, dst)
+        return features
+
+
+def iterContextFeatures(featureSet: Iterable[Features], window: float = None) -> Iterator[Features]:
+    """
+    Streaming version of addContextFeatures
+    :param featureSet: features in Ts order
+    :param window: window in microseconds
+    :return: features with context features
+    """
+    hostContext = HostContext(window)
+    for features in featureSet:
+        yield hostContext.update(features)
+
+
+def addContextFeatures(featureSet: FeatureSet, window: float = None) -> FeatureSet:
+    """
+    Append connection-context features to each flow's row in one pass
+    :param featureSet: features in Ts order, e.g., after sortFeatures
+    :param window: window in microseconds
+    :return: feature set
+    """
+    return list(iterContextFeatures(featureSet, window))
@@ -0,0 +1,99 @@
+import hashlib
+from collections import OrderedDict
+
+from NetworkFlowMeter.NetworkTyping import Optional, Collection, AnyStr, Iterable, Iterator, Dict, Packet
+from NetworkFlowMeter.Utils import packetTsNanoseconds
+
+# layer => header and payload fields carried by the frame itself, which are the same in every copy of it.
+# Left out: hop counts and the checksums covering them, which change between mirror points,
+# and whatever tshark computes per capture (time_delta, time_relative, analysis.*, _ws.expert.*, stream indexes).
+# Other layers contribute their names only (their bytes are in the payload of the transport layer)
+defaultFingerprintFields = {
+    'wpan': ('fcf', 'frame_type', 'seq_no', 'dst_pan', 'dst16', 'dst64', 'src_pan', 'src16', 'src64'),
+    'eth': ('dst', 'src', 'type'),
+    'ip': ('version', 'hdr_len', 'dsfield', 'len', 'id', 'flags', 'frag_offset', 'proto', 'src', 'dst'),
+    'ipv6': ('version', 'tclass', 'flow', 'plen', 'nxt', 'src', 'dst'),
+    'tcp': ('srcport', 'dstport', 'seq', 'seq_raw', 'ack', 'ack_raw', 'hdr_len', 'flags', 'window_size_value',
+            'urgent_pointer', 'options', 'len', 'payload'),
+    'udp': ('srcport', 'dstport', 'length', 'payload'),
+    'icmp': ('type', 'code', 'ident', 'seq', 'data'),
+    'icmpv6': ('type', 'code', 'echo_identifier', 'echo_sequence_number', 'data'),
+    'data': ('data',),
+}
+
+
+class FrameDeduplicator(object):
+    """
+    Drop duplicate frames of mirrored captures before session extraction.
+    A frame's fingerprint hashes its length, its layer names and the whitelisted fields of its layers;
+    a frame is a duplicate if the same fingerprint was seen within the window before it.
+    Fingerprints are kept in insertion (time) order, so expired ones are evicted from the front,
+    and at most capacity of them are kept
+    """
+    # microseconds, as flow timeouts
+    defaultWindow = 1000
+    defaultCapacity = 100000
+
+    def __init__(self, window: float = defaultWindow, capacity: int = defaultCapacity,
+                 fingerprintFields: Optional[Dict[AnyStr, Collection[AnyStr]]] = None):
+        """
+        :param window: duplicate window in microseconds
+        :param capacity: maximum number of fingerprints kept
+        :param fingerprintFields: layer => fields hashed into fingerprints; if it is None, defaultFingerprintFields
+        """
+        self.window = window
+        self.capacity = capacity
+        if fingerprintFields is None:
+            fingerprintFields = defaultFingerprintFields
+        self.fingerprintFields = {layer.lower(): tuple(fields) for layer, fields in fingerprintFields.items()}
+        # fingerprint => first ts (nanoseconds)
+        self.fingerprints: OrderedDict = OrderedDict()
+        self.packets = 0
+        self.removed = 0
+
+    def __str__(self):
+        ratio = self.removed / self.packets if self.packets != 0 else 0
+        return f'Duplicate Frames Removed: {self.removed} of {self.packets} ({ratio:.2%})'
+
+    def fingerprint(self, p: Packet) -> bytes:
+        # a digest rather than hash(), which is salted per process, so that fingerprints survive checkpoints
+        fingerprintFields = self.fingerprintFields
+        fields = [str(p.frame_info.len)]
+        for layer in p.layers:
+            layerName = layer.layer_name
+            fields.append(layerName)
+            # missing fields hash as None
+            fields.extend(str(layer.get_field(field)) for field in fingerprintFields.get(layerName, ()))
+        return hashlib.blake2b('\0'.join(fields).encode(), digest_size=16).digest()
+
+    def duplicate(self, p: Packet) -> bool:
+        """
+        Check a frame against the window (frames must come in timestamp order)
+        :param p: packet
+        :return: True if it is a duplicate, and it should be dropped
+        """
+        self.packets += 1
+        ts = packetTsNanoseconds(p)
+        windowNs = self.window * 1000
+        fingerprints = self.fingerprints
+        # evict expired fingerprints
+        while fingerprints:
+            oldestTs = next(iter(fingerprints.values()))
+            if ts - oldestTs <= windowNs and len(fingerprints) < self.capacity:
+                break
+            fingerprints.popitem(last=False)
+        fingerprint = self.fingerprint(p)
+        seenTs: Optional[int] = fingerprints.get(fingerprint)
+        if seenTs is not None and ts - seenTs <= windowNs:
+            self.removed += 1
+            return True
+        # a repeated frame outside the window starts a new window
+        fingerprints.pop(fingerprint, None)
+        fingerprints[fingerprint] = ts
+        return False
+
+    def filter(self, packets: Iterable[Packet]) -> Iterator[Packet]:
+        """Lazily drop duplicate frames of a packet stream in timestamp order"""
+        for p in packets:
+            if not self.duplicate(p):
+                yield p
@@ -1,9 +1,10 @@
-import statistics
-
 from pyprobar import probar
 
+from NetworkFlowMeter.Columnar import ColumnSpec, FlowColumns, ColumnarExtraction
 from NetworkFlowMeter.Flow import Flow
+from NetworkFlowMeter.Kernels import MathChar, floatArray, mathChar, mergeMathChar, std
 from NetworkFlowMeter.NetworkTyping import Callable, Optional, Collection, AnyStr, Any
+from NetworkFlowMeter.Quantile import TDigest, addQuantileChar2Dict
 from NetworkFlowMeter.NetworkTyping import List, Tuple, Dict, Flows, Features, FeatureSet, Packet, PacketList
 from NetworkFlowMeter.Settings import progressBarColor
 
@@ -64,29 +65,62 @@ class FeatureExtractor(object):
     def extract(self, flow: Flow) -> Features:
         raise NotImplementedError
 
+    def packetColumns(self) -> ColumnSpec:
+        """
+        Packet columns read by extractColumns: name => (dtype, getter(flow, packet)).
+        'Ns' and 'Forward' are always available
+        """
+        return dict()
+
+    def extractColumns(self, flow: FlowColumns) -> Features:
+        """
+        Optional columnar version of extract, run in worker processes over shared packet columns;
+        it must return the same features as extract
+        """
+        raise NotImplementedError
+
+    def columnar(self) -> bool:
+        return type(self).extractColumns is not FeatureExtractor.extractColumns
 
-def addMathChar2Dict(d: dict, baseName: Optional[str], numList: Collection[Any],
+
+def addMathChar2Dict(d: dict, baseName: Optional[str], numList: Optional[Collection[Any]],
                      charMin=True, charMax=True, charSum=True, charAve=True, charStd=True,
-                     defaultValue: float = 0) -> Dict:
-    numList = [float(n) for n in numList]
+                     defaultValue: float = 0,
+                     quantiles: Collection[float] = (), digest: Optional[TDigest] = None,
+                     char: Optional[MathChar] = None) -> Dict:
+    """
+    :param quantiles: quantiles (e.g., 0.5, 0.95) estimated by a t-digest, named as P50, P95
+    :param digest: t-digest of numList, if it is already maintained (e.g., merged from Fwd and Bwd digests)
+    :param char: Kernels.mathChar of numList, if it is already computed (e.g., merged from Fwd and Bwd ones);
+                 numList is then only needed for quantiles without digest
+    """
+    if char is None:
+        numList = floatArray(numList)
+        char = mathChar(numList)
+    n, minimum, maximum, total, mean, _ = char
     baseName = '' if baseName is None or baseName == '' else f'{baseName} '
     if charMin:
-        d[f'{baseName}Min'] = min(numList) if len(numList) >= 1 else defaultValue
+        d[f'{baseName}Min'] = minimum if n >= 1 else defaultValue
     if charMax:
-        d[f'{baseName}Max'] = max(numList) if len(numList) >= 1 else defaultValue
+        d[f'{baseName}Max'] = maximum if n >= 1 else defaultValue
     if charSum:
-        d[f'{baseName}Sum'] = sum(numList) if len(numList) >= 1 else defaultValue
+        d[f'{baseName}Sum'] = total if n >= 1 else defaultValue
     if charAve:
-        d[f'{baseName}Ave'] = statistics.mean(numList) if len(numList) >= 1 else defaultValue
+        d[f'{baseName}Ave'] = mean if n >= 1 else defaultValue
     if charStd:
-        d[f'{baseName}Std'] = statistics.stdev(numList) if len(numList) >= 2 else defaultValue
+        d[f'{baseName}Std'] = std(char) if n >= 2 else defaultValue
+    if len(quantiles) != 0:
+        if digest is None:
+            digest = TDigest().extend(numList)
+        addQuantileChar2Dict(d, baseName.rstrip(), digest, quantiles, defaultValue)
     return d
 
 
 def addBidirFlowMathChar2Features(d: Features, flow: Flow, baseName: str,
                                   pktOperator: Optional[Callable[[Packet], Any]] = None,
                                   pktListOperator: Optional[Callable[[PacketList], Collection[Any]]] = None,
-                                  defaultValue: float = 0) -> Features:
+                                  defaultValue: float = 0,
+                                  quantiles: Collection[float] = ()) -> Features:
     """
     Get a number from pktOperator;
     Store it in a list;
@@ -105,21 +139,45 @@ def addBidirFlowMathChar2Features(d: Features, flow: Flow, baseName: str,
     :param pktOperator: (Linear) Take packet as an input, and return something which can be convert to float/int
     :param pktListOperator: (Linear) Take a packet list as an input, return a collection (list)
     :param defaultValue: Default value if math char is not available
+    :param quantiles: quantiles estimated with t-digests of the Fwd and Bwd lists, built when the flow is extracted
+                      (the flow keeps its packets anyway); the Flow digest is merged from the Fwd and Bwd digests.
+                      SnapshotFlowTable maintains such digests per packet instead
     :return: The dict
     """
     if pktOperator is None and pktListOperator is None:
         raise Exception('pktOperator and pktListOperator can not be None at the same time')
-    fwdList, bwdList, pktList = None, None, None
+    fwdList, bwdList = None, None
     if pktOperator is not None:
         fwdList = [pktOperator(p) for p in flow.forwardPackets]
         bwdList = [pktOperator(p) for p in flow.backwardPackets]
     if pktListOperator is not None:
         fwdList = pktListOperator(flow.forwardPackets)
         bwdList = pktListOperator(flow.backwardPackets)
-    pktList = fwdList + bwdList
-    addMathChar2Dict(d, f'Fwd {baseName}', fwdList, defaultValue=defaultValue)
-    addMathChar2Dict(d, f'Bwd {baseName}', bwdList, defaultValue=defaultValue)
-    addMathChar2Dict(d, f'Flow {baseName}', pktList, charSum=False, defaultValue=defaultValue)
+    return addBidirMathChar2Features(d, baseName, fwdList, bwdList, defaultValue, quantiles)
+
+
+def addBidirMathChar2Features(d: Features, baseName: str,
+                              fwdList: Collection[Any], bwdList: Collection[Any],
+                              defaultValue: float = 0,
+                              quantiles: Collection[float] = ()) -> Features:
+    """
+    Add mathematical characteristics of the Fwd and Bwd lists, and of the Flow (Fwd + Bwd), to the dict,
+    e.g., from packet columns (FeatureExtractor.extractColumns)
+    """
+    fwdList, bwdList = floatArray(fwdList), floatArray(bwdList)
+    # Flow characteristics are merged from Fwd and Bwd ones, without concatenating the lists
+    fwdChar, bwdChar = mathChar(fwdList), mathChar(bwdList)
+    flowChar = mergeMathChar(fwdChar, bwdChar)
+    fwdDigest, bwdDigest, flowDigest = None, None, None
+    if len(quantiles) != 0:
+        fwdDigest, bwdDigest = TDigest().extend(fwdList), TDigest().extend(bwdList)
+        flowDigest = fwdDigest.merged(bwdDigest)
+    addMathChar2Dict(d, f'Fwd {baseName}', fwdList, defaultValue=defaultValue,
+                     quantiles=quantiles, digest=fwdDigest, char=fwdChar)
+    addMathChar2Dict(d, f'Bwd {baseName}', bwdList, defaultValue=defaultValue,
+                     quantiles=quantiles, digest=bwdDigest, char=bwdChar)
+    addMathChar2Dict(d, f'Flow {baseName}', None, charSum=False, defaultValue=defaultValue,
+                     quantiles=quantiles, digest=flowDigest, char=flowChar)
     return d
 
 
@@ -144,8 +202,22 @@ def addBidirFlowCountSpeed2features(d: Features, flow: Flow, baseName: str,
     """
     fwdCount, bwdCount = \
         counter(flow.forwardPackets), counter(flow.backwardPackets)
+    return addCountSpeed2features(d, baseName, fwdCount, bwdCount, flow.duration(f='s'), countFlow)
+
+
+def addCountSpeed2features(d: Features, baseName: str, fwdCount: Any, bwdCount: Any, duration: float,
+                           countFlow=False):
+    """
+    Add Fwd/Bwd counts, their ratio and their speeds (count / duration in seconds) to the dict
+    :param d: A dict
+    :param baseName: 'Fwd/Bwd/Flow+baseName+Num/Speed'
+    :param fwdCount: forward count
+    :param bwdCount: backward count
+    :param duration: duration in seconds
+    :param countFlow: if it is true, then we will calculate total flow count
+    :return: The dict
+    """
     fwdCount, bwdCount = float(fwdCount), float(bwdCount)
-    duration = flow.duration(f='s')
     if duration == 0:
         fwdSpeed, bwdSpeed = 0.0, 0.0
     else:
@@ -168,11 +240,43 @@ def flow2feature(flow: Flow) -> Features:
     return features
 
 
-def generateFeatures(flows: Flows) -> Tuple[FeatureSet, List[AnyStr]]:
-    """Generate Features According to Flows"""
+def generateFeatures(flows: Flows, workers: Optional[int] = None) -> Tuple[FeatureSet, List[AnyStr]]:
+    """
+    Generate Features According to Flows
+    :param workers: if it is not None, extractors with a columnar version (extractColumns)
+                    run in this many processes over packet columns in shared memory,
+                    while the other extractors run in this process meanwhile
+    """
+    if workers is not None:
+        return parallelGenerateFeatures(flows, workers), FeatureExtractor.getAllFeatureNames()
     featureSet: FeatureSet = list()
     for flow in probar(flows, color=progressBarColor):
         flow: Flow
         features = flow2feature(flow)
         featureSet.append(features)
     return featureSet, FeatureExtractor.getAllFeatureNames()
+
+
+def parallelGenerateFeatures(flows: Flows, workers: Optional[int] = None) -> FeatureSet:
+    """
+    Features of the flows, in the same order, with the same names and types as flow2feature
+    :param flows: flows
+    :param workers: number of processes; if it is None, the number of CPUs
+    :return: feature set
+    """
+    extractors = list(FeatureExtractor.extractors)
+    columnarExtractors = [extractor for extractor in extractors if extractor.columnar()]
+    serialExtractors = [extractor for extractor in extractors if not extractor.columnar()]
+    with ColumnarExtraction(flows, columnarExtractors, workers) as extraction:
+        serialFeatures = [[extractor.extract(flow) for extractor in serialExtractors]
+                          for flow in probar(flows, color=progressBarColor)]
+        columnarFeatures = extraction.features()
+    featureSet: FeatureSet = list()
+    for serialRow, columnarRow in zip(serialFeatures, columnarFeatures):
+        extractorFeatures = dict(zip(serialExtractors, serialRow))
+        extractorFeatures.update(zip(columnarExtractors, columnarRow))
+        features = dict()
+        for extractor in extractors:
+            features.update(extractorFeatures[extractor])
+        featureSet.append(features)
+    return featureSet
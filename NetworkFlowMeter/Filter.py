@@ -0,0 +1,272 @@
+import bisect
+import ipaddress
+import math
+import pickle
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+from NetworkFlowMeter.IO import readPackets, iterPackets, iterMergedPackets, captureFormat, iterRecordTs
+from NetworkFlowMeter.NetworkTyping import Optional, Collection, AnyStr, Iterable, Iterator, List, Tuple, Dict, \
+    Packet, PacketList
+from NetworkFlowMeter.Utils import packetTs
+
+
+class FilterSpec(object):
+    """
+    Packets of interest, pushed down as far as possible:
+    the time window selects a byte range of the capture through its time index (no decoding at all),
+    the rest becomes a wireshark display filter, so that tshark drops packets before they are parsed in python.
+    match checks decoded packets of other sources (live, replay, pickled packet lists), cheapest checks first.
+    Every given condition must hold; within a condition, any of the values may match
+    """
+
+    def __init__(self, protocols: Optional[Collection[AnyStr]] = None,
+                 networks: Optional[Collection[AnyStr]] = None,
+                 ports: Optional[Collection[int]] = None,
+                 start: Optional[float] = None,
+                 end: Optional[float] = None):
+        """
+        :param protocols: protocol layers, e.g., ['TCP', 'UDP', 'ICMPv6']
+        :param networks: addresses or CIDRs (IPv4/IPv6) matched against the source or destination address
+        :param ports: TCP/UDP ports matched against the source or destination port
+        :param start: window start (epoch seconds, inclusive)
+        :param end: window end (epoch seconds, exclusive)
+        """
+        self.protocols = None if protocols is None else tuple(protocols)
+        self.networks = None if networks is None else tuple(ipaddress.ip_network(n, strict=False) for n in networks)
+        self.ports = None if ports is None else frozenset(int(port) for port in ports)
+        self.start, self.end = start, end
+        # address string => whether it is inside the networks
+        self._addressCache: Dict[AnyStr, bool] = dict()
+
+    def __str__(self):
+        return self.displayFilter() or 'All Packets'
+
+    def hasTimeWindow(self) -> bool:
+        return self.start is not None or self.end is not None
+
+    def displayFilter(self) -> Optional[AnyStr]:
+        """
+        :return: the equivalent wireshark display filter; None if every packet matches
+        """
+        conditions = list()
+        if self.start is not None:
+            conditions.append(f'frame.time_epoch >= {self.start:.9f}')
+        if self.end is not None:
+            conditions.append(f'frame.time_epoch < {self.end:.9f}')
+        if self.protocols is not None:
+            conditions.append(' || '.join(protocol.lower() for protocol in self.protocols))
+        if self.networks is not None:
+            conditions.append(' || '.join(f'{"ip" if n.version == 4 else "ipv6"}.addr == {n}'
+                                          for n in self.networks))
+        if self.ports is not None:
+            ports = ' '.join(str(port) for port in sorted(self.ports))
+            conditions.append(f'tcp.port in {{{ports}}} || udp.port in {{{ports}}}')
+        if len(conditions) == 0:
+            return None
+        return ' && '.join(f'({condition})' for condition in conditions)
+
+    def _inNetworks(self, address: AnyStr) -> bool:
+        inNetworks = self._addressCache.get(address)
+        if inNetworks is None:
+            ip = ipaddress.ip_address(address)
+            inNetworks = any(ip in n for n in self.networks)
+            self._addressCache[address] = inNetworks
+        return inNetworks
+
+    def match(self, p: Packet) -> bool:
+        if self.start is not None or self.end is not None:
+            ts = packetTs(p)
+            if (self.start is not None and ts < self.start) or (self.end is not None and ts >= self.end):
+                return False
+        if self.protocols is not None and not any(protocol in p for protocol in self.protocols):
+            return False
+        if self.networks is not None:
+            # same address layer as the session extractor
+            ipLayer = p.ip if 'IP' in p else p.ipv6 if 'IPv6' in p else None
+            if ipLayer is None or not (self._inNetworks(ipLayer.src) or self._inNetworks(ipLayer.dst)):
+                return False
+        if self.ports is not None:
+            portLayer = p.tcp if 'TCP' in p else p.udp if 'UDP' in p else None
+            if portLayer is None or not (int(portLayer.srcport) in self.ports or int(portLayer.dstport) in self.ports):
+                return False
+        return True
+
+    def filter(self, packets: Iterable[Packet]) -> Iterator[Packet]:
+        for p in packets:
+            if self.match(p):
+                yield p
+
+
+class TimeIndex(object):
+    """
+    Sparse time index of a PCAP/PCAPNG file, built from the record headers without decoding:
+    the byte offset of every step-th record, the latest timestamp before it, and the earliest timestamp from it on.
+    Timestamps do not have to be in order; a window always maps to a byte range holding all of its records.
+    The index is saved next to the capture ('<capture>.tsidx') and rebuilt when the capture changes
+    """
+    defaultStep = 100
+
+    def __init__(self, filepath, step: int = defaultStep):
+        self.filepath = Path(filepath)
+        self.step = step
+        stat = self.filepath.stat()
+        self.fileSize, self.fileMtime = stat.st_size, stat.st_mtime_ns
+        self.offsets: List[int] = list()
+        self.maxBefore: List[float] = list()
+        self.minFrom: List[float] = list()
+        # bytes before the first packet record (file header, section and interface blocks)
+        self.headerEnd = self.fileSize
+        self.records, self.first, self.last = 0, math.inf, -math.inf
+        self.build()
+
+    def build(self):
+        latest, blockMins = -math.inf, list()
+        for i, (ts, offset) in enumerate(iterRecordTs(self.filepath)):
+            if i % self.step == 0:
+                self.offsets.append(offset)
+                self.maxBefore.append(latest)
+                blockMins.append(ts)
+            latest = max(latest, ts)
+            blockMins[-1] = min(blockMins[-1], ts)
+            self.first, self.last = min(self.first, ts), max(self.last, ts)
+            self.records += 1
+        # suffix minimum of the blocks
+        earliest = math.inf
+        for blockMin in reversed(blockMins):
+            earliest = min(earliest, blockMin)
+            self.minFrom.append(earliest)
+        self.minFrom.reverse()
+        if len(self.offsets) != 0:
+            self.headerEnd = self.offsets[0]
+
+    def upToDate(self) -> bool:
+        stat = self.filepath.stat()
+        return (stat.st_size, stat.st_mtime_ns) == (self.fileSize, self.fileMtime)
+
+    @staticmethod
+    def indexPath(filepath) -> Path:
+        return Path(f'{filepath}.tsidx')
+
+    @staticmethod
+    def load(filepath, step: int = defaultStep) -> 'TimeIndex':
+        """Load the saved index of the capture, or build (and try to save) it"""
+        indexPath = TimeIndex.indexPath(filepath)
+        try:
+            with open(indexPath, 'rb') as indexFile:
+                index: TimeIndex = pickle.load(indexFile)
+            # the capture may have been moved together with its index
+            index.filepath = Path(filepath)
+            if index.upToDate() and index.step == step:
+                return index
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+        index = TimeIndex(filepath, step)
+        try:
+            with open(indexPath, 'wb') as indexFile:
+                pickle.dump(index, indexFile, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            # read-only capture folder: the index is only kept in memory
+            pass
+        return index
+
+    def window(self, start: Optional[float] = None, end: Optional[float] = None) -> Tuple[int, int]:
+        """
+        :param start: window start (epoch seconds, inclusive)
+        :param end: window end (epoch seconds, exclusive)
+        :return: byte range [startOffset, endOffset) holding every record within the window
+        """
+        if len(self.offsets) == 0:
+            return self.fileSize, self.fileSize
+        startOffset, endOffset = self.headerEnd, self.fileSize
+        if start is not None:
+            # the last sample before which every record is earlier than start
+            startOffset = self.offsets[bisect.bisect_left(self.maxBefore, start) - 1]
+        if end is not None:
+            # the first sample from which every record is not earlier than end
+            k = bisect.bisect_left(self.minFrom, end)
+            if k < len(self.offsets):
+                endOffset = self.offsets[k]
+        return startOffset, max(startOffset, endOffset)
+
+
+def sliceCapture(filepath, slicePath, startOffset: int, endOffset: int, headerEnd: int,
+                 chunkSize: int = 1 << 20):
+    """
+    Write a valid capture made of the header bytes and the records within [startOffset, endOffset).
+    PCAPNG interface blocks are expected before the first packet, as dumpcap/tshark write them
+    """
+    sliceCaptureRecords(filepath, slicePath, [(startOffset, endOffset)], headerEnd, chunkSize)
+
+
+def sliceCaptureRecords(filepath, slicePath, spans: Iterable[Tuple[int, int]], headerEnd: int,
+                        chunkSize: int = 1 << 20):
+    """
+    Write a valid capture made of the header bytes and the byte spans [start, end) of records, in the given order
+    """
+    with open(filepath, 'rb') as src, open(slicePath, 'wb') as dst:
+        dst.write(src.read(headerEnd))
+        for startOffset, endOffset in spans:
+            src.seek(startOffset)
+            remaining = endOffset - startOffset
+            while remaining > 0:
+                chunk = src.read(min(chunkSize, remaining))
+                if len(chunk) == 0:
+                    break
+                dst.write(chunk)
+                remaining -= len(chunk)
+
+
+@contextmanager
+def captureWindow(filepath, start: Optional[float] = None, end: Optional[float] = None):
+    """
+    Seek to a time window: yield a temporary capture holding only the records of the window
+    (the capture itself if there is no window, or its format is unknown)
+    :param filepath: capture file path
+    :param start: window start (epoch seconds, inclusive)
+    :param end: window end (epoch seconds, exclusive)
+    :return: capture file path
+    """
+    if (start is None and end is None) or captureFormat(filepath) is None:
+        yield Path(filepath)
+        return
+    index = TimeIndex.load(filepath)
+    startOffset, endOffset = index.window(start, end)
+    if startOffset == index.headerEnd and endOffset == index.fileSize:
+        yield Path(filepath)
+        return
+    with tempfile.TemporaryDirectory(prefix='NetworkFlowMeter-') as tmpDir:
+        windowPath = Path(tmpDir) / Path(filepath).name
+        sliceCapture(filepath, windowPath, startOffset, endOffset, index.headerEnd)
+        yield windowPath
+
+
+def iterFilteredPackets(filepath, packetFilter: FilterSpec) -> Iterator[Packet]:
+    """Lazily yield the packets of a capture matching the filter"""
+    with captureWindow(filepath, packetFilter.start, packetFilter.end) as windowPath:
+        yield from iterPackets(windowPath, packetFilter.displayFilter())
+
+
+def readFilteredPackets(filepath, packetFilter: FilterSpec) -> PacketList:
+    """Read the packets of a capture matching the filter"""
+    with captureWindow(filepath, packetFilter.start, packetFilter.end) as windowPath:
+        return readPackets(windowPath, packetFilter.displayFilter())
+
+
+def capturesInWindow(filepaths: Iterable, packetFilter: FilterSpec) -> List[Path]:
+    """Drop the captures which have no packet within the time window of the filter"""
+    captures = list()
+    for filepath in filepaths:
+        if packetFilter.hasTimeWindow() and captureFormat(filepath) is not None:
+            index = TimeIndex.load(filepath)
+            if index.records == 0 or (packetFilter.start is not None and index.last < packetFilter.start) or \
+                    (packetFilter.end is not None and index.first >= packetFilter.end):
+                continue
+        captures.append(Path(filepath))
+    return captures
+
+
+def iterFilteredMergedPackets(filepaths: Iterable, packetFilter: FilterSpec) -> Iterator[Packet]:
+    """Streaming timestamp merge of the packets of several captures matching the filter"""
+    return iterMergedPackets(capturesInWindow(filepaths, packetFilter), packetFilter.displayFilter())
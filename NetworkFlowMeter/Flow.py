@@ -1,15 +1,18 @@
+from collections import deque
+
 from pyprobar import probar
 
-from NetworkFlowMeter.NetworkTyping import Callable, Optional, AnyStr, Packet, Sessions, SessionKeyInfo, PacketList, \
-    Flows
-from NetworkFlowMeter.Session import defaultSessionKeyInfo
+from NetworkFlowMeter.NetworkTyping import Callable, Optional, AnyStr, List, Tuple, Dict, Deque, Iterable, Iterator, \
+    Packet, Sessions, SessionKeyInfo, PacketList, Flows
+from NetworkFlowMeter.Session import defaultSessionKeyInfo, defaultBidirectionalSessionExtractor
 from NetworkFlowMeter.Settings import progressBarColor
-from NetworkFlowMeter.Utils import packetTsMicroseconds, formatMicrosecond, microsecond2second
+from NetworkFlowMeter.Utils import packetTsNanoseconds, formatNanosecond, progress
 
 
 class Flow(object):
     """
-    All time related operation will be based on microseconds
+    All time related operation will be based on microseconds;
+    packet timestamps are kept as integer nanoseconds, so that no precision is lost
     """
     # default timeout setting
     defaultFlowTimeout = 5000000
@@ -23,9 +26,9 @@ class Flow(object):
         self.sessionKeyInfoGenerator = sessionKeyInfoGenerator
         self.sessionKeyInfo = sessionKeyInfoGenerator(sessionKey)
         self.flowTimeout = self.defaultFlowTimeout if flowTimeout is None else flowTimeout
-        # packet ts => microseconds
-        self.initialPacketTs = 0
-        self.lastPacketTs = 0
+        # packet ts => nanoseconds
+        self.initialPacketNs = 0
+        self.lastPacketNs = 0
         # bidirectional packets
         self.packets: PacketList = list()
         # unidirectional packets
@@ -35,14 +38,14 @@ class Flow(object):
         self.label = ''
 
         if packet is not None:
-            self.initialPacketTs = self.lastPacketTs = packetTsMicroseconds(packet)
+            self.initialPacketNs = self.lastPacketNs = packetTsNanoseconds(packet)
             self.appendPacket(packet)
 
     def __lt__(self, other):
         if not hasattr(other, 'initialPacketTs'):
             print('Error Type: does\'nt have initialPacketTs')
             return False
-        if self.initialPacketTs < other.initialPacketTs:
+        if self.initialPacketNs < other.initialPacketNs:
             return True
         else:
             return False
@@ -51,7 +54,7 @@ class Flow(object):
         if not hasattr(other, 'initialPacketTs'):
             print('Error Type: does\'nt have initialPacketTs')
             return False
-        if self.initialPacketTs == other.initialPacketTs:
+        if self.initialPacketNs == other.initialPacketNs:
             return True
         else:
             return False
@@ -72,11 +75,21 @@ class Flow(object):
     def protocol(self):
         return self.sessionKeyInfo[0]
 
+    @property
+    def initialPacketTs(self) -> float:
+        """microseconds"""
+        return self.initialPacketNs / 1000.0
+
+    @property
+    def lastPacketTs(self) -> float:
+        """microseconds"""
+        return self.lastPacketNs / 1000.0
+
     def readableInitPacketTs(self) -> AnyStr:
-        return formatMicrosecond(self.initialPacketTs)
+        return formatNanosecond(self.initialPacketNs)
 
     def readableLastPacketTs(self) -> AnyStr:
-        return formatMicrosecond(self.lastPacketTs)
+        return formatNanosecond(self.lastPacketNs)
 
     def duration(self, f='ms') -> float:
         """
@@ -84,8 +97,8 @@ class Flow(object):
         s: second
         """
         if f == 's':
-            return microsecond2second(self.lastPacketTs - self.initialPacketTs)
-        return float(self.lastPacketTs - self.initialPacketTs)
+            return (self.lastPacketNs - self.initialPacketNs) / 1000000000.0
+        return (self.lastPacketNs - self.initialPacketNs) / 1000.0
 
     def empty(self) -> bool:
         return len(self.packets) == 0
@@ -97,8 +110,8 @@ class Flow(object):
         :param packet: new packet
         :return: True: timeout; False: the packet can be add into this flow
         """
-        packetTs = packetTsMicroseconds(packet)
-        if packetTs - self.initialPacketTs > self.flowTimeout:
+        packetNs = packetTsNanoseconds(packet)
+        if packetNs - self.initialPacketNs > self.flowTimeout * 1000:
             return True
         return False
 
@@ -119,14 +132,14 @@ class Flow(object):
         :param packet: packet
         :return: True: success; False: timeout
         """
-        packetTs = packetTsMicroseconds(packet)
+        packetNs = packetTsNanoseconds(packet)
         if self.empty():
             # if flow hasn't been initiated
-            self.initialPacketTs = packetTs
+            self.initialPacketNs = packetNs
         elif self.timeout(packet):
             return False
 
-        self.lastPacketTs = packetTs
+        self.lastPacketNs = packetNs
         self.appendPacket(packet)
         return True
 
@@ -153,3 +166,117 @@ def sessions2flows(sessions: Sessions,
     # sort the flows
     flows.sort()
     return flows
+
+
+class FlowTable(object):
+    """
+    Alive flows indexed by session key.
+    A packet either joins the alive flow of its session, or finishes it (timeout) and starts a new one.
+    With expiry enabled, flows are also kept in creation order,
+    so that flows which can no longer accept packets are finished in O(1) amortised time
+    """
+
+    def __init__(self, direction: AnyStr = 'bidirectional',
+                 sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
+                 expiry: bool = False):
+        if sessionExtractor is None:
+            # use bidirectional session extractor as default
+            # unidirectional session key is the bidirectional session key + direction
+            sessionExtractor = defaultBidirectionalSessionExtractor
+        self.direction = direction
+        self.sessionExtractor = sessionExtractor
+        self.aliveFlows: Dict[AnyStr, Flow] = dict()
+        # alive flows in creation order (may contain flows finished by add, which are skipped lazily)
+        self.flowQueue: Optional[Deque[Flow]] = deque() if expiry else None
+        self.packets = 0
+
+    def __len__(self):
+        return len(self.aliveFlows)
+
+    def newFlow(self, sessionKey: AnyStr, packet: Packet) -> Flow:
+        flow = Flow(sessionKey, packet)
+        self.aliveFlows[sessionKey] = flow
+        if self.flowQueue is not None:
+            self.flowQueue.append(flow)
+        return flow
+
+    def add(self, p: Packet) -> Optional[Flow]:
+        """
+        Add a packet into its flow
+        :param p: packet
+        :return: the finished flow if the packet starts a new flow of the same session, otherwise None
+        """
+        self.packets += 1
+        sessionKey, pDirection = self.sessionExtractor(p)
+        if self.direction == 'unidirectional':
+            sessionKey = f'{sessionKey} {pDirection}'
+        # add additional attribute on packet to mark the direction
+        p.pDirection = pDirection
+
+        flow = self.aliveFlows.get(sessionKey)
+        if flow is None:
+            self.onPacket(self.newFlow(sessionKey, p), p)
+        elif not flow.add(p):
+            self.onPacket(self.newFlow(sessionKey, p), p)
+            return flow
+        else:
+            self.onPacket(flow, p)
+        return None
+
+    def onPacket(self, flow: Flow, p: Packet):
+        """Invoked after a packet is added into an alive flow; sub-classes maintain per-flow state here"""
+        pass
+
+    def expire(self, ts: float) -> List[Flow]:
+        """
+        Finish flows which cannot accept any packet at or after ts (requires expiry)
+        :param ts: current capture time in nanoseconds, e.g., packetTsNanoseconds(p)
+        :return: finished flows
+        """
+        finished = list()
+        flowQueue, aliveFlows = self.flowQueue, self.aliveFlows
+        while flowQueue:
+            flow = flowQueue[0]
+            if aliveFlows.get(flow.sessionKey) is not flow:
+                flowQueue.popleft()
+            elif ts - flow.initialPacketNs > flow.flowTimeout * 1000:
+                flowQueue.popleft()
+                del aliveFlows[flow.sessionKey]
+                finished.append(flow)
+            else:
+                break
+        return finished
+
+    def flush(self) -> List[Flow]:
+        """
+        Finish all alive flows
+        :return: finished flows
+        """
+        finished = list(self.aliveFlows.values())
+        self.aliveFlows = dict()
+        if self.flowQueue is not None:
+            self.flowQueue.clear()
+        return finished
+
+
+def iterPackets2flows(packets: Iterable[Packet], direction: AnyStr = 'bidirectional',
+                      sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
+                      flowTimeout=Flow.defaultFlowTimeout,
+                      activityTimeout=Flow.defaultActivityTimeout) -> Iterator[Flow]:
+    """
+    Take packets as input and yield each flow once it is finished
+    :param packets: A list of packets, or a packet stream in timestamp order
+    :param direction: unidirectional or bidirectional
+    :param sessionExtractor: session extractor
+    :param flowTimeout: flow timeout in microseconds
+    :param activityTimeout: activity timeout in microseconds
+    :return: flows, in the order they are finished
+    """
+    Flow.defaultFlowTimeout, Flow.defaultActivityTimeout = flowTimeout, activityTimeout
+    flowTable = FlowTable(direction, sessionExtractor)
+    for p in progress(packets):
+        finishedFlow = flowTable.add(p)
+        if finishedFlow is not None:
+            yield finishedFlow
+    # flush alive flows to flows
+    yield from flowTable.flush()
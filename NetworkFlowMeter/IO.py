@@ -1,20 +1,223 @@
 import csv
+import glob
+import heapq
 import pickle
+import struct
+import tempfile
+from pathlib import Path
 
 from pyshark import FileCapture
 
-from NetworkFlowMeter.NetworkTyping import PacketList, FeatureSet
+from NetworkFlowMeter.NetworkTyping import Callable, Optional, Union, Iterable, Iterator, List, Tuple, AnyStr, \
+    Packet, PacketList, Features, FeatureSet
+from NetworkFlowMeter.Utils import packetTs, formatReadableTs
+
+captureSuffixes = ('.pcap', '.pcapng', '.cap')
 
 
 # Input
 
 
-def readPackets(filepath) -> PacketList:
-    fileCapture = FileCapture(str(filepath))
+def readPackets(filepath, displayFilter: Optional[AnyStr] = None) -> PacketList:
+    fileCapture = FileCapture(str(filepath), display_filter=displayFilter)
     packets = [p for p in fileCapture]
     return packets
 
 
+def iterPackets(filepath, displayFilter: Optional[AnyStr] = None) -> Iterator[Packet]:
+    """
+    Lazily yield packets one by one, so that one-pass consumers
+    do not have to keep the whole capture in memory
+    :param filepath: capture file path
+    :param displayFilter: wireshark display filter applied by tshark
+    """
+    fileCapture = FileCapture(str(filepath), keep_packets=False, display_filter=displayFilter)
+    try:
+        for p in fileCapture:
+            yield p
+    finally:
+        fileCapture.close()
+
+
+def expandCaptures(captures: Union[str, Path, Iterable[Union[str, Path]]]) -> List[Path]:
+    """
+    Resolve capture inputs into a list of files
+    :param captures: a file, a directory (all captures inside), a glob pattern, or a list of them
+    :return: capture file paths
+    """
+    if isinstance(captures, (str, Path)):
+        captures = [captures]
+    paths = list()
+    for capture in captures:
+        capture = Path(capture)
+        if capture.is_dir():
+            paths.extend(sorted(p for p in capture.iterdir() if p.is_file() and p.suffix in captureSuffixes))
+        elif glob.has_magic(str(capture)):
+            paths.extend(sorted(Path(p) for p in glob.glob(str(capture)) if Path(p).is_file()))
+        else:
+            paths.append(capture)
+    return paths
+
+
+pcapMagics = {b'\xd4\xc3\xb2\xa1': ('<', 1e-6), b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+              b'\x4d\x3c\xb2\xa1': ('<', 1e-9), b'\xa1\xb2\x3c\x4d': ('>', 1e-9)}
+pcapngMagic = b'\x0a\x0d\x0d\x0a'
+
+
+def captureFormat(filepath) -> Optional[AnyStr]:
+    """
+    :return: 'pcap', 'pcapng', or None if the format is unknown
+    """
+    with open(filepath, 'rb') as f:
+        magic = f.read(4)
+    if magic in pcapMagics:
+        return 'pcap'
+    if magic == pcapngMagic:
+        return 'pcapng'
+    return None
+
+
+def _iterPcapRecords(f) -> Iterator[Tuple[float, int]]:
+    byteOrder, fraction = pcapMagics[f.read(4)]
+    offset = 24
+    while True:
+        f.seek(offset)
+        record = f.read(16)
+        if len(record) < 16:
+            return
+        seconds, fractions, capturedLength, _ = struct.unpack(byteOrder + 'IIII', record)
+        yield seconds + fractions * fraction, offset
+        offset += 16 + capturedLength
+
+
+def _iterPcapngRecords(f) -> Iterator[Tuple[float, int]]:
+    byteOrder, tsResolutions, offset = '<', list(), 0
+    while True:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        blockType, blockLength = struct.unpack(byteOrder + 'II', header)
+        if blockType == 0x0A0D0D0A:
+            # a new section may change the byte order and resets interfaces
+            byteOrder = '<' if f.read(4) == b'\x4d\x3c\x2b\x1a' else '>'
+            blockLength, = struct.unpack(byteOrder + 'I', header[4:])
+            tsResolutions = list()
+        elif blockType == 0x00000001:
+            # interface description block: look for if_tsresol option
+            body = f.read(blockLength - 8)
+            tsResolution, optionOffset = 1e-6, 8
+            while optionOffset + 4 <= len(body) - 4:
+                code, length = struct.unpack(byteOrder + 'HH', body[optionOffset:optionOffset + 4])
+                if code == 0:
+                    break
+                if code == 9:
+                    value = body[optionOffset + 4]
+                    tsResolution = 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+                optionOffset += 4 + (length + 3) // 4 * 4
+            tsResolutions.append(tsResolution)
+        elif blockType in (0x00000006, 0x00000002):
+            # enhanced packet block / obsolete packet block
+            body = f.read(12)
+            if blockType == 0x00000006:
+                interfaceId, high, low = struct.unpack(byteOrder + 'III', body)
+            else:
+                interfaceId, _, high, low = struct.unpack(byteOrder + 'HHII', body)
+            tsResolution = tsResolutions[interfaceId] if interfaceId < len(tsResolutions) else 1e-6
+            yield ((high << 32) + low) * tsResolution, offset
+        offset += blockLength
+
+
+def iterRecordTs(filepath) -> Iterator[Tuple[float, int]]:
+    """
+    Walk the record headers of a PCAP/PCAPNG file without decoding packets
+    :param filepath: capture file path
+    :return: (timestamp in seconds, byte offset of the record) of every packet
+    """
+    captureType = captureFormat(filepath)
+    if captureType is None:
+        raise Exception(f'{filepath} is neither PCAP nor PCAPNG')
+    with open(filepath, 'rb') as f:
+        yield from _iterPcapRecords(f) if captureType == 'pcap' else _iterPcapngRecords(f)
+
+
+def firstPacketTs(filepath) -> Optional[float]:
+    """
+    Timestamp (seconds) of the first packet, read from the PCAP/PCAPNG record headers
+    without decoding; files with unknown formats fall back to decoding the first packet
+    :param filepath: capture file path
+    :return: timestamp in seconds; None if the capture is empty
+    """
+    if captureFormat(filepath) is not None:
+        for ts, _ in iterRecordTs(filepath):
+            return ts
+        return None
+    for p in iterPackets(filepath):
+        return packetTs(p)
+    return None
+
+
+def captureTimeRange(filepath) -> Tuple[Optional[float], Optional[float]]:
+    """
+    (first, last) packet timestamps in seconds, from the record headers
+    """
+    first, last = None, None
+    for ts, _ in iterRecordTs(filepath):
+        if first is None:
+            first = ts
+        last = ts
+    return first, last
+
+
+def mergePacketStreams(streams: Iterable[Tuple[float, Callable[[], Iterator[Packet]]]]) -> Iterator[Packet]:
+    """
+    Streaming k-way timestamp merge of packet streams, given as (first packet ts, opener).
+    A stream is only opened once the merge reaches its first packet; ties go to the earlier stream
+    :param streams: (timestamp of the first packet in seconds, function opening the stream)
+    :return: packets in timestamp order
+    """
+    pending = sorted(((ts, i, opener) for i, (ts, opener) in enumerate(streams)),
+                     key=lambda stream: stream[:2], reverse=True)
+    # heap of (packet ts, file order, packet, packet iterator); file order breaks ties stably
+    heap, order = list(), 0
+
+    def openPending():
+        nonlocal order
+        ts, _, opener = pending.pop()
+        packets = opener()
+        p = next(packets, None)
+        if p is not None:
+            heapq.heappush(heap, (packetTs(p), order, p, packets))
+        order += 1
+
+    while pending or heap:
+        # open every file which may hold a packet not later than the current head of the merge
+        while pending and (not heap or pending[-1][0] <= heap[0][0]):
+            openPending()
+        ts, fileOrder, p, packets = heapq.heappop(heap)
+        yield p
+        p = next(packets, None)
+        if p is not None:
+            heapq.heappush(heap, (packetTs(p), fileOrder, p, packets))
+
+
+def iterMergedPackets(filepaths: Iterable, displayFilter: Optional[AnyStr] = None) -> Iterator[Packet]:
+    """
+    Streaming k-way timestamp merge over several (rotated, possibly overlapping) captures.
+    Files are ordered by their first packet timestamp, and a file is only opened
+    once the merge reaches its first packet, so only overlapping files are decoded at the same time
+    :param filepaths: capture file paths
+    :param displayFilter: wireshark display filter applied by tshark to every capture
+    :return: packets in timestamp order
+    """
+    streams = list()
+    for filepath in sorted(str(filepath) for filepath in filepaths):
+        ts = firstPacketTs(filepath)
+        if ts is not None:
+            streams.append((ts, lambda filepath=filepath: iterPackets(filepath, displayFilter)))
+    return mergePacketStreams(streams)
+
+
 def readPacketsFromPkl(filepath) -> PacketList:
     with open(filepath, 'rb') as pklFile:
         packetList = pickle.load(pklFile)
@@ -35,4 +238,90 @@ def featureSet2csv(filepath: str, featureSet: FeatureSet):
         featureNames = list(featureSet[0].keys())
         writer = csv.DictWriter(csvFile, featureNames)
         writer.writeheader()
-        writer.writerows(featureSet)
+        writer.writerows(formatReadableTs(featureSet))
+
+
+class FeatureWriter(object):
+    """
+    Streaming CSV writer; feature names are taken from the first row, as featureSet2csv does
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.csvFile, self.writer = None, None
+        self.featureNames: List[AnyStr] = list()
+        self.rows = 0
+
+    def __enter__(self):
+        self.csvFile = open(self.filepath, 'w', newline='')
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.csvFile.close()
+
+    def write(self, features: Features):
+        if self.writer is None:
+            self.featureNames = list(features.keys())
+            self.writer = csv.DictWriter(self.csvFile, self.featureNames)
+            self.writer.writeheader()
+        self.writer.writerow(features)
+        self.rows += 1
+
+    def writeRows(self, featureSet: Iterable[Features]):
+        for features in featureSet:
+            self.write(features)
+
+
+def _iterRun(filepath) -> Iterator[Features]:
+    with open(filepath, 'rb') as runFile:
+        while True:
+            try:
+                yield pickle.load(runFile)
+            except EOFError:
+                return
+
+
+class ExternalSorter(object):
+    """
+    Sort rows by a key with bounded memory:
+    rows are buffered up to runSize, sorted and spilled as runs to temporary files,
+    and the runs are merged with a heap.
+    Sorting and merging are both stable, so the order is identical to sorting the whole list
+    """
+
+    def __init__(self, runSize: int = 1000000, key: AnyStr = 'Ts', tmpDir: Optional[AnyStr] = None):
+        self.runSize, self.key = runSize, key
+        self.tmpDir = tempfile.TemporaryDirectory(prefix='NetworkFlowMeter-', dir=tmpDir)
+        self.buffer: FeatureSet = list()
+        self.runs: List[Path] = list()
+        self.rows = 0
+
+    def add(self, features: Features):
+        self.buffer.append(features)
+        self.rows += 1
+        if len(self.buffer) >= self.runSize:
+            self.spill()
+
+    def spill(self):
+        if len(self.buffer) == 0:
+            return
+        self.buffer.sort(key=lambda f: f[self.key])
+        runPath = Path(self.tmpDir.name) / f'{len(self.runs)}.run'
+        with open(runPath, 'wb') as runFile:
+            for features in self.buffer:
+                pickle.dump(features, runFile, protocol=pickle.HIGHEST_PROTOCOL)
+        self.runs.append(runPath)
+        self.buffer = list()
+
+    def sorted(self) -> Iterator[Features]:
+        """
+        Yield all rows in key order; temporary files are removed afterwards
+        """
+        try:
+            self.buffer.sort(key=lambda f: f[self.key])
+            # the in-memory run holds the latest rows, so it goes last to keep the merge stable
+            runs = [_iterRun(runPath) for runPath in self.runs] + [iter(self.buffer)]
+            yield from heapq.merge(*runs, key=lambda f: f[self.key])
+        finally:
+            self.buffer = list()
+            self.tmpDir.cleanup()
@@ -0,0 +1,92 @@
+import math
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+from NetworkFlowMeter.NetworkTyping import Any, Collection, Tuple, PacketList
+from NetworkFlowMeter.Utils import packetTsNanoseconds
+
+# (count, min, max, sum, mean, sum of squared deviations)
+MathChar = Tuple[int, float, float, float, float, float]
+
+
+def floatArray(numList: Collection[Any]) -> np.ndarray:
+    """Contiguous float64 array of the numbers (pyshark fields are converted with float)"""
+    if isinstance(numList, np.ndarray):
+        return np.ascontiguousarray(numList, dtype=np.float64)
+    return np.fromiter((float(n) for n in numList), dtype=np.float64, count=len(numList))
+
+
+def packetNanoseconds(packets: PacketList) -> np.ndarray:
+    return np.fromiter((packetTsNanoseconds(p) for p in packets), dtype=np.int64, count=len(packets))
+
+
+def firstDifferences(values: np.ndarray) -> np.ndarray:
+    """[values[1] - values[0], values[2] - values[1], ...], e.g., inter-arrival times of timestamps"""
+    return np.diff(values) if len(values) >= 2 else np.empty(0, dtype=np.float64)
+
+
+def _mathCharLoop(values: np.ndarray) -> MathChar:
+    """Single pass: min/max/sum, and Welford's update for the squared deviations"""
+    n = values.shape[0]
+    if n == 0:
+        return 0, math.inf, -math.inf, 0.0, 0.0, 0.0
+    minimum, maximum, total, mean, m2 = values[0], values[0], 0.0, 0.0, 0.0
+    for i in range(n):
+        x = values[i]
+        minimum, maximum = min(minimum, x), max(maximum, x)
+        total += x
+        delta = x - mean
+        mean += delta / (i + 1)
+        m2 += delta * (x - mean)
+    return n, minimum, maximum, total, total / n, m2
+
+
+def _mathCharNumpy(values: np.ndarray) -> MathChar:
+    """Vectorised fallback: squared deviations around the exact mean (two passes over the array)"""
+    n = values.shape[0]
+    if n == 0:
+        return 0, math.inf, -math.inf, 0.0, 0.0, 0.0
+    total = values.sum()
+    mean = total / n
+    deviations = values - mean
+    return n, values.min(), values.max(), total, mean, np.dot(deviations, deviations)
+
+
+if njit is not None:
+    backend = 'numba'
+    _mathCharKernel = njit(cache=True, nogil=True)(_mathCharLoop)
+else:
+    backend = 'numpy'
+    _mathCharKernel = _mathCharNumpy
+
+
+def mathChar(values: np.ndarray) -> MathChar:
+    """
+    Min/Max/Sum/Mean/squared deviations of a float64 array;
+    compiled with numba if it is installed, vectorised with numpy otherwise
+    """
+    n, minimum, maximum, total, mean, m2 = _mathCharKernel(values)
+    return int(n), float(minimum), float(maximum), float(total), float(mean), float(m2)
+
+
+def mergeMathChar(a: MathChar, b: MathChar) -> MathChar:
+    """Characteristics of the concatenation of two arrays (Chan et al.), e.g., Flow = Fwd + Bwd"""
+    nA, minA, maxA, sumA, meanA, m2A = a
+    nB, minB, maxB, sumB, meanB, m2B = b
+    n = nA + nB
+    if nA == 0 or nB == 0:
+        return a if nB == 0 else b
+    total = sumA + sumB
+    delta = meanB - meanA
+    return n, min(minA, minB), max(maxA, maxB), total, total / n, m2A + m2B + delta * delta * nA * nB / n
+
+
+def std(char: MathChar) -> float:
+    """Sample standard deviation, as statistics.stdev"""
+    n, m2 = char[0], char[5]
+    return math.sqrt(max(m2, 0.0) / (n - 1))
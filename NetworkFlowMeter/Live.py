@@ -0,0 +1,237 @@
+import sys
+import time
+from pathlib import Path
+
+from pyshark import LiveCapture
+from pyshark.capture.pipe_capture import PipeCapture
+
+from NetworkFlowMeter.Feature import flow2feature, FeatureExtractor
+from NetworkFlowMeter.Flow import Flow, FlowTable
+from NetworkFlowMeter.IO import iterPackets, FeatureWriter
+from NetworkFlowMeter.Snapshot import SnapshotFlowTable
+from NetworkFlowMeter.NetworkTyping import Callable, Optional, Collection, AnyStr, Any, Iterable, Iterator, Tuple, \
+    Packet, Features
+from NetworkFlowMeter.TicToc import formatT
+from NetworkFlowMeter.Utils import packetTs, packetTsNanoseconds
+
+
+# Packet Sources
+
+
+def liveSource(interface: AnyStr, bpfFilter: Optional[AnyStr] = None) -> Iterator[Packet]:
+    """Packets sniffed continuously from a local interface"""
+    liveCapture = LiveCapture(interface=interface, bpf_filter=bpfFilter)
+    try:
+        yield from liveCapture.sniff_continuously()
+    finally:
+        liveCapture.close()
+
+
+def pipeSource(pipe=None) -> Iterator[Packet]:
+    """Packets decoded from a stream of pcap records, stdin by default (e.g., tcpdump -w - | python ...)"""
+    pipeCapture = PipeCapture(pipe=sys.stdin if pipe is None else pipe)
+    try:
+        yield from pipeCapture.sniff_continuously()
+    finally:
+        pipeCapture.close()
+
+
+def replaySource(packets: Iterable[Packet], speed: Optional[float] = 1.0) -> Iterator[Packet]:
+    """
+    Replay packets at their original pace
+    :param packets: packets in timestamp order, e.g., iterPackets(pcapPath)
+    :param speed: N times the original pace; None or 0 means as fast as possible
+    :return: packets
+    """
+    startTs, startTime = None, None
+    for p in packets:
+        if speed:
+            ts = packetTs(p)
+            if startTs is None:
+                startTs, startTime = ts, time.perf_counter()
+            delay = (ts - startTs) / speed - (time.perf_counter() - startTime)
+            if delay > 0:
+                time.sleep(delay)
+        yield p
+
+
+# Online Extraction
+
+
+class IngestStats(object):
+    """
+    Throughput and latency of online extraction.
+    Processing latency: wall time spent on one packet (flow table and any triggered extraction).
+    Emission delay: capture time between a flow becoming expirable and its row being emitted
+    """
+
+    def __init__(self):
+        self.packets, self.rows, self.snapshots = 0, 0, 0
+        self.startTime = self.endTime = time.perf_counter()
+        self.latencySum, self.latencyMax = 0.0, 0.0
+        self.delaySum, self.delayMax = 0.0, 0.0
+
+    def addPacket(self, latency: float):
+        self.packets += 1
+        self.latencySum += latency
+        self.latencyMax = max(self.latencyMax, latency)
+        self.endTime = time.perf_counter()
+
+    def addRow(self, delay: float):
+        self.rows += 1
+        self.delaySum += delay
+        self.delayMax = max(self.delayMax, delay)
+
+    def elapsed(self) -> float:
+        return self.endTime - self.startTime
+
+    def packetsPerSecond(self) -> float:
+        return self.packets / self.elapsed() if self.elapsed() > 0 else 0.0
+
+    def __str__(self):
+        packets, rows = max(self.packets, 1), max(self.rows, 1)
+        return f'Packets: {self.packets} {formatT(self.startTime, self.endTime)}\n' \
+               f'Rows: {self.rows}\n' \
+               f'Snapshots: {self.snapshots}\n' \
+               f'Throughput: {self.packetsPerSecond():.1f} packets/s\n' \
+               f'Processing Latency: ave {self.latencySum / packets * 1e6:.1f} us, ' \
+               f'max {self.latencyMax * 1e6:.1f} us\n' \
+               f'Emission Delay: ave {self.delaySum / rows / 1e6:.6f} s, max {self.delayMax / 1e6:.6f} s'
+
+
+def ingest(packets: Iterable[Packet], onFeatures: Callable[[Features], Any] = None,
+           direction: AnyStr = 'bidirectional',
+           sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
+           flowTimeout=Flow.defaultFlowTimeout,
+           activityTimeout=Flow.defaultActivityTimeout,
+           stats: Optional[IngestStats] = None,
+           earlyPackets: Optional[int] = None,
+           snapshotInterval: Optional[float] = None,
+           onSnapshot: Callable[[Features], Any] = None,
+           quantiles: Collection[float] = ()) -> IngestStats:
+    """
+    Run the flow table and extractors online: rows are emitted as soon as flows expire
+    (in capture time), and the remaining flows are flushed when the source ends.
+    Optionally, incremental snapshot rows are emitted before flows end (see SnapshotFlowTable)
+    :param packets: packet source, e.g., liveSource, pipeSource, replaySource
+    :param onFeatures: invoked with the features of every finished flow
+    :param direction: unidirectional or bidirectional
+    :param sessionExtractor: session extractor
+    :param flowTimeout: flow timeout in microseconds
+    :param activityTimeout: activity timeout in microseconds
+    :param stats: ingest statistics to be updated
+    :param earlyPackets: if it is not None, emit a snapshot row after the first earlyPackets packets of a flow
+    :param snapshotInterval: if it is not None, emit a snapshot row of every alive flow
+                             every snapshotInterval microseconds of capture time
+    :param onSnapshot: invoked with every snapshot row
+    :param quantiles: packet length and IAT quantiles of snapshot rows, e.g., (0.5, 0.95) => P50, P95
+    :return: ingest statistics
+    """
+    Flow.defaultFlowTimeout, Flow.defaultActivityTimeout = flowTimeout, activityTimeout
+    if earlyPackets is None and snapshotInterval is None:
+        flowTable = FlowTable(direction, sessionExtractor, expiry=True)
+    else:
+        flowTable = SnapshotFlowTable(direction, sessionExtractor, expiry=True,
+                                      earlyPackets=earlyPackets, snapshotInterval=snapshotInterval,
+                                      quantiles=quantiles)
+    stats = IngestStats() if stats is None else stats
+
+    def emit(flow: Flow, ts: Optional[float]):
+        features = flow2feature(flow)
+        if onFeatures is not None:
+            onFeatures(features)
+        stats.addRow(0.0 if ts is None else max(ts - flow.initialPacketTs - flow.flowTimeout, 0.0))
+
+    try:
+        for p in packets:
+            t = time.perf_counter()
+            tsNs = packetTsNanoseconds(p)
+            ts = tsNs / 1000.0
+            # packets at ts can no longer join flows initiated before ts - flowTimeout
+            for flow in flowTable.expire(tsNs):
+                emit(flow, ts)
+            finishedFlow = flowTable.add(p)
+            if finishedFlow is not None:
+                emit(finishedFlow, ts)
+            if isinstance(flowTable, SnapshotFlowTable):
+                for snapshot in flowTable.takeSnapshots():
+                    stats.snapshots += 1
+                    if onSnapshot is not None:
+                        onSnapshot(snapshot)
+            stats.addPacket(time.perf_counter() - t)
+    except KeyboardInterrupt:
+        print('Ingest Interrupted')
+    for flow in flowTable.flush():
+        emit(flow, None)
+    return stats
+
+
+def ingest2csv(packets: Iterable[Packet], csvPath, direction: AnyStr = 'bidirectional',
+               sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
+               flowTimeout=Flow.defaultFlowTimeout,
+               activityTimeout=Flow.defaultActivityTimeout,
+               earlyPackets: Optional[int] = None,
+               snapshotInterval: Optional[float] = None,
+               snapshotCsvPath=None,
+               quantiles: Collection[float] = ()) -> IngestStats:
+    """
+    Ingest packets online and append rows to a CSV file in emission order
+    :param packets: packet source, e.g., liveSource, pipeSource, replaySource
+    :param csvPath: CSV file path
+    :param direction: unidirectional or bidirectional
+    :param sessionExtractor: session extractor
+    :param flowTimeout: flow timeout in microseconds
+    :param activityTimeout: activity timeout in microseconds
+    :param earlyPackets: emit a snapshot row after the first earlyPackets packets of a flow
+    :param snapshotInterval: emit snapshot rows of alive flows every snapshotInterval microseconds
+    :param snapshotCsvPath: CSV file path of snapshot rows; if it is None, '<csv>.snapshot.csv'
+    :param quantiles: packet length and IAT quantiles of snapshot rows, e.g., (0.5, 0.95) => P50, P95
+    :return: ingest statistics
+    """
+    print(f'{len(FeatureExtractor.extractors)} Feature Extractors are Invoked: ')
+    FeatureExtractor.printExistingExtractors()
+    print(f'Ingesting Packets to {csvPath}')
+    if earlyPackets is None and snapshotInterval is None:
+        with FeatureWriter(csvPath) as writer:
+            stats = ingest(packets, writer.write, direction, sessionExtractor, flowTimeout, activityTimeout)
+    else:
+        if snapshotCsvPath is None:
+            snapshotCsvPath = Path(csvPath).with_suffix('.snapshot.csv')
+        print(f'Emitting Snapshots to {snapshotCsvPath}')
+        with FeatureWriter(csvPath) as writer, FeatureWriter(snapshotCsvPath) as snapshotWriter:
+            stats = ingest(packets, writer.write, direction, sessionExtractor, flowTimeout, activityTimeout,
+                           earlyPackets=earlyPackets, snapshotInterval=snapshotInterval,
+                           onSnapshot=snapshotWriter.write, quantiles=quantiles)
+    print(stats)
+    return stats
+
+
+def replayPcap2csv(pcapPath=None, csvPath=None, speed: Optional[float] = 1.0,
+                   direction: AnyStr = 'bidirectional',
+                   sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
+                   flowTimeout=Flow.defaultFlowTimeout,
+                   activityTimeout=Flow.defaultActivityTimeout,
+                   earlyPackets: Optional[int] = None,
+                   snapshotInterval: Optional[float] = None,
+                   quantiles: Collection[float] = ()) -> IngestStats:
+    """
+    Replay a PCAP/PCAPNG file through online extraction, to measure sustained throughput and latency
+    :param pcapPath: PCAP/PCAPNG file path; if it is None, user need to input the file path
+    :param csvPath: CSV file path; if it is None, '<pcap>.live.csv' is generated in the same folder
+    :param speed: N times the original pace; None or 0 means as fast as possible
+    :param direction: unidirectional or bidirectional
+    :param sessionExtractor: session extractor
+    :param flowTimeout: flow timeout in microseconds
+    :param activityTimeout: activity timeout in microseconds
+    :param earlyPackets: emit a snapshot row after the first earlyPackets packets of a flow
+    :param snapshotInterval: emit snapshot rows of alive flows every snapshotInterval microseconds
+    :param quantiles: packet length and IAT quantiles of snapshot rows, e.g., (0.5, 0.95) => P50, P95
+    :return: ingest statistics
+    """
+    if pcapPath is None:
+        pcapPath = input('PCAP/PCAPNG File Path: ')
+    pcapPath = Path(pcapPath)
+    if csvPath is None:
+        csvPath = pcapPath.with_suffix('.live.csv')
+    return ingest2csv(replaySource(iterPackets(pcapPath), speed), csvPath, direction, sessionExtractor,
+                      flowTimeout, activityTimeout, earlyPackets, snapshotInterval, quantiles=quantiles)
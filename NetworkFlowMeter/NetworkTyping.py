@@ -1,7 +1,8 @@
 from pyshark.packet.packet import Packet
 from pandas import DataFrame
 
-from typing import Callable, Optional, Collection, AnyStr, Any, List, Tuple, Dict, DefaultDict
+from typing import Callable, Optional, Collection, AnyStr, Any, List, Tuple, Dict, DefaultDict, Deque, Iterable, \
+    Iterator, Union
 
 
 PacketList = List[Packet]
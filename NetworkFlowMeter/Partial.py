@@ -0,0 +1,227 @@
+import gzip
+import math
+import pickle
+from multiprocessing import Pool
+from pathlib import Path
+
+from NetworkFlowMeter.BuiltinFeatureExtractors.Bfe1BasicFlowInfo import sortFeatures
+from NetworkFlowMeter.Feature import flow2feature, FeatureExtractor
+from NetworkFlowMeter.Flow import Flow, FlowTable
+from NetworkFlowMeter.Filter import FilterSpec, iterFilteredPackets
+from NetworkFlowMeter.IO import captureTimeRange, featureSet2csv
+from NetworkFlowMeter.NetworkTyping import Callable, Optional, AnyStr, Iterable, List, Tuple, Dict, Packet, \
+    FeatureSet
+from NetworkFlowMeter.TicToc import Timer
+from NetworkFlowMeter.Utils import packetTsMicroseconds, second2microsecond, microsecond2second, progress
+
+
+class PartialResult(object):
+    """
+    Serialisable result of one worker over the time range [rangeStart, rangeEnd) (microseconds):
+    - rows: finished flows which cannot be affected by other workers
+    - headFlows: flows of sessions whose first packet is within flowTimeout of rangeStart;
+                 they may continue a flow of the previous range, so their grouping is resolved on merge
+    - tailFlows: flows of the other sessions still alive at the end of the range
+    """
+
+    def __init__(self, rangeStart: float, rangeEnd: float):
+        self.rangeStart, self.rangeEnd = rangeStart, rangeEnd
+        self.rows: FeatureSet = list()
+        self.headFlows: Dict[AnyStr, List[Flow]] = dict()
+        self.tailFlows: Dict[AnyStr, Flow] = dict()
+
+    def save(self, filepath):
+        with gzip.open(filepath, 'wb', compresslevel=1) as partialFile:
+            pickle.dump(self, partialFile, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(filepath) -> 'PartialResult':
+        with gzip.open(filepath, 'rb') as partialFile:
+            return pickle.load(partialFile)
+
+
+def packets2partial(packets: Iterable[Packet], rangeStart: float, rangeEnd: float,
+                    direction: AnyStr = 'bidirectional',
+                    sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
+                    flowTimeout=Flow.defaultFlowTimeout,
+                    activityTimeout=Flow.defaultActivityTimeout) -> PartialResult:
+    """
+    Process the packets of one time range into a partial result
+    :param packets: packets within [rangeStart, rangeEnd) in timestamp order
+    :param rangeStart: range start in microseconds
+    :param rangeEnd: range end in microseconds
+    :param direction: unidirectional or bidirectional
+    :param sessionExtractor: session extractor
+    :param flowTimeout: flow timeout in microseconds
+    :param activityTimeout: activity timeout in microseconds
+    :return: partial result
+    """
+    Flow.defaultFlowTimeout, Flow.defaultActivityTimeout = flowTimeout, activityTimeout
+    partial = PartialResult(rangeStart, rangeEnd)
+    flowTable = FlowTable(direction, sessionExtractor)
+    for p in progress(packets):
+        sessions = len(flowTable)
+        finishedFlow = flowTable.add(p)
+        if len(flowTable) > sessions:
+            # a new session; a session starting late enough cannot continue a flow of the previous range
+            sessionKey = next(reversed(flowTable.aliveFlows))
+            if packetTsMicroseconds(p) - rangeStart <= flowTimeout:
+                partial.headFlows[sessionKey] = list()
+        elif finishedFlow is None:
+            continue
+        elif finishedFlow.sessionKey in partial.headFlows:
+            partial.headFlows[finishedFlow.sessionKey].append(finishedFlow)
+        else:
+            partial.rows.append(flow2feature(finishedFlow))
+    for sessionKey, aliveFlow in flowTable.aliveFlows.items():
+        if sessionKey in partial.headFlows:
+            partial.headFlows[sessionKey].append(aliveFlow)
+        else:
+            partial.tailFlows[sessionKey] = aliveFlow
+    return partial
+
+
+def mergePartials(partials: Iterable[PartialResult],
+                  flowTimeout=Flow.defaultFlowTimeout,
+                  activityTimeout=Flow.defaultActivityTimeout) -> FeatureSet:
+    """
+    Stitch partial results of consecutive time ranges back together.
+    Flows alive at the end of a range are carried over; the head flows of the next range
+    are replayed packet by packet into the carried flow, exactly as a single run would group them
+    :param partials: partial results in time range order
+    :param flowTimeout: flow timeout in microseconds
+    :param activityTimeout: activity timeout in microseconds
+    :return: feature set (unsorted)
+    """
+    Flow.defaultFlowTimeout, Flow.defaultActivityTimeout = flowTimeout, activityTimeout
+    carriedFlows: Dict[AnyStr, Flow] = dict()
+    featureSet: FeatureSet = list()
+    for partial in partials:
+        featureSet.extend(partial.rows)
+        for sessionKey, headFlows in partial.headFlows.items():
+            flow = carriedFlows.pop(sessionKey, None)
+            if flow is None:
+                # nothing to continue: the worker's grouping is the final one
+                featureSet.extend(flow2feature(headFlow) for headFlow in headFlows[:-1])
+                carriedFlows[sessionKey] = headFlows[-1]
+                continue
+            for headFlow in headFlows:
+                for p in headFlow.packets:
+                    if not flow.add(p):
+                        featureSet.append(flow2feature(flow))
+                        flow = Flow(sessionKey, p)
+            carriedFlows[sessionKey] = flow
+        for sessionKey, tailFlow in partial.tailFlows.items():
+            # the session started more than flowTimeout after the range start, so the carried flow has ended
+            carriedFlow = carriedFlows.pop(sessionKey, None)
+            if carriedFlow is not None:
+                featureSet.append(flow2feature(carriedFlow))
+            carriedFlows[sessionKey] = tailFlow
+    featureSet.extend(flow2feature(flow) for flow in carriedFlows.values())
+    return featureSet
+
+
+def timeRangeFilter(rangeStart: float, rangeEnd: float) -> FilterSpec:
+    """Packet filter of [rangeStart, rangeEnd) microseconds"""
+    return FilterSpec(start=None if math.isinf(rangeStart) else microsecond2second(rangeStart),
+                      end=None if math.isinf(rangeEnd) else microsecond2second(rangeEnd))
+
+
+def pcap2partial(pcapPath, partialPath, rangeStart: float = -math.inf, rangeEnd: float = math.inf,
+                 direction: AnyStr = 'bidirectional',
+                 sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
+                 flowTimeout=Flow.defaultFlowTimeout,
+                 activityTimeout=Flow.defaultActivityTimeout):
+    """
+    Worker (node) entry: extract the time range [rangeStart, rangeEnd) of a capture into a partial result file
+    :param pcapPath: PCAP/PCAPNG file path
+    :param partialPath: partial result file path
+    :param rangeStart: range start in microseconds
+    :param rangeEnd: range end in microseconds
+    :param direction: unidirectional or bidirectional
+    :param sessionExtractor: session extractor
+    :param flowTimeout: flow timeout in microseconds
+    :param activityTimeout: activity timeout in microseconds
+    :return: partial result file path
+    """
+    # the worker seeks to its range through the capture time index
+    packets = iterFilteredPackets(pcapPath, timeRangeFilter(rangeStart, rangeEnd))
+    partial = packets2partial(packets, rangeStart, rangeEnd, direction, sessionExtractor,
+                              flowTimeout, activityTimeout)
+    partial.save(partialPath)
+    return partialPath
+
+
+def partials2csv(partialPaths: List, csvPath,
+                 flowTimeout=Flow.defaultFlowTimeout,
+                 activityTimeout=Flow.defaultActivityTimeout):
+    """
+    Merge tool: stitch partial result files (in any order) into the final CSV file
+    :param partialPaths: partial result file paths
+    :param csvPath: CSV file path
+    :param flowTimeout: flow timeout in microseconds, the same as the workers'
+    :param activityTimeout: activity timeout in microseconds, the same as the workers'
+    """
+    partials = sorted((PartialResult.load(partialPath) for partialPath in partialPaths),
+                      key=lambda partial: partial.rangeStart)
+    for previous, current in zip(partials, partials[1:]):
+        if previous.rangeEnd != current.rangeStart:
+            raise Exception(f'Partial results are not contiguous: '
+                            f'{previous.rangeEnd} != {current.rangeStart}')
+    with Timer('Partial Results Merged'):
+        featureSet = sortFeatures(mergePartials(partials, flowTimeout, activityTimeout))
+    with Timer(f'Features Saved to {csvPath}'):
+        featureSet2csv(csvPath, featureSet)
+    print(f'Flows: {len(featureSet)}')
+
+
+def _pcap2partialStar(args):
+    return pcap2partial(*args)
+
+
+def splitTimeRange(pcapPath, workers: int) -> List[Tuple[float, float]]:
+    """
+    Split the capture time span into equal contiguous ranges (microseconds);
+    the first and the last ranges are open so that no packet is lost
+    """
+    first, last = captureTimeRange(pcapPath)
+    first, last = second2microsecond(first), second2microsecond(last)
+    bounds = [first + (last - first) * i / workers for i in range(1, workers)]
+    bounds = [-math.inf] + bounds + [math.inf]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def parallelPcap2csv(pcapPath=None, csvPath=None, workers: int = 4,
+                     direction: AnyStr = 'bidirectional',
+                     sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
+                     flowTimeout=Flow.defaultFlowTimeout,
+                     activityTimeout=Flow.defaultActivityTimeout,
+                     partialDir=None):
+    """
+    Local stand-in for multi-node processing: split a capture by time range,
+    extract the ranges in worker processes, and merge the partial results
+    :param pcapPath: PCAP/PCAPNG file path; if it is None, user need to input the file path
+    :param csvPath: CSV file path; if it is None, it is generated next to the PCAP file
+    :param workers: number of worker processes (time ranges)
+    :param direction: unidirectional or bidirectional
+    :param sessionExtractor: session extractor (must be picklable)
+    :param flowTimeout: flow timeout in microseconds
+    :param activityTimeout: activity timeout in microseconds
+    :param partialDir: directory of partial result files; if it is None, the folder of the PCAP file
+    """
+    if pcapPath is None:
+        pcapPath = input('PCAP/PCAPNG File Path: ')
+    pcapPath = Path(pcapPath)
+    csvPath = pcapPath.with_suffix('.csv') if csvPath is None else csvPath
+    partialDir = pcapPath.parent if partialDir is None else Path(partialDir)
+    print(f'{len(FeatureExtractor.extractors)} Feature Extractors are Invoked: ')
+    FeatureExtractor.printExistingExtractors()
+    ranges = splitTimeRange(pcapPath, workers)
+    jobs = [(pcapPath, partialDir / f'{pcapPath.stem}.part{i}', rangeStart, rangeEnd, direction,
+             sessionExtractor, flowTimeout, activityTimeout) for i, (rangeStart, rangeEnd) in enumerate(ranges)]
+    with Timer(f'{len(jobs)} Partial Results Generated'):
+        with Pool(workers) as pool:
+            partialPaths = pool.map(_pcap2partialStar, jobs)
+    partials2csv(partialPaths, csvPath, flowTimeout, activityTimeout)
+    for partialPath in partialPaths:
+        Path(partialPath).unlink()
@@ -0,0 +1,118 @@
+import math
+
+from NetworkFlowMeter.NetworkTyping import Optional, Collection, Any, List, Tuple, Dict
+
+
+class TDigest(object):
+    """
+    Merging t-digest: streaming quantile estimation with a bounded number of centroids (about compression),
+    accurate at the tails (k1 scale function), and mergeable, e.g., Flow = merge(Fwd, Bwd).
+    Values are buffered and only merged into centroids once the buffer is full,
+    so small streams (fewer values than the buffer) are kept exactly
+    """
+
+    def __init__(self, compression: float = 100, bufferSize: Optional[int] = None):
+        self.compression = compression
+        self.bufferSize = int(5 * compression) if bufferSize is None else bufferSize
+        # centroids sorted by mean
+        self.centroids: List[Tuple[float, float]] = list()
+        self.buffer: List[Tuple[float, float]] = list()
+        self.total = 0.0
+        self.min, self.max = math.inf, -math.inf
+
+    def __len__(self):
+        return int(self.total)
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _qLimit(self, q: float) -> float:
+        k = self._k(q) + 1
+        if k >= self.compression / 4:
+            return 1.0
+        return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+    def add(self, x: Any, w: float = 1):
+        x = float(x)
+        self.buffer.append((x, w))
+        self.total += w
+        self.min, self.max = min(self.min, x), max(self.max, x)
+        if len(self.buffer) >= self.bufferSize:
+            self.compress()
+
+    def extend(self, numList: Collection[Any]) -> 'TDigest':
+        for x in numList:
+            self.add(x)
+        return self
+
+    def compress(self):
+        """Merge the buffer into the centroids, respecting the size limit of the scale function"""
+        if len(self.buffer) == 0:
+            return
+        points = sorted(self.centroids + self.buffer)
+        self.buffer = list()
+        total, centroids = self.total, list()
+        mean, weight = points[0]
+        soFar, qLimit = 0.0, self._qLimit(0.0)
+        for x, w in points[1:]:
+            if (soFar + weight + w) / total <= qLimit:
+                weight += w
+                mean += (x - mean) * w / weight
+            else:
+                centroids.append((mean, weight))
+                soFar += weight
+                qLimit = self._qLimit(soFar / total)
+                mean, weight = x, w
+        centroids.append((mean, weight))
+        self.centroids = centroids
+
+    def merged(self, other: 'TDigest') -> 'TDigest':
+        """A new digest of both streams; neither digest is modified"""
+        merged = TDigest(self.compression, self.bufferSize)
+        merged.buffer = self.centroids + self.buffer + other.centroids + other.buffer
+        merged.total = self.total + other.total
+        merged.min, merged.max = min(self.min, other.min), max(self.max, other.max)
+        if len(merged.buffer) >= merged.bufferSize:
+            merged.compress()
+        return merged
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        :param q: within [0, 1]
+        :return: estimated quantile; None if the digest is empty
+        """
+        if self.total == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        target = q * self.total
+        # interpolate between centroid centers (buffered values are centroids of their own);
+        # min and max anchor both ends
+        prevCenter, prevMean, cumulative = 0.0, self.min, 0.0
+        for mean, weight in sorted(self.centroids + self.buffer):
+            center = cumulative + weight / 2
+            if target < center:
+                if center == prevCenter:
+                    return mean
+                return prevMean + (mean - prevMean) * (target - prevCenter) / (center - prevCenter)
+            prevCenter, prevMean = center, mean
+            cumulative += weight
+        if self.total == prevCenter:
+            return self.max
+        return prevMean + (self.max - prevMean) * (target - prevCenter) / (self.total - prevCenter)
+
+
+def quantileName(q: float) -> str:
+    """0.5 => P50, 0.999 => P99.9"""
+    return f'P{q * 100:g}'
+
+
+def addQuantileChar2Dict(d: Dict, baseName: Optional[str], digest: TDigest, quantiles: Collection[float],
+                         defaultValue: float = 0) -> Dict:
+    baseName = '' if baseName is None or baseName == '' else f'{baseName} '
+    for q in quantiles:
+        value = digest.quantile(q)
+        d[f'{baseName}{quantileName(q)}'] = value if value is not None else defaultValue
+    return d
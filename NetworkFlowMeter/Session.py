@@ -2,8 +2,8 @@ from collections import defaultdict
 
 from pyprobar import probar
 
-from NetworkFlowMeter.NetworkTyping import Optional, Callable, Any, AnyStr, List, Tuple, Packet, Sessions, \
-    SessionKeyInfo
+from NetworkFlowMeter.NetworkTyping import Optional, Callable, Collection, Any, AnyStr, List, Tuple, Dict, Packet, \
+    Sessions, SessionKeyInfo
 from NetworkFlowMeter.Settings import progressBarColor
 
 
@@ -20,39 +20,133 @@ def directionalField(field1: Any, field2: Any) -> (Any, Any, AnyStr):
     return (field1, field2, 'Forward') if field1 <= field2 else (field2, field1, 'Backward')
 
 
-def defaultBidirectionalSessionExtractor(p: Packet) -> (AnyStr, AnyStr):
+class SessionRule(object):
     """
-    These messy codes are generating p's session key and indicating the direction of p
-    :param p: Packet
-    :return: (session key, direction)
+    Declarative description of the session key of one kind of packets:
+    '<protocol> <address 1> <port 1> <address 2> <port 2> [<extra fields>]',
+    where the addresses are sorted (so that both directions share the key) and the ports follow them
     """
-    sessionKey, pDirection = '', 'Forward'
-    if 'WPAN' in p:
-        if 'IPv6' in p:
-            ip1, ip2, pDirection = directionalField(p.ip.src, p.ip.dst) if 'IP' in p \
-                else directionalField(p.ipv6.src, p.ipv6.dst)
-            if 'TCP' in p:
-                port1, port2 = (p.tcp.srcport, p.tcp.dstport) if pDirection == 'Forward' \
-                    else (p.tcp.dstport, p.tcp.srcport)
-                sessionKey = f'TCP {ip1} {port1} {ip2} {port2}'
-            elif 'UDP' in p:
-                port1, port2 = (p.udp.srcport, p.udp.dstport) if pDirection == 'Forward' \
-                    else (p.udp.dstport, p.udp.srcport)
-                sessionKey = f'UDP {ip1} {port1} {ip2} {port2}'
-            elif 'ICMP' in p:
-                icmpType, icmpCode, icmpId = p.icmp.type, p.icmp.code, p.icmp.id
-                sessionKey = f'ICMP {ip1} 0 {ip2} 0 {icmpType} {icmpCode} {icmpId}'
-            # Scapy cannot guess ICMPv6 protocol, so we extract it under IPv6
-            elif 'ICMPv6' in p:
-                icmpv6Type, icmpv6Code = p.icmpv6.type, p.icmpv6.code
-                sessionKey = f'ICMPv6 {ip1} 0 {ip2} 0 {icmpv6Type} {icmpv6Code}'
-            else:
-                sessionKey = f'IPv6 {ip1} 0 {ip2} 0 {p["IPv6.nh"]}'
+
+    def __init__(self, protocol: AnyStr, layers: Collection[AnyStr] = (),
+                 addresses: Collection[Tuple[AnyStr, AnyStr, AnyStr]] = (),
+                 ports: Optional[Tuple[AnyStr, AnyStr, AnyStr]] = None,
+                 extras: Collection[Tuple[AnyStr, AnyStr]] = ()):
+        """
+        :param protocol: the first element of the key
+        :param layers: layers which must all be present for the rule to apply
+        :param addresses: candidates of (layer, src field, dst field); the first present layer gives the addresses.
+                          Without addresses, the addresses and the ports are 0, and the direction is Forward
+        :param ports: (layer, src field, dst field); without ports, the ports are 0
+        :param extras: (layer, field) appended to the key, e.g., ICMP type and code
+        """
+        self.protocol = protocol
+        self.layers = tuple(layer.lower() for layer in layers)
+        self.addresses = tuple((layer.lower(), src, dst) for layer, src, dst in addresses)
+        self.ports = None if ports is None else (ports[0].lower(), ports[1], ports[2])
+        self.extras = tuple((layer.lower(), field) for layer, field in extras)
+
+    def __repr__(self):
+        return f'SessionRule({self.protocol!r}, {self.layers!r}, {self.addresses!r}, {self.ports!r}, {self.extras!r})'
+
+
+class SessionExtractor(object):
+    """
+    Session extractor compiled from a session key spec (rules in priority order, the first applicable one is used;
+    the last rule should require no layer, as a catch-all).
+    Every layer named in the spec gets a bit; a packet's layers are scanned once into a bitmask,
+    and the key function specialised for that combination of layers is built once and memoised
+    """
+
+    def __init__(self, spec: Collection[SessionRule]):
+        self.spec = tuple(spec)
+        self.compile()
+
+    def compile(self):
+        layerNames = sorted({layer for rule in self.spec
+                             for layer in rule.layers + tuple(address[0] for address in rule.addresses)})
+        self.layerBits: Dict[AnyStr, int] = {layer: 1 << i for i, layer in enumerate(layerNames)}
+        self.requiredMasks = [sum(self.layerBits[layer] for layer in set(rule.layers)) for rule in self.spec]
+        self.keyFunctions: Dict[int, Callable[[Dict[AnyStr, Any]], Tuple[AnyStr, AnyStr]]] = dict()
+
+    def __getstate__(self):
+        return {'spec': self.spec}
+
+    def __setstate__(self, state):
+        self.spec = state['spec']
+        self.compile()
+
+    def __repr__(self):
+        return f'SessionExtractor({list(self.spec)!r})'
+
+    def specialise(self, mask: int) -> Callable[[Dict[AnyStr, Any]], Tuple[AnyStr, AnyStr]]:
+        """Build the key function of packets whose layers are given by the mask"""
+        for rule, requiredMask in zip(self.spec, self.requiredMasks):
+            if mask & requiredMask == requiredMask:
+                break
         else:
-            sessionKey = f'WPAN 0 0 0 0 {p.wpan.frame_type}'
-    else:
-        sessionKey, pDirection = 'OTHER 0 0 0 0', 'Forward'
-    return sessionKey, pDirection
+            layerNames = [layer for layer, bit in self.layerBits.items() if mask & bit]
+            raise Exception(f'No session rule matches layers {layerNames}')
+        protocol, ports, extras = rule.protocol, rule.ports, rule.extras
+        address = next((a for a in rule.addresses if mask & self.layerBits[a[0]]), None)
+
+        if address is None:
+            def keyFunction(layers):
+                extraValues = ''.join(f' {getattr(layers[layer], field)}' for layer, field in extras)
+                return f'{protocol} 0 0 0 0{extraValues}', 'Forward'
+            return keyFunction
+
+        addressLayer, srcField, dstField = address
+
+        def keyFunction(layers):
+            ipLayer = layers[addressLayer]
+            ip1, ip2, pDirection = directionalField(getattr(ipLayer, srcField), getattr(ipLayer, dstField))
+            if ports is None:
+                port1, port2 = 0, 0
+            else:
+                portLayer = layers[ports[0]]
+                port1, port2 = (getattr(portLayer, ports[1]), getattr(portLayer, ports[2])) \
+                    if pDirection == 'Forward' else (getattr(portLayer, ports[2]), getattr(portLayer, ports[1]))
+            extraValues = ''.join(f' {getattr(layers[layer], field)}' for layer, field in extras)
+            return f'{protocol} {ip1} {port1} {ip2} {port2}{extraValues}', pDirection
+        return keyFunction
+
+    def __call__(self, p: Packet) -> Tuple[AnyStr, AnyStr]:
+        """
+        :param p: Packet
+        :return: (session key, direction)
+        """
+        layers, mask, layerBits = dict(), 0, self.layerBits
+        for layer in p.layers:
+            # the outermost layer wins, as p.<layer> does
+            if layer.layer_name not in layers:
+                layers[layer.layer_name] = layer
+                mask |= layerBits.get(layer.layer_name, 0)
+        keyFunction = self.keyFunctions.get(mask)
+        if keyFunction is None:
+            keyFunction = self.keyFunctions[mask] = self.specialise(mask)
+        return keyFunction(layers)
+
+
+def compileSessionExtractor(spec: Collection[SessionRule]) -> SessionExtractor:
+    """Compile a session key spec into a session extractor (picklable, so it can be sent to worker processes)"""
+    return SessionExtractor(spec)
+
+
+# IPv4 is preferred over IPv6 if both are present
+ipAddresses = (('ip', 'src', 'dst'), ('ipv6', 'src', 'dst'))
+defaultSessionKeySpec = [
+    SessionRule('TCP', ('wpan', 'ipv6', 'tcp'), ipAddresses, ('tcp', 'srcport', 'dstport')),
+    SessionRule('UDP', ('wpan', 'ipv6', 'udp'), ipAddresses, ('udp', 'srcport', 'dstport')),
+    SessionRule('ICMP', ('wpan', 'ipv6', 'icmp'), ipAddresses,
+                extras=(('icmp', 'type'), ('icmp', 'code'), ('icmp', 'id'))),
+    # Scapy cannot guess ICMPv6 protocol, so we extract it under IPv6
+    SessionRule('ICMPv6', ('wpan', 'ipv6', 'icmpv6'), ipAddresses, extras=(('icmpv6', 'type'), ('icmpv6', 'code'))),
+    SessionRule('IPv6', ('wpan', 'ipv6'), ipAddresses, extras=(('ipv6', 'nxt'),)),
+    SessionRule('WPAN', ('wpan',), extras=(('wpan', 'frame_type'),)),
+    SessionRule('OTHER'),
+]
+# generate p's session key and indicate the direction of p
+defaultBidirectionalSessionExtractor = compileSessionExtractor(defaultSessionKeySpec)
 
 
 def defaultSessionKeyInfo(sessionKey: AnyStr) -> SessionKeyInfo:
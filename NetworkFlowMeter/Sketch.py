@@ -0,0 +1,234 @@
+import hashlib
+import math
+from collections import defaultdict
+
+from NetworkFlowMeter.NetworkTyping import Callable, Optional, Iterable, AnyStr, Any, List, Tuple, Dict, Packet
+from NetworkFlowMeter.Session import defaultBidirectionalSessionExtractor, defaultSessionKeyInfo
+from NetworkFlowMeter.Utils import progress
+
+
+def stableHash(item: Any, seed: int = 0) -> int:
+    """
+    64-bit hash which is stable between runs (unlike built-in hash with PYTHONHASHSEED)
+    :param item: anything which can be converted to str
+    :param seed: different seeds give independent hash functions
+    :return: 64-bit unsigned integer
+    """
+    digest = hashlib.blake2b(str(item).encode(), digest_size=8, salt=seed.to_bytes(16, 'little'))
+    return int.from_bytes(digest.digest(), 'little')
+
+
+class CountMinSketch(object):
+    """
+    Count-Min sketch: approximate counts in fixed memory (width * depth counters).
+    Estimates never underestimate; the error is at most e / width * total with
+    probability 1 - exp(-depth)
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width, self.depth = width, depth
+        self.table = [[0] * width for _ in range(depth)]
+        self.total = 0
+
+    def _indexes(self, item):
+        # double hashing: two independent 32-bit halves generate depth hash functions
+        h = stableHash(item)
+        h1, h2 = h & 0xFFFFFFFF, h >> 32
+        return [(h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, item: Any, count: float = 1):
+        for row, index in enumerate(self._indexes(item)):
+            self.table[row][index] += count
+        self.total += count
+
+    def estimate(self, item: Any) -> float:
+        return min(self.table[row][index] for row, index in enumerate(self._indexes(item)))
+
+    def merge(self, other: 'CountMinSketch'):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise Exception('Count-Min sketches with different shapes cannot be merged')
+        for row in range(self.depth):
+            self.table[row] = [a + b for a, b in zip(self.table[row], other.table[row])]
+        self.total += other.total
+
+
+class HyperLogLog(object):
+    """
+    HyperLogLog distinct counter using 2 ** precision one-byte registers;
+    standard error is about 1.04 / sqrt(2 ** precision)
+    """
+
+    def __init__(self, precision: int = 10):
+        if not 4 <= precision <= 16:
+            raise Exception('HyperLogLog precision must be within [4, 16]')
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    def add(self, item: Any):
+        h = stableHash(item, seed=1)
+        index = h & (self.m - 1)
+        w = h >> self.precision
+        # position of the leftmost 1-bit within the remaining (64 - precision) bits
+        rank = (64 - self.precision) - w.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros != 0:
+            # small range correction: linear counting
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other: 'HyperLogLog'):
+        if self.precision != other.precision:
+            raise Exception('HyperLogLogs with different precisions cannot be merged')
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def __len__(self):
+        return self.count()
+
+
+class SpaceSaving(object):
+    """
+    Space-Saving heavy hitters: keep at most capacity counters;
+    a new item replaces the smallest counter and inherits its count as error
+    """
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self.counters: Dict[Any, float] = dict()
+        self.errors: Dict[Any, float] = dict()
+
+    def add(self, item: Any, weight: float = 1) -> Optional[Any]:
+        """
+        :param item: item
+        :param weight: weight of the item, e.g., 1 for packets, length for bytes
+        :return: the evicted item if there is one, otherwise None
+        """
+        if item in self.counters:
+            self.counters[item] += weight
+            return None
+        if len(self.counters) < self.capacity:
+            self.counters[item], self.errors[item] = weight, 0
+            return None
+        evicted = min(self.counters, key=self.counters.get)
+        minCount = self.counters.pop(evicted)
+        self.errors.pop(evicted)
+        self.counters[item], self.errors[item] = minCount + weight, minCount
+        return evicted
+
+    def __contains__(self, item):
+        return item in self.counters
+
+    def top(self, k: int = 10) -> List[Tuple[Any, float, float]]:
+        """
+        :param k: number of items
+        :return: [(item, count, error)], count - error is a guaranteed lower bound
+        """
+        items = sorted(self.counters.items(), key=lambda kv: kv[1], reverse=True)[:k]
+        return [(item, count, self.errors[item]) for item, count in items]
+
+
+class TrafficSummary(object):
+    """
+    One-pass, bounded-memory triage summary of a capture:
+    top talkers by packets/bytes, distinct destinations per talker (scan detection),
+    and per-protocol cardinalities
+    """
+
+    def __init__(self, capacity: int = 100, width: int = 2048, depth: int = 4, precision: int = 10):
+        self.precision = precision
+        self.packets, self.bytes = 0, 0.0
+        self.packetTalkers, self.byteTalkers = SpaceSaving(capacity), SpaceSaving(capacity)
+        self.packetSketch, self.byteSketch = CountMinSketch(width, depth), CountMinSketch(width, depth)
+        # distinct destinations are only kept for tracked talkers to bound memory
+        self.talkerPeers: Dict[AnyStr, HyperLogLog] = dict()
+        self.talkerPorts: Dict[AnyStr, HyperLogLog] = dict()
+        self.protocolPackets = defaultdict(int)
+        self.protocolFlows = defaultdict(lambda: HyperLogLog(precision))
+        self.protocolSrcs = defaultdict(lambda: HyperLogLog(precision))
+        self.protocolDsts = defaultdict(lambda: HyperLogLog(precision))
+
+    def add(self, sessionKey: AnyStr, pDirection: AnyStr, length: float):
+        protocol, ip1, port1, ip2, port2 = defaultSessionKeyInfo(sessionKey)
+        src, dst, dstPort = (ip1, ip2, port2) if pDirection == 'Forward' else (ip2, ip1, port1)
+        self.packets += 1
+        self.bytes += length
+        self.packetSketch.add(src)
+        self.byteSketch.add(src, length)
+        self.byteTalkers.add(src, length)
+        evicted = self.packetTalkers.add(src)
+        if evicted is not None:
+            self.talkerPeers.pop(evicted, None)
+            self.talkerPorts.pop(evicted, None)
+        if src not in self.talkerPeers:
+            self.talkerPeers[src] = HyperLogLog(self.precision)
+            self.talkerPorts[src] = HyperLogLog(self.precision)
+        self.talkerPeers[src].add(dst)
+        self.talkerPorts[src].add(f'{dst} {dstPort}')
+        self.protocolPackets[protocol] += 1
+        self.protocolFlows[protocol].add(sessionKey)
+        self.protocolSrcs[protocol].add(src)
+        self.protocolDsts[protocol].add(dst)
+
+    def topTalkers(self, k: int = 10, byBytes=False) -> List[Tuple[AnyStr, float]]:
+        """
+        Space-Saving and Count-Min both overestimate, so the smaller estimate is used
+        """
+        talkers, sketch = (self.byteTalkers, self.byteSketch) if byBytes else (self.packetTalkers, self.packetSketch)
+        return [(src, min(count, sketch.estimate(src))) for src, count, _ in talkers.top(k)]
+
+    def topScanners(self, k: int = 10) -> List[Tuple[AnyStr, int, int]]:
+        """
+        :return: [(src, distinct destination hosts, distinct destination services)]
+        """
+        scanners = [(src, hll.count(), self.talkerPorts[src].count()) for src, hll in self.talkerPeers.items()]
+        scanners.sort(key=lambda s: (s[1], s[2]), reverse=True)
+        return scanners[:k]
+
+    def protocolCardinalities(self) -> Dict[AnyStr, Dict[AnyStr, int]]:
+        return {protocol: {'Packets': count,
+                           'Flows': self.protocolFlows[protocol].count(),
+                           'Srcs': self.protocolSrcs[protocol].count(),
+                           'Dsts': self.protocolDsts[protocol].count()}
+                for protocol, count in sorted(self.protocolPackets.items(), key=lambda kv: kv[1], reverse=True)}
+
+    def __str__(self):
+        lines = [f'Packets: {self.packets}', f'Bytes: {self.bytes:.0f}', 'Top Talkers (Packets):']
+        lines += [f'    {src}: {count:.0f}' for src, count in self.topTalkers()]
+        lines += ['Top Talkers (Bytes):']
+        lines += [f'    {src}: {count:.0f}' for src, count in self.topTalkers(byBytes=True)]
+        lines += ['Top Scanners (Distinct Dst Hosts / Services):']
+        lines += [f'    {src}: {hosts} / {services}' for src, hosts, services in self.topScanners()]
+        lines += ['Protocols (Packets / Flows / Srcs / Dsts):']
+        lines += [f'    {protocol}: {c["Packets"]} / {c["Flows"]} / {c["Srcs"]} / {c["Dsts"]}'
+                  for protocol, c in self.protocolCardinalities().items()]
+        return '\n'.join(lines)
+
+
+def packets2summary(packets: Iterable[Packet],
+                    sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
+                    capacity: int = 100, width: int = 2048, depth: int = 4,
+                    precision: int = 10) -> TrafficSummary:
+    """
+    Summarise packets in one pass, using the same session extractor as generateSessions
+    :param packets: packets; a lazy iterator keeps memory bounded
+    :param sessionExtractor: session extractor
+    :param capacity: number of heavy hitters tracked
+    :param width: Count-Min sketch width
+    :param depth: Count-Min sketch depth
+    :param precision: HyperLogLog precision
+    :return: traffic summary
+    """
+    if sessionExtractor is None:
+        sessionExtractor = defaultBidirectionalSessionExtractor
+    summary = TrafficSummary(capacity, width, depth, precision)
+    for p in progress(packets):
+        sessionKey, pDirection = sessionExtractor(p)
+        summary.add(sessionKey, pDirection, float(p.frame_info.len))
+    return summary
@@ -0,0 +1,185 @@
+import math
+
+from NetworkFlowMeter.BuiltinFeatureExtractors.Bfe4TcpFlagCounter import tcpFlags
+from NetworkFlowMeter.Feature import addCountSpeed2features
+from NetworkFlowMeter.Flow import Flow, FlowTable
+from NetworkFlowMeter.NetworkTyping import Callable, Optional, Collection, AnyStr, List, Tuple, Packet, Features
+from NetworkFlowMeter.Quantile import TDigest, addQuantileChar2Dict
+from NetworkFlowMeter.Utils import packetTsNanoseconds, packetTsMicroseconds, ReadableTs
+
+
+class RunningStats(object):
+    """
+    Min/Max/Sum/Ave/Std of a number stream in O(1) memory (Welford),
+    mergeable so that Flow statistics are derived from Fwd and Bwd ones
+    """
+
+    def __init__(self):
+        self.n, self.min, self.max, self.sum, self.mean, self.m2 = 0, math.inf, -math.inf, 0.0, 0.0, 0.0
+
+    def add(self, x: float):
+        self.n += 1
+        self.min, self.max, self.sum = min(self.min, x), max(self.max, x), self.sum + x
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def merged(self, other: 'RunningStats') -> 'RunningStats':
+        merged = RunningStats()
+        merged.n = self.n + other.n
+        if merged.n == 0:
+            return merged
+        merged.min, merged.max, merged.sum = min(self.min, other.min), max(self.max, other.max), self.sum + other.sum
+        delta = other.mean - self.mean
+        merged.mean = self.mean + delta * other.n / merged.n
+        merged.m2 = self.m2 + other.m2 + delta * delta * self.n * other.n / merged.n
+        return merged
+
+    def addChar2Dict(self, d: Features, baseName: str, charSum=True, defaultValue: float = 0) -> Features:
+        """Same names and defaults as addMathChar2Dict"""
+        d[f'{baseName} Min'] = self.min if self.n >= 1 else defaultValue
+        d[f'{baseName} Max'] = self.max if self.n >= 1 else defaultValue
+        if charSum:
+            d[f'{baseName} Sum'] = self.sum if self.n >= 1 else defaultValue
+        d[f'{baseName} Ave'] = self.mean if self.n >= 1 else defaultValue
+        d[f'{baseName} Std'] = math.sqrt(self.m2 / (self.n - 1)) if self.n >= 2 else defaultValue
+        return d
+
+
+class DirectionState(object):
+    """Incremental state of one direction of a flow; t-digests are only kept if quantiles are requested"""
+
+    def __init__(self, quantiles: Collection[float] = ()):
+        self.pktLen, self.iat = RunningStats(), RunningStats()
+        self.pktLenDigest, self.iatDigest = (TDigest(), TDigest()) if len(quantiles) != 0 else (None, None)
+        # nanoseconds
+        self.lastTs: Optional[int] = None
+        self.bytes = 0.0
+        self.flags = {flagName: 0.0 for flagName in tcpFlags}
+
+    def add(self, p: Packet, isTcp: bool):
+        length, ts = float(p.frame_info.len), packetTsNanoseconds(p)
+        self.pktLen.add(length)
+        self.bytes += length
+        if self.pktLenDigest is not None:
+            self.pktLenDigest.add(length)
+        if self.lastTs is not None:
+            iat = (ts - self.lastTs) / 1000000000.0
+            self.iat.add(iat)
+            if self.iatDigest is not None:
+                self.iatDigest.add(iat)
+        self.lastTs = ts
+        if isTcp:
+            for flagName, fieldName in tcpFlags.items():
+                self.flags[flagName] += float(getattr(p.tcp, fieldName))
+
+
+class FlowState(object):
+    """
+    Incremental per-flow state covering the built-in statistics
+    (PacketCounter, InterArrivalTime, TcpFlagCounter), updated once per packet
+    """
+
+    def __init__(self, quantiles: Collection[float] = ()):
+        self.quantiles = tuple(quantiles)
+        self.forward, self.backward = DirectionState(quantiles), DirectionState(quantiles)
+        self.emitted = False
+
+    def add(self, flow: Flow, p: Packet):
+        state = self.forward if p.pDirection == 'Forward' else self.backward
+        state.add(p, flow.protocol() == 'TCP')
+
+    def features(self, flow: Flow, emission: AnyStr) -> Features:
+        """
+        Snapshot row; statistics use the same names as the built-in extractors
+        :param flow: flow
+        :param emission: 'Early' or 'Snapshot'
+        :return: features
+        """
+        protocol, srcIp, srcPort, dstIp, dstPort = flow.sessionKeyInfo
+        fwd, bwd = self.forward, self.backward
+        duration = flow.duration(f='s')
+        features = {
+            'Emission': emission,
+            'Session Key': flow.sessionKey,
+            'Protocol': protocol,
+            'Src IP': srcIp,
+            'Src Port': srcPort,
+            'Dst IP': dstIp,
+            'Dst Port': dstPort,
+            'Init Ts': ReadableTs(flow.initialPacketNs),
+            'Last Ts': ReadableTs(flow.lastPacketNs),
+            'Ts': flow.initialPacketTs,
+            'Duration': flow.duration(),
+        }
+        fwd.iat.addChar2Dict(features, 'Fwd IAT')
+        bwd.iat.addChar2Dict(features, 'Bwd IAT')
+        fwd.iat.merged(bwd.iat).addChar2Dict(features, 'Flow IAT', charSum=False)
+        fwd.pktLen.addChar2Dict(features, 'Fwd Pkt Len')
+        bwd.pktLen.addChar2Dict(features, 'Bwd Pkt Len')
+        fwd.pktLen.merged(bwd.pktLen).addChar2Dict(features, 'Flow Pkt Len', charSum=False)
+        if len(self.quantiles) != 0:
+            for baseName, fwdDigest, bwdDigest in (('IAT', fwd.iatDigest, bwd.iatDigest),
+                                                   ('Pkt Len', fwd.pktLenDigest, bwd.pktLenDigest)):
+                addQuantileChar2Dict(features, f'Fwd {baseName}', fwdDigest, self.quantiles)
+                addQuantileChar2Dict(features, f'Bwd {baseName}', bwdDigest, self.quantiles)
+                addQuantileChar2Dict(features, f'Flow {baseName}', fwdDigest.merged(bwdDigest), self.quantiles)
+        addCountSpeed2features(features, 'Pkt', fwd.pktLen.n, bwd.pktLen.n, duration)
+        addCountSpeed2features(features, 'Byte', fwd.bytes, bwd.bytes, duration)
+        for flagName in tcpFlags:
+            addCountSpeed2features(features, flagName, fwd.flags[flagName], bwd.flags[flagName], duration)
+        return features
+
+
+class SnapshotFlowTable(FlowTable):
+    """
+    Flow table with emission policies for low-latency detection:
+    - early: emit a row once a flow has earlyPackets packets
+    - periodic: every snapshotInterval microseconds of capture time, emit a row for every alive flow
+    Rows are computed from incremental flow state in O(1) per flow, instead of re-running flow2feature.
+    Quantiles of packet length and IAT are maintained with fixed-size t-digests per direction.
+    Emitted rows are collected until takeSnapshots is invoked
+    """
+
+    def __init__(self, direction: AnyStr = 'bidirectional',
+                 sessionExtractor: Optional[Callable[[Packet], Tuple[AnyStr, AnyStr]]] = None,
+                 expiry: bool = False,
+                 earlyPackets: Optional[int] = None,
+                 snapshotInterval: Optional[float] = None,
+                 quantiles: Collection[float] = ()):
+        super(SnapshotFlowTable, self).__init__(direction, sessionExtractor, expiry)
+        self.quantiles = tuple(quantiles)
+        self.earlyPackets = earlyPackets
+        self.snapshotInterval = snapshotInterval
+        self.nextSnapshotTs: Optional[float] = None
+        self.snapshots: List[Features] = list()
+
+    def add(self, p: Packet) -> Optional[Flow]:
+        if self.snapshotInterval is not None:
+            ts = packetTsMicroseconds(p)
+            if self.nextSnapshotTs is None:
+                self.nextSnapshotTs = ts + self.snapshotInterval
+            elif ts >= self.nextSnapshotTs:
+                self.snapshot(ts)
+                # skip the intervals without packets
+                intervals = (ts - self.nextSnapshotTs) // self.snapshotInterval + 1
+                self.nextSnapshotTs += intervals * self.snapshotInterval
+        return super(SnapshotFlowTable, self).add(p)
+
+    def onPacket(self, flow: Flow, p: Packet):
+        if not hasattr(flow, 'state'):
+            flow.state = FlowState(self.quantiles)
+        flow.state.add(flow, p)
+        if self.earlyPackets is not None and not flow.state.emitted and len(flow) >= self.earlyPackets:
+            flow.state.emitted = True
+            self.snapshots.append(flow.state.features(flow, 'Early'))
+
+    def snapshot(self, ts: float):
+        """Snapshot alive flows which can still accept packets at ts"""
+        for flow in self.aliveFlows.values():
+            if ts - flow.initialPacketTs <= flow.flowTimeout:
+                self.snapshots.append(flow.state.features(flow, 'Snapshot'))
+
+    def takeSnapshots(self) -> List[Features]:
+        snapshots, self.snapshots = self.snapshots, list()
+        return snapshots
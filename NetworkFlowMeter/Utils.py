@@ -1,9 +1,13 @@
 import time
+from functools import lru_cache
 
+import numpy as np
 import pandas as pd
+from pyprobar import probar
 
-from NetworkFlowMeter.NetworkTyping import AnyStr
+from NetworkFlowMeter.NetworkTyping import AnyStr, Optional, Collection, List
 from NetworkFlowMeter.NetworkTyping import Packet, FeatureSet, DataFrame
+from NetworkFlowMeter.Settings import progressBarColor
 
 
 def second2microsecond(t) -> float:
@@ -20,13 +24,95 @@ def formatMicrosecond(t) -> AnyStr:
     return s + '.' + (f'{seconds % 1:.6f}'[-6:])
 
 
+@lru_cache(maxsize=4096)
+def _formatSecond(seconds: int) -> AnyStr:
+    # flows of a capture share few distinct seconds, so strftime runs once per second
+    return time.strftime('%Y-%m-%d %X', time.localtime(seconds))
+
+
+def formatNanosecond(t: int) -> AnyStr:
+    # rounded to microseconds, as formatMicrosecond
+    seconds, microseconds = divmod((int(t) + 500) // 1000, 1000000)
+    return f'{_formatSecond(seconds)}.{microseconds:06d}'
+
+
+def formatNanoseconds(ts: Collection[int]) -> List[AnyStr]:
+    """Vectorised formatNanosecond: strftime once per distinct second, fractions formatted by numpy"""
+    ts = np.asarray(ts, dtype=np.int64)
+    if len(ts) == 0:
+        return list()
+    seconds, microseconds = np.divmod((ts + 500) // 1000, 1000000)
+    uniqueSeconds, inverse = np.unique(seconds, return_inverse=True)
+    prefixes = np.array([_formatSecond(int(s)) + '.' for s in uniqueSeconds])
+    fractions = np.char.zfill(microseconds.astype(str), 6)
+    return np.char.add(prefixes[inverse], fractions).tolist()
+
+
+class ReadableTs(int):
+    """
+    Timestamp in nanoseconds which is only formatted (as formatMicrosecond) when it is written out,
+    by str (e.g., the CSV writer), or in one vectorised pass per column (formatReadableTs)
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return formatNanosecond(self)
+
+    def __repr__(self):
+        return repr(formatNanosecond(self))
+
+
+def formatReadableTs(featureSet: FeatureSet) -> FeatureSet:
+    """
+    Rows with their ReadableTs columns formatted into strings (rows are copied, not modified)
+    """
+    if len(featureSet) == 0:
+        return featureSet
+    readableColumns = {name: formatNanoseconds([features[name] for features in featureSet])
+                       for name, value in featureSet[0].items() if isinstance(value, ReadableTs)}
+    if len(readableColumns) == 0:
+        return featureSet
+    return [{**features, **{name: column[i] for name, column in readableColumns.items()}}
+            for i, features in enumerate(featureSet)]
+
+
+def parseNanoseconds(ts) -> int:
+    """'1600000000.123456789' => 1600000000123456789, exactly (without going through a float)"""
+    seconds, _, fraction = str(ts).partition('.')
+    return int(seconds) * 1000000000 + int(fraction[:9].ljust(9, '0'))
+
+
+def packetTsNanoseconds(packet: Packet) -> int:
+    """
+    Packet timestamp in integer nanoseconds; it is parsed once and kept on the packet
+    """
+    try:
+        return packet.tsNanoseconds
+    except AttributeError:
+        packet.tsNanoseconds = parseNanoseconds(packet.sniff_timestamp)
+        return packet.tsNanoseconds
+
+
 def packetTsMicroseconds(packet: Packet) -> float:
-    return second2microsecond(float(packet.sniff_timestamp))
+    return packetTsNanoseconds(packet) / 1000.0
 
 
 def packetTs(packet: Packet) -> float:
-    return float(packet.sniff_timestamp)
+    return packetTsNanoseconds(packet) / 1000000000.0
 
 
 def featureSet2dataframe(featureSet: FeatureSet) -> DataFrame:
-    return pd.DataFrame(featureSet)
+    return pd.DataFrame(formatReadableTs(featureSet))
+
+
+def progress(iterable, total: Optional[int] = None):
+    """
+    Wrap an iterable with the progress bar when its length is known;
+    lazy packet streams (generators) are returned as they are
+    :param iterable: iterable
+    :param total: total steps, if the iterable does not have __len__
+    :return: iterable
+    """
+    if total is None and not hasattr(iterable, '__len__'):
+        return iterable
+    return probar(iterable, total_steps=total, color=progressBarColor)
@@ -1,4 +1,46 @@
+import argparse
+import sys
+
 from NetworkFlowMeter.Comprehensive import pcap2csv
+from NetworkFlowMeter.Flow import Flow
+
+
+def parseArgs(args):
+    parser = argparse.ArgumentParser(prog='NetworkFlowMeter',
+                                     description='Extract flow features from PCAP/PCAPNG files into CSV files. '
+                                                 'Without inputs, capture paths are asked interactively.')
+    parser.add_argument('inputs', nargs='+', help='capture files, directories, or glob patterns')
+    parser.add_argument('-o', '--output-dir', default=None, help='folder of CSV files (default: next to captures)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of processes (default: CPUs)')
+    parser.add_argument('-f', '--force', action='store_true', help='extract captures with up-to-date CSV files')
+    parser.add_argument('-s', '--summary', default=None, help='summary CSV path (default: summary.csv)')
+    parser.add_argument('--direction', choices=['bidirectional', 'unidirectional'], default='bidirectional')
+    parser.add_argument('--flow-timeout', type=float, default=Flow.defaultFlowTimeout,
+                        help='flow timeout in microseconds')
+    parser.add_argument('--activity-timeout', type=float, default=Flow.defaultActivityTimeout,
+                        help='activity timeout in microseconds')
+    parser.add_argument('--context-window', type=float, default=None,
+                        help='add connection-context features over a window of this many microseconds')
+    parser.add_argument('--max-rows-in-memory', type=int, default=None,
+                        help='stream packets and sort rows externally with this many rows in memory')
+    parser.add_argument('--dedup-window', type=float, default=None,
+                        help='drop duplicate frames seen again within this many microseconds (SPAN captures)')
+    return parser.parse_args(args)
+
+
+def main():
+    if len(sys.argv) == 1:
+        while True:
+            pcap2csv()
+    from NetworkFlowMeter.Batch import batchPcap2csv
+
+    arguments = parseArgs(sys.argv[1:])
+    batchPcap2csv(arguments.inputs, arguments.output_dir, arguments.jobs, arguments.force, arguments.summary,
+                  direction=arguments.direction, flowTimeout=arguments.flow_timeout,
+                  activityTimeout=arguments.activity_timeout, contextWindow=arguments.context_window,
+                  maxRowsInMemory=arguments.max_rows_in_memory, dedupWindow=arguments.dedup_window)
+
 
-while True:
-    pcap2csv()
+# worker processes re-import this module when they are spawned
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import math
+import random
+import statistics
+
+import numpy as np
+
+from NetworkFlowMeter.TicToc import timing
+from NetworkFlowMeter import Kernels
+from NetworkFlowMeter.Feature import addMathChar2Dict
+
+
+def referenceMathChar2Dict(d, baseName, numList, charSum=True, defaultValue=0):
+    """addMathChar2Dict before the kernels (pure python and statistics)"""
+    numList = [float(n) for n in numList]
+    d[f'{baseName} Min'] = min(numList) if len(numList) >= 1 else defaultValue
+    d[f'{baseName} Max'] = max(numList) if len(numList) >= 1 else defaultValue
+    if charSum:
+        d[f'{baseName} Sum'] = sum(numList) if len(numList) >= 1 else defaultValue
+    d[f'{baseName} Ave'] = statistics.mean(numList) if len(numList) >= 1 else defaultValue
+    d[f'{baseName} Std'] = statistics.stdev(numList) if len(numList) >= 2 else defaultValue
+    return d
+
+
+def assertAgree(d, reference):
+    assert d.keys() == reference.keys(), (d.keys(), reference.keys())
+    for name, value in reference.items():
+        assert math.isclose(d[name], value, rel_tol=1e-9, abs_tol=1e-12), (name, d[name], value)
+
+
+@timing
+def main():
+    random.seed(0)
+    lists = [[], [5.0], ['1500', '60'], [1.0] * 100]
+    for _ in range(200):
+        n = random.randint(0, 500)
+        lists.append([random.choice([random.uniform(0, 1e-3), random.uniform(40, 1500), 1.6e9 + random.random()])
+                      for _ in range(n)])
+    for numList in lists:
+        reference = referenceMathChar2Dict(dict(), 'Test', numList)
+        assertAgree(addMathChar2Dict(dict(), 'Test', numList), reference)
+        # both kernels, whichever backend is active
+        values = Kernels.floatArray(numList)
+        for kernel in (Kernels._mathCharLoop, Kernels._mathCharNumpy):
+            assertAgree(addMathChar2Dict(dict(), 'Test', None, char=kernel(values)), reference)
+        # Flow = Fwd + Bwd
+        split = len(numList) // 3
+        flowChar = Kernels.mergeMathChar(Kernels.mathChar(values[:split]), Kernels.mathChar(values[split:]))
+        assertAgree(addMathChar2Dict(dict(), 'Test', None, charSum=False, char=flowChar),
+                    referenceMathChar2Dict(dict(), 'Test', numList, charSum=False))
+    # inter-arrival times
+    ts = np.cumsum(np.random.default_rng(0).exponential(0.01, 1000)) + 1.6e9
+    iat = Kernels.firstDifferences(ts)
+    assert list(iat) == [ts[i] - ts[i - 1] for i in range(1, len(ts))]
+    print(f'{len(lists)} Lists Agree ({Kernels.backend} Backend)')
+
+
+if __name__ == '__main__':
+    main(timerPrefix='Total Time Costs: ', timerBeep=False)
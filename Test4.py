@@ -0,0 +1,83 @@
+import random
+
+from NetworkFlowMeter.TicToc import timing
+from NetworkFlowMeter.Flow import iterPackets2flows
+from NetworkFlowMeter.Feature import FeatureExtractor, generateFeatures
+
+
+class FakeLayer(object):
+    """A decoded layer of pyshark: fields are attributes"""
+
+    def __init__(self, layerName, **fields):
+        self.layer_name = layerName
+        self.field_names = list(fields)
+        self.__dict__.update(fields)
+
+    def get_field(self, name):
+        return self.__dict__.get(name)
+
+
+class FakePacket(object):
+    """The parts of a pyshark packet read by sessions, flows and feature extractors"""
+
+    def __init__(self, ts, length, layers):
+        self.sniff_timestamp = f'{ts:.9f}'
+        self.frame_info = FakeLayer('frame_info', len=str(length), time_epoch=self.sniff_timestamp)
+        self.layers = layers
+        for layer in layers:
+            setattr(self, layer.layer_name, layer)
+
+    def __contains__(self, layerName):
+        return any(layer.layer_name.lower() == layerName.lower() for layer in self.layers)
+
+    def __getitem__(self, layerName):
+        for layer in self.layers:
+            if layer.layer_name.lower() == layerName.lower():
+                return layer
+        raise KeyError(layerName)
+
+
+tcpFlagFields = ['flags_ack', 'flags_cwr', 'flags_ecn', 'flags_fin', 'flags_ns', 'flags_push', 'flags_res',
+                 'flags_reset', 'flags_syn', 'flags_urg']
+
+
+def fakePackets(n, seed=0):
+    """TCP and UDP packets between a few IPv6 hosts over 802.15.4, in timestamp order"""
+    rng = random.Random(seed)
+    hosts = [f'fe80::{i}' for i in range(6)]
+    packets, ts = list(), 1600000000.0
+    for _ in range(n):
+        ts += rng.random() * 0.2
+        src, dst = rng.sample(hosts, 2)
+        sport, dport = rng.choice([80, 443, 5683]), rng.choice([80, 443, 5683])
+        layers = [FakeLayer('wpan', src16='0x0001', dst16='0x0002', frame_type='1', seq_no='1')]
+        if rng.random() < 0.5:
+            layers.append(FakeLayer('ipv6', src=src, dst=dst, nxt='6', hlim='64'))
+            layers.append(FakeLayer('tcp', srcport=str(sport), dstport=str(dport), seq='1',
+                                    **{field: str(rng.randint(0, 1)) for field in tcpFlagFields}))
+        else:
+            layers.append(FakeLayer('ipv6', src=src, dst=dst, nxt='17', hlim='64'))
+            layers.append(FakeLayer('udp', srcport=str(sport), dstport=str(dport)))
+        packets.append(FakePacket(ts, rng.randint(40, 120), layers))
+    return packets
+
+
+@timing
+def main():
+    flows = list(iterPackets2flows(fakePackets(3000)))
+    serialFeatureSet, serialNames = generateFeatures(flows)
+    parallelFeatureSet, parallelNames = generateFeatures(flows, workers=2)
+    assert serialNames == parallelNames
+    assert len(serialFeatureSet) == len(parallelFeatureSet) == len(flows)
+    for serialFeatures, parallelFeatures in zip(serialFeatureSet, parallelFeatureSet):
+        assert list(serialFeatures) == list(parallelFeatures)
+        for name, value in serialFeatures.items():
+            # same values and same types (integer defaults of empty directions stay ints)
+            assert parallelFeatures[name] == value, (name, parallelFeatures[name], value)
+            assert type(parallelFeatures[name]) is type(value), (name, parallelFeatures[name], value)
+    columnarExtractors = [extractor.name() for extractor in FeatureExtractor.extractors if extractor.columnar()]
+    print(f'{len(flows)} Flows Agree (Columnar: {", ".join(columnarExtractors)})')
+
+
+if __name__ == '__main__':
+    main(timerPrefix='Total Time Costs: ', timerBeep=False)
@@ -0,0 +1,50 @@
+import copy
+
+from NetworkFlowMeter.TicToc import timing
+from NetworkFlowMeter.Dedup import FrameDeduplicator
+from Test4 import FakeLayer, FakePacket
+
+
+def tcpFrame(ts, seq, ttl=64, analysis=None, timeDelta='0.000000000'):
+    """An IPv4 TCP frame as tshark decodes it, with the fields tshark computes per capture"""
+    tcpFields = dict(srcport='5683', dstport='443', seq=str(seq), ack='1', flags='0x0018', len='10',
+                     payload='01:02:03:04:05:06:07:08:09:0a', time_delta=timeDelta, time_relative=f'{ts:.9f}',
+                     checksum='0x1a2b')
+    if analysis is not None:
+        tcpFields.update(analysis)
+    return FakePacket(ts, 64, [FakeLayer('eth', src='00:00:00:00:00:01', dst='00:00:00:00:00:02', type='0x0800'),
+                               FakeLayer('ip', version='4', len='50', id='0x1234', proto='6', src='10.0.0.1',
+                                         dst='10.0.0.2', ttl=str(ttl), checksum=hex(ttl)),
+                               FakeLayer('tcp', **tcpFields)])
+
+
+def mirroredCopy(p, delay):
+    """The same frame seen again at another mirror point: one hop later, and flagged by tshark's analysis"""
+    q = copy.deepcopy(p)
+    q.sniff_timestamp = f'{float(p.sniff_timestamp) + delay:.9f}'
+    q.frame_info.time_epoch = q.sniff_timestamp
+    q.ip.ttl, q.ip.checksum = '63', '0x3f'
+    q.tcp.field_names.extend(['analysis_retransmission', 'analysis_rto', '_ws_expert'])
+    q.tcp.analysis_retransmission, q.tcp.analysis_rto, q.tcp._ws_expert = '', '0.000020000', 'Retransmission'
+    q.tcp.time_delta = f'{delay:.9f}'
+    return q
+
+
+@timing
+def main():
+    ts = 1600000000.0
+    original = tcpFrame(ts, seq=1)
+    copied = mirroredCopy(original, 0.00002)
+    # same headers, another sequence number: a distinct frame
+    distinct = tcpFrame(ts + 0.00004, seq=11)
+    # the same frame again, after the window: a genuine repetition
+    repeated = tcpFrame(ts + 0.01, seq=1)
+    deduplicator = FrameDeduplicator(window=1000)
+    kept = list(deduplicator.filter([original, copied, distinct, repeated]))
+    assert kept == [original, distinct, repeated], [float(p.sniff_timestamp) - ts for p in kept]
+    assert (deduplicator.packets, deduplicator.removed) == (4, 1)
+    print(deduplicator)
+
+
+if __name__ == '__main__':
+    main(timerPrefix='Total Time Costs: ', timerBeep=False)
@@ -0,0 +1,40 @@
+from NetworkFlowMeter.TicToc import timing
+from NetworkFlowMeter.Context import addContextFeatures
+
+
+def flowRow(ts, src, dst, dstPort):
+    """The items of a flow row read by context features (Ts in microseconds)"""
+    return {'Ts': ts, 'Src IP': src, 'Dst IP': dst, 'Dst Port': dstPort}
+
+
+@timing
+def main():
+    window = 2000000
+    featureSet = addContextFeatures([
+        flowRow(0, 'fe80::1', 'fe80::a', '5683'),
+        flowRow(500000, 'fe80::2', 'fe80::b', '5683'),
+        flowRow(1000000, 'fe80::1', 'fe80::b', '443'),
+        # exactly one window after the first flow: it is still counted
+        flowRow(2000000, 'fe80::3', 'fe80::a', '5683'),
+        # just past one window after the first flow: it has expired
+        flowRow(2000001, 'fe80::1', 'fe80::c', '5683'),
+        # everything before has expired
+        flowRow(5000000, 'fe80::2', 'fe80::a', '5683'),
+    ], window)
+    counts = [(features['Ctx Src Flows'], features['Ctx Dst Flows'],
+               features['Ctx Dst Port Flows'], features['Ctx Dst Port Distinct Srcs'],
+               features['Ctx Svc Flows'], features['Ctx Src Dst Port Flows']) for features in featureSet]
+    assert counts == [
+        (0, 0, 0, 0, 0, 0),
+        (0, 0, 1, 1, 0, 0),
+        (1, 1, 0, 0, 0, 0),
+        (0, 1, 2, 2, 1, 0),
+        # the flow at 0 has expired: port 5683 keeps the flows at 500000 (fe80::2) and 2000000 (fe80::3)
+        (1, 0, 2, 2, 0, 0),
+        (0, 0, 0, 0, 0, 0),
+    ], counts
+    print(f'{len(featureSet)} Flows Agree')
+
+
+if __name__ == '__main__':
+    main(timerPrefix='Total Time Costs: ', timerBeep=False)
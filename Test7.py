@@ -0,0 +1,48 @@
+import numpy as np
+
+from NetworkFlowMeter.TicToc import timing
+from NetworkFlowMeter.Feature import addBidirMathChar2Features
+from NetworkFlowMeter.Quantile import TDigest
+
+
+def rankError(values: np.ndarray, estimate: float, q: float) -> float:
+    """Distance between q and the fraction of values below the estimate"""
+    return abs(np.searchsorted(np.sort(values), estimate) / len(values) - q)
+
+
+@timing
+def main():
+    rng = np.random.default_rng(0)
+    quantiles = (0.5, 0.95)
+    # packet lengths and inter-arrival times of a long flow
+    fwdList = rng.integers(40, 1500, 20000).astype(float)
+    bwdList = rng.exponential(0.01, 5000)
+    for values in (fwdList, bwdList):
+        digest = TDigest().extend(values)
+        assert len(digest.centroids) < 2 * digest.compression
+        for q in quantiles:
+            estimate = digest.quantile(q)
+            assert rankError(values, estimate, q) < 0.01, (q, estimate, np.quantile(values, q))
+            assert np.isclose(estimate, np.quantile(values, q), rtol=0.05), (q, estimate, np.quantile(values, q))
+    # Flow = merge(Fwd, Bwd)
+    flowList = np.concatenate([fwdList, bwdList])
+    flowDigest = TDigest().extend(fwdList).merged(TDigest().extend(bwdList))
+    assert len(flowDigest) == len(flowList)
+    for q in quantiles:
+        assert rankError(flowList, flowDigest.quantile(q), q) < 0.01, (q, flowDigest.quantile(q))
+    # small streams are kept exactly: quantiles are between the neighbouring values, merged or not
+    small = rng.normal(100, 10, 101)
+    smallDigest = TDigest().extend(small[:60]).merged(TDigest().extend(small[60:]))
+    assert len(smallDigest.centroids) == 0
+    assert smallDigest.quantile(0.5) == np.median(small)
+    assert (smallDigest.quantile(0), smallDigest.quantile(1)) == (small.min(), small.max())
+    # quantile columns of the feature extractors
+    features = addBidirMathChar2Features(dict(), 'Pkt Len', fwdList, bwdList, quantiles=quantiles)
+    for direction, values in (('Fwd', fwdList), ('Bwd', bwdList), ('Flow', flowList)):
+        for q, name in zip(quantiles, ('P50', 'P95')):
+            assert rankError(values, features[f'{direction} Pkt Len {name}'], q) < 0.01, (direction, name)
+    print(f'Quantiles {quantiles} Agree')
+
+
+if __name__ == '__main__':
+    main(timerPrefix='Total Time Costs: ', timerBeep=False)
@@ -0,0 +1,60 @@
+import csv
+import struct
+import tempfile
+from pathlib import Path
+
+from NetworkFlowMeter.TicToc import timing
+from NetworkFlowMeter.Batch import batchPcap2csv
+from NetworkFlowMeter.Feature import FeatureExtractor
+from NetworkFlowMeter.BuiltinFeatureExtractors.Bfe3PacketCounter import PacketCounter
+
+
+def udpRecord(ts: float, src: int, dst: int, sport: int, dport: int, payload: bytes) -> bytes:
+    """A pcap record of an Ethernet/IPv4/UDP frame"""
+    udp = struct.pack('>HHHH', sport, dport, 8 + len(payload), 0) + payload
+    ip = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0,
+                     bytes([10, 0, 0, src]), bytes([10, 0, 0, dst])) + udp
+    frame = bytes(6) + bytes(5) + b'\x01' + b'\x08\x00' + ip
+    seconds = int(ts)
+    return struct.pack('<IIII', seconds, round((ts - seconds) * 1e6), len(frame), len(frame)) + frame
+
+
+def writeCapture(path: Path):
+    records = [udpRecord(1600000000 + i * 0.01, 1 + i % 3, 9, 5683, 5683 + i % 2, bytes(i % 50))
+               for i in range(200)]
+    path.write_bytes(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1) + b''.join(records))
+
+
+def csvColumns(path: Path):
+    with open(path, newline='') as csvFile:
+        return next(csv.reader(csvFile))
+
+
+@timing
+def main():
+    with tempfile.TemporaryDirectory() as tmpDir:
+        capturePath = Path(tmpDir) / 'capture.pcap'
+        writeCapture(capturePath)
+        csvPath = capturePath.with_suffix('.csv')
+
+        summaries = batchPcap2csv(capturePath, workers=1)
+        assert [summary['Status'] for summary in summaries] == ['Done'], summaries
+        defaultColumns = csvColumns(csvPath)
+        assert 'Fwd Flag Ack Num' in defaultColumns and 'Fwd Pkt Len P50' not in defaultColumns
+        # nothing has changed
+        assert [summary['Status'] for summary in batchPcap2csv(capturePath, workers=1)] == ['Skipped']
+
+        # a non-default extractor set reaches the workers, and makes the CSV file out of date
+        FeatureExtractor.remove('TcpFlagCounter')
+        FeatureExtractor.remove('PacketCounter')
+        PacketCounter(quantiles=(0.5,))
+        summaries = batchPcap2csv(capturePath, workers=1)
+        assert [summary['Status'] for summary in summaries] == ['Done'], summaries
+        columns = csvColumns(csvPath)
+        assert 'Fwd Flag Ack Num' not in columns and 'Fwd Pkt Len P50' in columns, columns
+        assert [summary['Status'] for summary in batchPcap2csv(capturePath, workers=1)] == ['Skipped']
+        print(f'Extractors Reach Workers: {len(defaultColumns)} => {len(columns)} Columns')
+
+
+if __name__ == '__main__':
+    main(timerPrefix='Total Time Costs: ', timerBeep=False)
@@ -0,0 +1,109 @@
+import ast
+import csv
+import random
+import struct
+import tempfile
+from pathlib import Path
+
+from NetworkFlowMeter.TicToc import timing
+from NetworkFlowMeter.Comprehensive import pcap2csv
+from NetworkFlowMeter.Feature import FeatureExtractor
+
+
+def wpanFrame(seq: int, src: int, dst: int, payload: bytes) -> bytes:
+    """An IEEE 802.15.4 data frame between short addresses of one PAN (PAN ID compression)"""
+    return struct.pack('<HBHHH', 0x8841, seq & 0xff, 0xabcd, dst, src) + payload
+
+
+def linkLocal(shortAddress: int) -> bytes:
+    """fe80::ff:fe00:<short address>"""
+    return bytes.fromhex('fe80000000000000000000fffe00') + struct.pack('>H', shortAddress)
+
+
+def writeCapture(path: Path, n: int, seed: int = 0):
+    """
+    UDP datagrams over 6LoWPAN (uncompressed IPv6) between a few nodes over a few minutes;
+    some are split into a FRAG1 and a FRAGN fragment, between which other frames are captured,
+    so that tshark reassembles them across frames
+    """
+    rng = random.Random(seed)
+    frames, delayed, ts = list(), list(), 1600000000.0
+    for i in range(n):
+        ts += rng.random() * 0.05
+        src, dst = rng.sample(range(1, 6), 2)
+        sport, dport = rng.choice([5683, 5684]), rng.choice([5683, 5684])
+        data = bytes(rng.randrange(256) for _ in range(rng.randint(8, 40)))
+        udp = struct.pack('>HHHH', sport, dport, 8 + len(data), 0) + data
+        datagram = struct.pack('>IHBB', 0x60000000, len(udp), 17, 64) + linkLocal(src) + linkLocal(dst) + udp
+        if rng.random() < 0.1:
+            tag = i & 0xffff
+            frag1 = struct.pack('>HH', 0xc000 | len(datagram), tag) + b'\x41' + datagram[:48]
+            fragN = struct.pack('>HHB', 0xe000 | len(datagram), tag, 48 // 8) + datagram[48:]
+            frames.append((ts, wpanFrame(i, src, dst, frag1)))
+            delayed.append((i + rng.randint(1, 5), wpanFrame(i, src, dst, fragN)))
+        else:
+            frames.append((ts, wpanFrame(i, src, dst, b'\x41' + datagram)))
+        for due, frame in [item for item in delayed if item[0] <= i]:
+            delayed.remove((due, frame))
+            frames.append((ts, frame))
+    frames.extend((ts, frame) for _, frame in delayed)
+    with open(path, 'wb') as f:
+        # LINKTYPE_IEEE802_15_4_NOFCS
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 230))
+        for ts, frame in frames:
+            seconds = int(ts)
+            f.write(struct.pack('<IIII', seconds, round((ts - seconds) * 1e6), len(frame), len(frame)) + frame)
+
+
+def csvRows(path: Path):
+    """The rows of a CSV file; sets (Mac Addr) are compared as sets, as their order depends on string hashing"""
+    with open(path, newline='') as csvFile:
+        return [[ast.literal_eval(cell) if cell.startswith('{') else cell for cell in row]
+                for row in csv.reader(csvFile)]
+
+
+class Interrupt(FeatureExtractor):
+    """Interrupt the extraction (as Ctrl+C does) once a number of flows is finished; it adds no feature"""
+
+    def __init__(self, flows: int):
+        self.flows = None
+        super(Interrupt, self).__init__()
+        self.flows = flows
+
+    def extract(self, flow):
+        if self.flows is not None:
+            self.flows -= 1
+            if self.flows < 0:
+                raise KeyboardInterrupt
+        return dict()
+
+
+@timing
+def main():
+    with tempfile.TemporaryDirectory() as tmpDir:
+        capturePath, checkpointPath = Path(tmpDir) / 'capture.pcap', Path(tmpDir) / 'capture.checkpoint'
+        writeCapture(capturePath, 3000)
+        settings = dict(flowTimeout=1000000, activityTimeout=500000)
+
+        referencePath = Path(tmpDir) / 'reference.csv'
+        pcap2csv(capturePath, referencePath, **settings)
+
+        resumedPath = Path(tmpDir) / 'resumed.csv'
+        for flows in (200, 150):
+            Interrupt(flows)
+            try:
+                pcap2csv(capturePath, resumedPath, checkpointPath=checkpointPath, checkpointInterval=100,
+                         resume=checkpointPath.exists(), **settings)
+                raise Exception('The extraction was not interrupted')
+            except KeyboardInterrupt:
+                assert checkpointPath.exists()
+            FeatureExtractor.remove('Interrupt')
+        pcap2csv(capturePath, resumedPath, checkpointPath=checkpointPath, checkpointInterval=100, resume=True,
+                 **settings)
+        assert not checkpointPath.exists()
+        assert csvRows(resumedPath) == csvRows(referencePath)
+        print('Resumed CSV Matches the Uninterrupted One')
+
+
+if __name__ == '__main__':
+    main(timerPrefix='Total Time Costs: ', timerBeep=False)